@@ -21,8 +21,6 @@ with open('data/methylation/beta_vals_no_context.bed', 'r') as f:
         split = [i.rstrip() for i in line.split('\t')]
         chrom, c_pos, beta = str(split[0]), int(split[1]), float(split[3])
 
-        p = antr.Reader(table).fetch(chrom, c_pos, c_pos + 1, raw = True)
-
-        for record in p:
+        for record in p.fetch(chrom, c_pos, c_pos + 1, raw = True):
             record = record + '\t' + str(beta)
             print(record)
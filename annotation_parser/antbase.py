@@ -0,0 +1,645 @@
+'''
+Schema-driven parser for the annotation tables - the shared code behind ant.py, antr.py and antm.py.
+
+Rather than each parser hardcoding its number of columns and unpacking every row by hand,
+the column layout is read off the table header once, and compiled into a tuple of
+converter functions - one per column - and a record class with an attribute for each
+(see recordclass). Records only hold the split row, and convert fields as they're used.
+
+Column types are decided as follows:
+- the first 32 columns are the base annotation table, and use the parser's base layout
+(BASE_COLUMNS, or ANT_COLUMNS for the original table read by ant.py)
+- any further column that the parser knows about (ld_rho, methylation - see EXTRA_COLUMNS)
+uses its usual converter
+- any other column is typed from its ##name=description [TYPE] header line (TYPE being
+BOOL, INT, FLOAT, STR or LIST - see TYPES), or left as a string if it has none
+
+so the same code reads the 32, 33 and 34 column tables, and any other columns added on later.
+
+For whole regions at once, Reader.fetch_columns() returns columns as NumPy arrays instead
+of records, and windowsums() adds them up in windows:
+p = antr.Reader('file.txt.gz')
+cols = p.fetch_columns('chromosome_1', 0, 1000000, columns = ['pos', 'is_genic', 'ld_rho'])
+edges = np.arange(0, 1000001, 10000) # 10 kb windows
+genic_count = windowsums(cols['pos'], cols['is_genic'], edges)
+
+If the table has a binary sidecar (table + '.cols', made by antcols.py), Reader uses it
+instead of the text table for records and fetch_columns() - see Sidecar.
+
+Usage:
+import antr # or ant/antm, which use this module
+parser = antr.Reader('file.txt.gz') # file should have equivalent .tbi index
+chr15_genic = [r for r in parser.fetch('chromosome_15') if r.is_genic]
+
+AH - 11/2017
+'''
+
+import os
+import re
+import gzip
+import ast
+import json
+import itertools
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+def tobool(ob):
+    '''1 -> True, 0 or . -> False, anything else -> None.'''
+    if ob in [0, '0', '.']:
+        return False
+    elif ob == 1 or ob == '1':
+        return True
+
+def toint(ob):
+    '''int, or 'NA' if missing/not a number.'''
+    if ob == '.':
+        return 'NA'
+    try:
+        return int(ob)
+    except ValueError:
+        return 'NA'
+
+def tofloat(ob):
+    '''float, or 'NA' if missing/not a number.'''
+    try:
+        return float(ob)
+    except ValueError:
+        return 'NA'
+
+def tostr(ob):
+    return str(ob)
+
+def toalleles(ob):
+    '''quebec_alleles - colon separated allele counts, ie 3:0:1 -> [3, 0, 1]'''
+    return [int(i) for i in str(ob).split(':')]
+
+@lru_cache(maxsize = 65536)
+def _literal(ob):
+    return ast.literal_eval(ob)
+
+def toliteral(ob):
+    '''Python literal (ie a list of feature names). The same few strings ('[]' and so on)
+    come up on most rows, so parsed values are cached - lists are copied on the way out
+    so that records don't share them.
+    '''
+    value = _literal(ob)
+    return list(value) if isinstance(value, list) else value
+
+TYPES = {'BOOL': tobool,
+         'INT': toint,
+         'FLOAT': tofloat,
+         'STR': tostr,
+         'LIST': toliteral}
+
+# (record attribute, converter) for each of the base annotation table's columns, in order
+BASE_COLUMNS = (('chrom', tostr),
+                ('pos', toint),
+                ('ref', tostr),
+                ('is_genic', tobool),
+                ('is_exonic', tobool),
+                ('is_intronic', tobool),
+                ('is_intergenic', tobool),
+                ('is_utr5', tobool),
+                ('is_utr3', tobool),
+                ('is_fold0', tobool),
+                ('is_fold4', tobool),
+                ('is_fold2', tobool),
+                ('is_fold3', tobool),
+                ('is_in_CDS', tobool),
+                ('is_in_mRNA', tobool),
+                ('is_rRNA', tobool),
+                ('is_tRNA', tobool),
+                ('feature_names', toliteral),
+                ('feature_types', toliteral),
+                ('feature_ID', tostr),
+                ('cds_position', toint),
+                ('strand', tostr),
+                ('frame', toint),
+                ('codon', tostr),
+                ('aa', tobool),
+                ('degeneracy', toint),
+                ('FPKM', tofloat),
+                ('map_rho', tofloat),
+                ('FAIRE', tofloat),
+                ('recombination', tofloat),
+                ('mutability', tofloat),
+                ('quebec_alleles', toalleles))
+
+# as above, but with the attribute names + types used by ant.py for the original table
+ANT_COLUMNS = BASE_COLUMNS[:27] + (('rho', tofloat),
+                                   ('FAIRE', tofloat),
+                                   ('map_rho', tofloat),
+                                   ('mutability', tofloat),
+                                   ('quebec_alleles', list))
+
+# columns appended to the base table (by column name)
+EXTRA_COLUMNS = {'ld_rho': tofloat, # add_ld_rho.py
+                 'methylation': toliteral} # add_rho_meth_context.py
+
+INT_NA = int(np.iinfo(np.int32).min) # missing values in INT columns from fetch_columns() (-1 is real data)
+
+def _columnarray(values, convert, floattype = np.float32):
+    '''Helper function - converts a list of strings from one column into an array, based on
+    the column's converter. BOOL -> bool, INT -> int32 (INT_NA if missing), FLOAT -> floattype
+    (NaN if missing), and anything else -> object array of converted values.
+    '''
+    values = np.array(values, dtype = str)
+    if convert is tobool:
+        return values == '1'
+    elif convert is tofloat:
+        out = np.full(len(values), np.nan, dtype = floattype)
+        ok = (values != 'NA') & (values != '.')
+        try:
+            out[ok] = values[ok].astype(floattype)
+        except ValueError: # something else unparseable - go one at a time
+            out = np.array([np.nan if v == 'NA' else v for v in map(tofloat, values)], dtype = floattype)
+        return out
+    elif convert is toint:
+        out = np.full(len(values), INT_NA, dtype = np.int32)
+        ok = (values != '.')
+        try:
+            out[ok] = values[ok].astype(np.int32)
+        except ValueError:
+            out = np.array([INT_NA if v == 'NA' else v for v in map(toint, values)], dtype = np.int32)
+        return out
+    out = np.empty(len(values), dtype = object)
+    for i, value in enumerate(values.tolist()):
+        out[i] = convert(value)
+    return out
+
+def windowsums(positions, values, edges):
+    '''Sums values (bools are counted) in windows along a chromosome, using np.add.reduceat
+    (floats are summed as float64).
+    positions must be sorted, and window i covers edges[i] < pos <= edges[i + 1] - the same
+    positions as fetch(chrom, edges[i], edges[i + 1]). Empty windows sum to 0.
+    '''
+    values = np.asarray(values)
+    if values.dtype == bool:
+        values = values.astype(np.int64)
+    bounds = np.searchsorted(positions, edges, side = 'right')
+    starts, ends = bounds[:-1], bounds[1:]
+    # reduceat sums from each index to the next, so interleave window starts + ends and keep
+    # every other sum - padded with a 0 so that an end can be one past the last value
+    padded = np.append(values, np.zeros(1, dtype = values.dtype))
+    dtype = np.float64 if values.dtype.kind == 'f' else None # add up floats in double precision
+    sums = np.add.reduceat(padded, np.column_stack([starts, ends]).ravel(), dtype = dtype)[::2]
+    sums[starts == ends] = 0
+    return sums
+
+def headertypes(header):
+    '''Returns {column name: TYPE} for the ##name=description [TYPE] lines in header.'''
+    types = {}
+    for line in header:
+        match = re.match(r'##([^=]+)=.*\[(\w+)\]\s*$', line)
+        if match and match.group(2).upper() in TYPES:
+            types[match.group(1)] = match.group(2).upper()
+    return types
+
+def compileschema(cols, header, base = BASE_COLUMNS):
+    '''Returns (attribute names, converters) as two tuples, one entry per column in cols.'''
+    types = headertypes(header)
+    names, converters = [], []
+    for i, col in enumerate(cols):
+        col = col.strip()
+        if i < len(base):
+            name, converter = base[i]
+        elif col in EXTRA_COLUMNS:
+            name, converter = col, EXTRA_COLUMNS[col]
+        else:
+            name, converter = col, TYPES.get(types.get(col), tostr)
+        names.append(name)
+        converters.append(converter)
+    return tuple(names), tuple(converters)
+
+class _Record(object):
+    '''A record object - stores all information at a single row in the annotation table.
+
+    Only the split row is kept - each field is converted when it's first asked for (see
+    recordclass), as most scripts only look at a couple of fields.
+    '''
+    __slots__ = ('_row',)
+    _fields = ()
+
+    def __init__(self, row):
+        self._row = row
+
+    def __dir__(self):
+        # just the columns - scripts look up attributes by name in dir(record) (see attr_fetch)
+        return list(self._fields)
+
+def _field(index, convert):
+    '''Helper function - attribute converting column index on every access.'''
+    return property(lambda self: convert(self._row[index]))
+
+def _cachedfield(index, convert, slot):
+    '''Helper function - attribute converting column index on first access and
+    keeping the result in slot.'''
+    def get(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = convert(self._row[index])
+            setattr(self, slot, value)
+            return value
+    return property(get)
+
+def recordclass(names, converters):
+    '''Returns a _Record subclass with one attribute per column (see compileschema).
+    Fields that are costly to convert (LIST columns - feature_names, feature_types,
+    methylation) are cached on the record after their first access, and the rest are
+    converted on every access.
+    '''
+    attributes = {}
+    slots = []
+    for index, (name, convert) in enumerate(zip(names, converters)):
+        if convert is toliteral:
+            slot = '_cached_' + name
+            slots.append(slot)
+            attributes[name] = _cachedfield(index, convert, slot)
+        else:
+            attributes[name] = _field(index, convert)
+    attributes['__slots__'] = tuple(slots)
+    attributes['_fields'] = tuple(names)
+    return type('_Record', (_Record,), attributes)
+
+# per process caches, so that Readers are cheap to make and can share open files
+_tabixhandles = {} # (filename, pid): pysam.TabixFile
+_headers = {} # (filename, mtime): (cols, header)
+_schemas = {} # (cols, header, base): (names, converters, record class, sidecar record class)
+_sidecars = {} # (path, mtime): Sidecar
+
+def tabixhandle(filename):
+    '''Returns an open pysam.TabixFile for filename, shared by everything in this process
+    (forked processes get their own, as the key includes the pid).'''
+    if not pysam:
+        raise Exception('Error: pysam not installed.')
+    key = (filename, os.getpid())
+    if key not in _tabixhandles:
+        _tabixhandles[key] = pysam.TabixFile(filename)
+    return _tabixhandles[key]
+
+def sidecarpath(filename):
+    '''Returns the path of the binary sidecar for an annotation table (see antcols.py).'''
+    return filename + '.cols'
+
+def columnkind(index, convert):
+    '''How a column is stored in the sidecar - chrom (implicit), pos, flag (a bit in the
+    flags word), float (float32 or float64), int (int32) or dict (dictionary-encoded strings).'''
+    if index == 0:
+        return 'chrom'
+    elif index == 1:
+        return 'pos'
+    elif convert is tobool:
+        return 'flag'
+    elif convert is tofloat:
+        return 'float'
+    elif convert is toint:
+        return 'int'
+    return 'dict'
+
+def _same(ob):
+    return ob
+
+def _shortest(values):
+    '''Helper function - float32 array to float64, with each value read back through its
+    shortest repr (ie 0.004, not 0.004000000189989805) - the value the text table holds.
+    Done once per distinct value, as most float columns hold long runs of the same value.'''
+    unique, inverse = np.unique(values, return_inverse = True)
+    decoded = np.array([float(str(v)) for v in unique], dtype = np.float64)
+    return decoded[inverse.ravel()]
+
+def _floatlist(values):
+    '''Helper function - float32/float64 array to a list of floats with 'NA' for NaN.'''
+    if values.dtype == np.float32:
+        values = _shortest(values)
+    return ['NA' if v != v else v for v in values.tolist()]
+
+class Sidecar(object):
+    '''Reader for the binary columnar sidecar of an annotation table (made by antcols.py).
+
+    The sidecar is a directory (table + '.cols') holding schema.json - the table's header
+    and columns, how each column is stored, and the dictionaries for string columns - and
+    a subdirectory of .npy arrays per chromosome:
+    pos.npy - positions, unless they run 1, 2, 3... (then only the first is kept)
+    flags.npy - all BOOL columns, one bit each
+    [column index].npy - float32 for FLOAT columns (float64 on chromosomes where any value
+    doesn't survive the trip through float32), int32 for INT columns (INT_NA if
+    missing), dictionary codes for everything else (and for any BOOL column with values
+    other than 0/1/. on that chromosome, so that records still match the text table)
+    [column index].na.npy - which rows of an INT column are missing, if any are on that
+    chromosome
+
+    Arrays are memory-mapped, so a region is a slice of each. Records and fetch_columns()
+    give the same values as from the text table.
+    '''
+    blocksize = 100000 # records are built this many rows at a time
+    format = 4 # sidecars of any other format are ignored - see load()
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'schema.json')) as f:
+            schema = json.load(f)
+        self.path = path
+        self.cols = schema['cols']
+        self.header = schema['header']
+        self.kinds = schema['kinds']
+        self.flagbits = {int(i): bit for i, bit in schema['flagbits'].items()}
+        self.vocab = {int(i): np.array(words, dtype = object) for i, words in schema['vocab'].items()}
+        self.chroms = OrderedDict((chrom['name'], chrom) for chrom in schema['chroms'])
+        self.format = schema.get('format', 1)
+        self._arrays = {}
+
+    @classmethod
+    def load(cls, filename):
+        '''Returns the Sidecar for an annotation table, or None if it has none (or the
+        table has changed since it was made, or it was made by an older antcols.py).'''
+        schemafile = os.path.join(sidecarpath(filename), 'schema.json')
+        if not os.path.exists(schemafile) or os.path.getmtime(schemafile) < os.path.getmtime(filename):
+            return None
+        key = (sidecarpath(filename), os.path.getmtime(schemafile))
+        if key not in _sidecars:
+            _sidecars[key] = cls(sidecarpath(filename))
+        if _sidecars[key].format != cls.format:
+            return None
+        return _sidecars[key]
+
+    def matches(self, converters):
+        '''Whether columns with these converters (see compileschema) are stored as expected.'''
+        return self.kinds == [columnkind(i, convert) for i, convert in enumerate(converters)]
+
+    def _array(self, chrom, key):
+        if (chrom, key) not in self._arrays:
+            filename = os.path.join(self.path, chrom, '{0}.npy'.format(key))
+            self._arrays[(chrom, key)] = np.load(filename, mmap_mode = 'r')
+        return self._arrays[(chrom, key)]
+
+    def _rows(self, chrom, start = None, end = None):
+        '''Returns (first row, last row + 1, positions) for the rows of chrom with
+        start < pos <= end - the same as a tabix fetch.'''
+        if chrom not in self.chroms:
+            raise ValueError('could not create iterator for region {0}:{1}-{2}'.format(chrom, start, end))
+        info = self.chroms[chrom]
+        n = info['n']
+        if info['first'] is not None: # positions implicit
+            first = info['first']
+            i0 = 0 if start is None else min(max(int(start) + 1 - first, 0), n)
+            i1 = n if end is None else min(max(int(end) + 1 - first, i0), n)
+            return i0, i1, np.arange(first + i0, first + i1, dtype = np.int32)
+        positions = self._array(chrom, 'pos')
+        i0 = 0 if start is None else int(np.searchsorted(positions, start, side = 'right'))
+        i1 = n if end is None else max(int(np.searchsorted(positions, end, side = 'right')), i0)
+        return i0, i1, np.array(positions[i0:i1])
+
+    def _strings(self, chrom, i, i0, i1):
+        '''Helper function - the raw strings of dictionary-encoded column i.'''
+        return self.vocab[i][self._array(chrom, str(i))[i0:i1]]
+
+    def _flags(self, chrom, i, i0, i1):
+        '''Helper function - BOOL column i as a bool array.'''
+        return ((self._array(chrom, 'flags')[i0:i1] >> self.flagbits[i]) & 1).astype(bool)
+
+    def columns(self, chrom, start, end, indices, converters, floattype = np.float32):
+        '''Returns arrays for the columns in indices, in the same form as fetch_columns().'''
+        i0, i1, positions = self._rows(chrom, start, end)
+        out = []
+        for i in indices:
+            kind = self.kinds[i]
+            if kind == 'chrom':
+                values = np.empty(i1 - i0, dtype = object)
+                values[:] = converters[i](chrom)
+            elif kind == 'pos':
+                values = positions
+            elif kind == 'flag':
+                values = self._flags(chrom, i, i0, i1)
+            elif kind == 'float':
+                stored = self._array(chrom, str(i))[i0:i1]
+                if stored.dtype == np.float32 and np.dtype(floattype).itemsize > 4: # widen as the text would parse
+                    values = _shortest(stored).astype(floattype)
+                else:
+                    values = stored.astype(floattype)
+            elif kind == 'int':
+                values = np.array(self._array(chrom, str(i))[i0:i1])
+            else:
+                values = np.empty(i1 - i0, dtype = object)
+                for j, value in enumerate(self._strings(chrom, i, i0, i1).tolist()):
+                    values[j] = converters[i](value)
+            out.append(values)
+        return out
+
+    def records(self, chrom, start, end, record):
+        '''Returns an iterator of records (instances of record - see Reader) in a region.'''
+        i0, i1, positions = self._rows(chrom, start, end)
+        return self._records(chrom, i0, i1, positions, record)
+
+    def _records(self, chrom, i0, i1, positions, record):
+        rawflags = set(self.chroms[chrom]['rawflags'])
+        intna = set(self.chroms[chrom]['intna'])
+        for b0 in range(i0, i1, self.blocksize):
+            b1 = min(b0 + self.blocksize, i1)
+            columns = []
+            for i, kind in enumerate(self.kinds):
+                if kind == 'chrom':
+                    columns.append(itertools.repeat(chrom, b1 - b0))
+                elif kind == 'pos':
+                    columns.append(positions[b0 - i0:b1 - i0].tolist())
+                elif kind == 'flag' and i in rawflags:
+                    columns.append([tobool(value) for value in self._strings(chrom, i, b0, b1).tolist()])
+                elif kind == 'flag':
+                    columns.append(self._flags(chrom, i, b0, b1).tolist())
+                elif kind == 'float':
+                    columns.append(_floatlist(self._array(chrom, str(i))[b0:b1]))
+                elif kind == 'int' and i in intna:
+                    missing = self._array(chrom, '{0}.na'.format(i))[b0:b1].tolist()
+                    columns.append(['NA' if na else v for v, na in zip(self._array(chrom, str(i))[b0:b1].tolist(), missing)])
+                elif kind == 'int':
+                    columns.append(self._array(chrom, str(i))[b0:b1].tolist())
+                else:
+                    columns.append(self._strings(chrom, i, b0, b1).tolist())
+            for row in zip(*columns):
+                yield record(row)
+
+class Reader(object):
+    '''The actual parser.
+
+    Usage:
+    import antr
+    parser = antr.Reader([annotation table filename])
+    records = [r for r in parser]
+
+    If file is compressed + tabix-indexed, can also use .fetch():
+    chr1_start = [r for r in parser.fetch('chromosome_1', start = 0, end = 50)]
+
+    Fetch uses tabix's half-open (?) indexing. (ie start = 0 and end = 3 corresponds to getting 1, 2, and 3).
+
+    Can set raw = True when initializing parser object to get raw lines instead of _Record objects.
+
+    If the table has an up to date binary sidecar (see antcols.py), records and fetch_columns()
+    come from it instead of the text - set sidecar = False to always read the text.
+
+    Readers are cheap to make - the header is only read once per file, and tabix handles are
+    shared within a process (see tabixhandle) - but it's best to make one per table and reuse
+    it, as each fetch() is independent:
+    parser = antr.Reader('file.txt.gz')
+    for start, end in windows:
+        genic = [r for r in parser.fetch('chromosome_1', start, end) if r.is_genic]
+    '''
+    base = BASE_COLUMNS # layout of the first columns - see compileschema
+    eagerlimit = 100000 # regions up to this size (bp) are read in on fetch - see _fetchlines
+    columnchunk = 100000 # lines parsed at a time by fetch_columns (text table only)
+
+    def __init__(self, filename = None, compressed = None, raw = False, sidecar = True):
+
+        if not filename:
+            raise Exception('Error: filename not provided.')
+        self.filename = filename
+        if compressed is None:
+            compressed = filename.endswith('.gz')
+        self._compressed = compressed
+
+        # binary sidecar, if there is one (see Sidecar) - not used for raw lines
+        self._sidecar = Sidecar.load(filename) if sidecar and not raw else None
+        if self._sidecar is not None:
+            self.cols = list(self._sidecar.cols)
+            self.header = list(self._sidecar.header)
+            self._compile()
+            if not self._sidecar.matches(self._converters):
+                self._sidecar = None
+        if self._sidecar is not None:
+            self.reader = (record for chrom in self._sidecar.chroms
+                for record in self._sidecar.records(chrom, None, None, self._sidecarrecord))
+            return
+
+        # header is only read once per file (see _readheader)
+        key = (filename, os.path.getmtime(filename))
+        if key not in _headers:
+            _headers[key] = self._readheader()
+        cols, header = _headers[key]
+        self.cols, self.header = list(cols), list(header) # copies - scripts add to these
+        self._compile()
+
+        # generator without header - the file is only opened once iterated over
+        if not raw:
+            self.reader = (self._line_to_rec(line) for line in self._lines())
+        elif raw:
+            self.reader = self._lines() # lines as strings, not records
+
+    def _textfile(self):
+        '''Opens the text table - returns a generator of lines (as strings).'''
+        if self._compressed:
+            f = gzip.GzipFile(fileobj = open(self.filename, 'rb'))
+            return (line.decode('utf-8') for line in f) # gzipped obj returns lines as bytes objs
+        return (line for line in open(self.filename, 'rt'))
+
+    def _readheader(self):
+        '''Reads in the header - returns (column names, list of ## lines).'''
+        reader = self._textfile()
+        line = next(reader)
+        header = []
+        header.append(line)
+        while line.startswith('##'):
+            line = next(reader)
+            if line.startswith('#chromosome'):
+                break
+            else:
+                header.append(line)
+
+        assert line.startswith('#chromosome') # make sure header has been completely read in
+        return line.split('#')[1].split('\t'), header # get column names
+
+    def _lines(self):
+        '''Generator of the lines in the table after the header.'''
+        for line in self._textfile():
+            if not line.startswith('#'):
+                yield line
+
+    def _compile(self):
+        '''Compiles the column schema + record classes from self.cols and self.header
+        (once per distinct header - see _schemas).'''
+        key = (tuple(self.cols), tuple(self.header), self.base)
+        if key not in _schemas:
+            names, converters = compileschema(self.cols, self.header, self.base)
+            # sidecar rows come typed, apart from dictionary-encoded columns
+            sidecarconverters = [convert if columnkind(i, convert) == 'dict' else _same
+                for i, convert in enumerate(converters)]
+            _schemas[key] = (names, converters, recordclass(names, converters),
+                             recordclass(names, sidecarconverters))
+        self._names, self._converters, self._record, self._sidecarrecord = _schemas[key]
+
+    def _line_to_rec(self, line):
+        '''Converts lines in annotation table to Record objects.'''
+        row = line.rstrip().split('\t')
+        assert len(row) == len(self._converters)
+        return self._record(row)
+
+    def __iter__(self):
+        return self.reader
+
+    def metadata(self): # parser.metadata returns column names
+        return self.cols
+
+    def fields(self): # parser.fields returns record attribute names (ie for fetch_columns)
+        return list(self._names)
+
+    def head(self): # parser.head returns entire header
+        return self.header
+
+    def next(self):
+        '''Return next record in file.'''
+        return self._line_to_rec(next(self.reader))
+
+    def fetch(self, chrom, start = None, end = None, raw = False):
+        '''Returns an iterable of _Record instances. Tabix file needs to have been made using
+        the vcf preset. If raw = True, returns raw lines.
+
+        Each call returns its own iterator - the Reader can be reused for any number of
+        fetches, including nested ones (ie fetching around each record of another fetch).
+        '''
+        if self._sidecar is not None and not raw:
+            return self._sidecar.records(chrom, start, end, self._sidecarrecord)
+        lines = self._fetchlines(chrom, start, end)
+        if raw:
+            return lines
+        return (self._line_to_rec(line) for line in lines)
+
+    def _fetchlines(self, chrom, start = None, end = None):
+        '''Iterator of raw lines in a region, independent of any other. Small regions are read
+        in straight away from the shared tabix handle, and larger ones get their own handle.
+        '''
+        tabix = tabixhandle(self.filename)
+        if start is not None and end is not None and end - start <= self.eagerlimit:
+            return iter(list(tabix.fetch(chrom, start, end)))
+        return tabix.fetch(chrom, start, end, multiple_iterators = True)
+
+    def fetch_columns(self, chrom, start = None, end = None, columns = None, floattype = np.float32):
+        '''Returns {column: array} for every row in a region (same coordinates as fetch()),
+        for the columns (record attribute names - ie pos, is_genic, ld_rho) in columns, or
+        all columns if None. Positions and other INT columns are int32 (INT_NA if missing),
+        flags are bool arrays, FLOAT columns are floattype with NaN for NA, and anything
+        else is an object array - see _columnarray.
+        '''
+        if columns is None:
+            columns = self._names
+        index = {name: i for i, name in enumerate(self._names)}
+        for column in columns:
+            if column not in index:
+                raise KeyError('{0} is not a column - must be one of {1}'.format(column, self._names))
+        if self._sidecar is not None:
+            return OrderedDict(zip(columns, self._sidecar.columns(chrom, start, end,
+                [index[column] for column in columns], self._converters, floattype)))
+        # text is parsed columnchunk lines at a time, keeping only the columns asked for -
+        # so a whole chromosome is never held in memory as split rows
+        lines = tabixhandle(self.filename).fetch(chrom, start, end)
+        chunks = OrderedDict((column, []) for column in columns)
+        while True:
+            block = [line.rstrip().split('\t') for line in itertools.islice(lines, self.columnchunk)]
+            for column in columns:
+                i = index[column]
+                chunks[column].append(_columnarray([row[i] for row in block], self._converters[i], floattype))
+            if len(block) < self.columnchunk: # end of region
+                break
+        return OrderedDict((column, np.concatenate(arrays)) for column, arrays in chunks.items())
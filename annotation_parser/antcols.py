@@ -0,0 +1,146 @@
+'''
+Converts an annotation table into its binary columnar sidecar (see antbase.Sidecar).
+
+The text table has one row per base and is decompressed, split and typed all over again
+every time it's read. The sidecar stores each column as a memory-mappable array per
+chromosome instead - BOOL columns packed into one flags word, FLOAT columns as float32
+(or float64 on chromosomes where float32 would change any value), INT columns as int32 (with a mask of missing rows where there are any), and string/list
+columns (feature_names etc) dictionary-encoded - so that region queries are just slices
+of each array.
+
+Once made, the sidecar (table + '.cols') is used automatically by ant/antr/antm.Reader for
+records and fetch_columns(), unless the table is newer than it. Raw lines still come from
+the text table.
+
+usage:
+python3.5 antcols.py -t [table (.txt.gz)]
+
+add -o [directory] to write the sidecar elsewhere (it will then only be used if moved to
+table + '.cols')
+'''
+
+import os
+import json
+import argparse
+import itertools
+import numpy as np
+from tqdm import tqdm
+from antbase import Reader, Sidecar, compileschema, columnkind, sidecarpath, _columnarray, _shortest, tofloat, toint, INT_NA
+
+def _codes(values, words):
+    '''Helper function - dictionary codes for values, adding new values to words.'''
+    return np.array([words.setdefault(value, len(words)) for value in values], dtype = np.uint32)
+
+def _smallest(codes, numwords):
+    '''Helper function - casts dictionary codes to the smallest dtype that fits.'''
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if numwords <= np.iinfo(dtype).max + 1:
+            return codes.astype(dtype)
+
+def _missing(values, column):
+    '''Helper function - bool array of which values of an INT column are missing (only
+    rows holding INT_NA are checked).'''
+    missing = np.zeros(len(values), dtype = bool)
+    candidates = np.flatnonzero(column == INT_NA)
+    missing[candidates] = [toint(values[j]) == 'NA' for j in candidates.tolist()]
+    return missing
+
+def writechrom(path, chrom, kinds, flagcols, chunks, vocab, missing):
+    '''Writes the arrays for one chromosome. chunks is {column index: list of arrays}, and
+    missing {INT column index: list of missing masks}. Returns the chromosome's schema entry.'''
+    os.makedirs(os.path.join(path, chrom), exist_ok = True)
+    arrays = {i: np.concatenate(chunk) for i, chunk in chunks.items()}
+    positions = arrays[1]
+    n = len(positions)
+    info = {'name': chrom, 'n': n, 'first': None, 'rawflags': [], 'intna': []}
+
+    if n and np.array_equal(positions, np.arange(positions[0], positions[0] + n)):
+        info['first'] = int(positions[0]) # implicit
+    else:
+        np.save(os.path.join(path, chrom, 'pos.npy'), positions)
+
+    flags = np.zeros(n, dtype = np.uint32 if len(flagcols) <= 32 else np.uint64)
+    for bit, i in enumerate(flagcols):
+        words = list(vocab[i])
+        isset = np.array([word == '1' for word in words], dtype = bool)
+        flags |= isset[arrays[i]].astype(flags.dtype) << flags.dtype.type(bit)
+        if any(words[code] not in ('0', '1', '.') for code in np.unique(arrays[i]).tolist()):
+            # not a plain flag here - keep the values too, so records still match the text
+            info['rawflags'].append(i)
+            np.save(os.path.join(path, chrom, '{0}.npy'.format(i)), _smallest(arrays[i], len(words)))
+    np.save(os.path.join(path, chrom, 'flags.npy'), flags)
+
+    for i, kind in enumerate(kinds):
+        if kind == 'float':
+            # float32 only if every value reads back the same as from the text
+            narrow = arrays[i].astype(np.float32)
+            exact = np.array_equal(_shortest(narrow), arrays[i], equal_nan = True)
+            np.save(os.path.join(path, chrom, '{0}.npy'.format(i)), narrow if exact else arrays[i])
+        elif kind == 'int':
+            np.save(os.path.join(path, chrom, '{0}.npy'.format(i)), arrays[i])
+        elif kind == 'dict':
+            np.save(os.path.join(path, chrom, '{0}.npy'.format(i)), _smallest(arrays[i], len(vocab[i])))
+
+    for i, masks in missing.items():
+        mask = np.concatenate(masks)
+        if mask.any():
+            info['intna'].append(i)
+            np.save(os.path.join(path, chrom, '{0}.na.npy'.format(i)), mask)
+    return info
+
+def antcols(table, path = None, chunksize = 1000000):
+    '''Converts table into a binary sidecar at path (default table + '.cols').'''
+    path = path or sidecarpath(table)
+    reader = Reader(table, raw = True, sidecar = False)
+    names, converters = compileschema(reader.cols, reader.header)
+    kinds = [columnkind(i, convert) for i, convert in enumerate(converters)]
+    flagcols = [i for i, kind in enumerate(kinds) if kind == 'flag']
+    if len(flagcols) > 64:
+        raise ValueError('too many BOOL columns to pack into a flags word ({0})'.format(len(flagcols)))
+    vocab = {i: {} for i, kind in enumerate(kinds) if kind in ('flag', 'dict')}
+    os.makedirs(path, exist_ok = True)
+
+    chroms = []
+    for chrom, lines in itertools.groupby(reader, key = lambda line: line.split('\t', 1)[0]):
+        chunks = {i: [] for i, kind in enumerate(kinds) if kind != 'chrom'}
+        missing = {i: [] for i, kind in enumerate(kinds) if kind == 'int'}
+        lines = iter(lines)
+        for chunk in tqdm(iter(lambda: list(itertools.islice(lines, chunksize)), []), desc = chrom):
+            rows = [line.rstrip().split('\t') for line in chunk]
+            for row in rows:
+                assert len(row) == len(kinds)
+            for i in chunks:
+                values = [row[i] for row in rows]
+                if kinds[i] == 'pos':
+                    chunks[i].append(_columnarray(values, toint))
+                elif kinds[i] == 'int':
+                    chunks[i].append(_columnarray(values, toint))
+                    missing[i].append(_missing(values, chunks[i][-1]))
+                elif kinds[i] == 'float':
+                    chunks[i].append(_columnarray(values, tofloat, np.float64))
+                else:
+                    chunks[i].append(_codes(values, vocab[i]))
+        chroms.append(writechrom(path, chrom, kinds, flagcols, chunks, vocab, missing))
+
+    schema = {'format': Sidecar.format,
+              'cols': reader.cols,
+              'header': reader.header,
+              'kinds': kinds,
+              'flagbits': {str(i): bit for bit, i in enumerate(flagcols)},
+              'vocab': {str(i): list(words) for i, words in vocab.items()},
+              'chroms': chroms}
+    with open(os.path.join(path, 'schema.json'), 'w') as f: # written last - marks the sidecar as complete
+        json.dump(schema, f)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert an annotation table into a binary columnar sidecar.',
+                                    usage = 'antcols.py [options]')
+    parser.add_argument('-t', '--table', required = True,
+                       type = str, help = 'Annotation table file (.txt.gz)')
+    parser.add_argument('-o', '--out', required = False,
+                       type = str, help = 'Output directory. Optional - defaults to [table].cols')
+    parser.add_argument('-c', '--chunksize', required = False, default = 1000000,
+                       type = int, help = 'Rows converted at a time [default 1000000]')
+    args = parser.parse_args()
+
+    antcols(args.table, args.out, args.chunksize)
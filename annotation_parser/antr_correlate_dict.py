@@ -79,19 +79,18 @@ def attr_fetch(rec, attribute):
     out = getattr(rec, rec_attr)
     return out
 
-def gc_calc(chromosome, window, table):
-    '''Returns GC content in given window as proportion.'''
-    seq = ''.join([record.ref for record in antr.Reader(table).fetch(chromosome, window[0], window[1])])
+def gc_calc(chromosome, window, p):
+    '''Returns GC content in given window as proportion. p is an antr.Reader.'''
+    seq = ''.join([record.ref for record in p.fetch(chromosome, window[0], window[1])])
     total = len(seq)
     GC = seq.count('G') + seq.count('C')
     GC_content = GC / total
     return GC_content
 
-def check_gene_proximity(record, dist, direction):
-    '''(rec, int, str) -> bool
+def check_gene_proximity(record, dist, direction, p):
+    '''(rec, int, str, Reader) -> bool
     dir = 'u' for upstream, 'd' for downstream
     '''
-    p = antr.Reader(table)
 
     try: # in case site hits end of chrom
         if direction == 'u':
@@ -128,13 +127,13 @@ def main(table, windowsize, correlates, gc_content, gene_context):
     elif gc and not correlates:
         print('chromosome', 'start', 'end', 'GC', 'rho', 'rho_total', 'count')
 
+    p = antr.Reader(table) # reused for every fetch below - each fetch is independent
+
     # iterate through chromosomes
     for chrom in range(1, 18):
         current_chrom = 'chromosome_{}'.format(str(chrom))
         windows = list(range(0, lengths[current_chrom], windowsize)) + [lengths[current_chrom]]
 
-        p = antr.Reader(table)
-
         for i in range(len(windows) - 1):
             window = (windows[i], windows[i + 1])
 
@@ -155,10 +154,10 @@ def main(table, windowsize, correlates, gc_content, gene_context):
                                 upstream = False
                                 downstream = False
 
-                                if check_gene_proximity(record, context_size, 'u'):
+                                if check_gene_proximity(record, context_size, 'u', p):
                                     neither = False
                                     upstream = True
-                                if check_gene_proximity(record, context_size, 'd'):
+                                if check_gene_proximity(record, context_size, 'd', p):
                                     neither = False
                                     downstream = True
 
@@ -200,7 +199,7 @@ def main(table, windowsize, correlates, gc_content, gene_context):
                     gc_rho += record.ld_rho
                     gc_counter += 1
 
-                gc_window = gc_calc(current_chrom, window, table)
+                gc_window = gc_calc(current_chrom, window, p)
                 gc_rho_perbp = gc_rho / gc_counter
 
                 if correlates:
@@ -83,9 +83,9 @@ def attr_fetch(rec, attribute):
     out = getattr(rec, rec_attr)
     return out
 
-def gc_calc(chromosome, window, table):
-    '''Returns GC content in given window as proportion.'''
-    seq = ''.join([record.ref for record in antr.Reader(table).fetch(chromosome, window[0], window[1])])
+def gc_calc(chromosome, window, p):
+    '''Returns GC content in given window as proportion. p is an antr.Reader.'''
+    seq = ''.join([record.ref for record in p.fetch(chromosome, window[0], window[1])])
     total = len(seq)
     GC = seq.count('G') + seq.count('C')
     GC_content = GC / total
@@ -97,9 +97,8 @@ def eprint(*args, **kwargs): # throws out progress info
 def check_gene_proximity(record, dist, direction):
     '''(rec, int, str) -> bool
     dir = 'u' for upstream, 'd' for downstream
+    Uses the global reader p.
     '''
-    p = antr.Reader(table)
-
     try: # in case site hits end of chrom
         if direction == 'u':
             region = p.fetch(record.chrom, record.pos, record.pos + dist)
@@ -138,7 +137,7 @@ elif gc and not correlates:
 # iterate through chromosomes
 windows = list(range(0, lengths[current_chrom], windowsize)) + [lengths[current_chrom]]
 
-p = antr.Reader(table)
+p = antr.Reader(table) # reused for every fetch - each fetch is independent
 
 for i in range(len(windows) - 1):
     window = (windows[i], windows[i + 1])
@@ -209,7 +208,7 @@ for i in range(len(windows) - 1):
             gc_rho += record.ld_rho
             gc_counter += 1
         
-        gc_window = gc_calc(current_chrom, window, table)
+        gc_window = gc_calc(current_chrom, window, p)
         gc_rho_perbp = gc_rho / gc_counter
         
         if correlates:
@@ -6,13 +6,16 @@ usage:
 python3.5 antr_correlate_num.py -t [table (.txt.gz)] -w [windowsize] -c [correlates] > output.txt
 python3.5 antr_correlate_num.py -t table.txt.gz -w 100000 -c map_rho > output.txt
 
+each chromosome is read in as columns (see antbase.Reader.fetch_columns) and summed up over windows
+all at once with antr.windowsums, rather than record by record.
+
 AH - 12/2017
 '''
 
 import argparse
 import sys
+import numpy as np
 from tqdm import tqdm
-from collections import OrderedDict
 
 try:
     import antr
@@ -59,17 +62,25 @@ lengths = {'chromosome_1': 8033585,
 'chromosome_16': 7783580,
 'chromosome_17': 7188315}
 
-def attr_fetch(rec, attribute):
-    '''(rec, str) -> bool/float
-    Used for fetching desired attributes from a record.'''
-    rec_attr = [item for item in dir(rec) if '__' not in item and attribute in item]
+def attr_fetch(fields, attribute):
+    '''(list, str) -> str
+    Used for finding the record attribute (out of a Reader's fields()) matching a desired correlate.'''
+    rec_attr = [item for item in fields if '__' not in item and attribute in item]
     try:
         assert len(rec_attr) == 1
     except:
         raise AssertionError('{} is not a valid attribute. {} matches found - {}'.format(attribute, len(rec_attr), rec_attr))
-    rec_attr = rec_attr[0] # extract item from list
-    out = getattr(rec, rec_attr)
-    return out
+    return rec_attr[0] # extract item from list
+
+def notna(values):
+    '''Returns a mask of non-NA values in an array from fetch_columns.'''
+    if values.dtype.kind == 'f':
+        return ~np.isnan(values)
+    elif values.dtype.kind == 'i':
+        return values != antr.INT_NA
+    elif values.dtype == bool:
+        return np.ones(len(values), dtype = bool)
+    return values != 'NA'
 
 # print column headers
 
@@ -81,51 +92,48 @@ title5 = ' '.join([item + '_count' for item in correlates])
 print('chromosome', 'start', 'end', title1, title2, title3, \
     title4, title5, 'iter_count', 'record_count')
 
-for chrom in range(1, 18):
+p = antr.Reader(table)
+attributes = [attr_fetch(p.fields(), key) for key in correlates]
+
+for chrom in tqdm(range(1, 18)):
     current_chrom = 'chromosome_{}'.format(str(chrom))
     windows = list(range(0, lengths[current_chrom], windowsize)) + [lengths[current_chrom]]
-
-    p = antr.Reader(table)
+    edges = np.array(windows)
+
+    cols = p.fetch_columns(current_chrom, windows[0], windows[-1],
+        columns = ['pos', 'ld_rho'] + attributes, floattype = np.float64)
+    pos, ld_rho = cols['pos'], cols['ld_rho']
+
+    # sums over windows for each correlate - lists of (windows) values
+    rho, corr, count = [], [], []
+    for attribute in attributes:
+        values = cols[attribute]
+        valid = notna(values) & ~np.isnan(ld_rho)
+        rho.append(antr.windowsums(pos, np.where(valid, ld_rho, 0.0), edges).tolist())
+        corr.append(antr.windowsums(pos, np.where(valid, values, 0), edges).astype(np.float64).tolist())
+        count.append(antr.windowsums(pos, valid, edges).tolist())
+    record_counts = antr.windowsums(pos, np.ones(len(pos), dtype = bool), edges).tolist()
 
     for i in range(len(windows) - 1):
         window = (windows[i], windows[i + 1])
-
-        if correlates:
-            rho = OrderedDict.fromkeys(correlates, 0.0)
-            corr = OrderedDict.fromkeys(correlates, 0.0)
-            count = OrderedDict.fromkeys(correlates, 0)
-            total_counter = 0
-            record_counter = 0
-
-            # iterate through records in window
-            for record in tqdm(p.fetch(current_chrom, window[0], window[1])):
-                for key in correlates:
-                    if attr_fetch(record, key) != 'NA' and record.ld_rho != 'NA':
-                        rho[key] += record.ld_rho
-                        corr[key] += attr_fetch(record, key)
-                        count[key] += 1
-                        total_counter += 1
-                    else:
-                        continue
-                record_counter += 1
-
-            corrvals = list(corr.values())
-            rhovals = list(rho.values())
-            countvals = list(count.values())
-
-            try:
-                corr_out = ' '.join([str(corrvals[i] / countvals[i]) for i in range(len(corrvals))])
-                corr_totals = ' '.join([str(v) for v in corrvals])
-                rho_out = ' '.join([str(rhovals[i] / countvals[i]) for i in range(len(rhovals))])
-                rho_totals = ' '.join([str(v) for v in rhovals])
-                counts = ' '.join([str(v) for v in countvals])
-            except ZeroDivisionError: # nothing in window
-                corr_out = ' '.join([str(0) for i in range(len(corrvals))])
-                corr_totals = ' '.join([str(0) for v in corrvals])
-                rho_out = ' '.join([str(0) for i in range(len(rhovals))])
-                rho_totals = ' '.join([str(0) for v in rhovals])
-                counts = ' '.join([str(0) for v in countvals])
-
-            print(current_chrom, window[0], window[1], \
-                corr_out, corr_totals, rho_out, rho_totals, counts, total_counter, record_counter)
-
+        corrvals = [c[i] for c in corr]
+        rhovals = [r[i] for r in rho]
+        countvals = [c[i] for c in count]
+        total_counter = sum(countvals)
+        record_counter = record_counts[i]
+
+        try:
+            corr_out = ' '.join([str(corrvals[i] / countvals[i]) for i in range(len(corrvals))])
+            corr_totals = ' '.join([str(v) for v in corrvals])
+            rho_out = ' '.join([str(rhovals[i] / countvals[i]) for i in range(len(rhovals))])
+            rho_totals = ' '.join([str(v) for v in rhovals])
+            counts = ' '.join([str(v) for v in countvals])
+        except ZeroDivisionError: # nothing in window
+            corr_out = ' '.join([str(0) for i in range(len(corrvals))])
+            corr_totals = ' '.join([str(0) for v in corrvals])
+            rho_out = ' '.join([str(0) for i in range(len(rhovals))])
+            rho_totals = ' '.join([str(0) for v in rhovals])
+            counts = ' '.join([str(0) for v in countvals])
+
+        print(current_chrom, window[0], window[1], \
+            corr_out, corr_totals, rho_out, rho_totals, counts, total_counter, record_counter)
@@ -39,9 +39,9 @@ def MAF_from_allele_count(allele_counts, min_alleles = None):
     except ZeroDivisionError:
         return None
 
-def SFS_from_antr(table, chromosome, start, end, min_alleles = None, neutral_only = False, counter = False):
+def SFS_from_antr(p, chromosome, start, end, min_alleles = None, neutral_only = False, counter = False):
+    '''p is an antr.Reader.'''
     SFSs = {}
-    p = antr.Reader(table)
     if counter:
         record_count = 0
     for record in p.fetch(chromosome, start, end):
@@ -68,6 +68,7 @@ def SFS_from_antr(table, chromosome, start, end, min_alleles = None, neutral_onl
 
 def main(table, dist, min_alleles, neutral_only):
     print('chromosome start end diversity record_count length') # column names
+    p = antr.Reader(table) # reused for every block - each fetch is independent
     with open(dist, 'r') as f:
         for line in tqdm(f):
             if line.startswith('chr,block_start'): # header
@@ -77,7 +78,7 @@ def main(table, dist, min_alleles, neutral_only):
                 chrom, block_start, block_end, flank_rate, \
                 block_rate, rate_ratio, spot_group, length = sp
                 try:
-                    curr_theta, c = SFS_from_antr(table, chrom, int(float(block_start)), int(float(block_end)),
+                    curr_theta, c = SFS_from_antr(p, chrom, int(float(block_start)), int(float(block_end)),
                                                   min_alleles = min_alleles, neutral_only = neutral_only, counter = True)
                     c = int(c)
                 except ZeroDivisionError: # nothing in window
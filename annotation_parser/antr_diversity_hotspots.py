@@ -43,9 +43,9 @@ def MAF_from_allele_count(allele_counts, min_alleles = None):
     except ZeroDivisionError:
         return None
 
-def SFS_from_antr(table, chromosome, start, end, min_alleles = None, neutral_only = False, counter = False):
+def SFS_from_antr(p, chromosome, start, end, min_alleles = None, neutral_only = False, counter = False):
+    '''p is an antr.Reader.'''
     SFSs = {}
-    p = antr.Reader(table)
     if counter:
         record_count = 0
     for record in p.fetch(chromosome, start, end):
@@ -73,6 +73,8 @@ def SFS_from_antr(table, chromosome, start, end, min_alleles = None, neutral_onl
 # column headers
 print('chromosome start end diversity record_count is_hotspot')
 
+p = antr.Reader(table) # reused for every hotspot - each fetch is independent
+
 with open(dist, 'r') as f:
     for line in tqdm(f):
         if line.startswith('chr,block_start'): # header
@@ -81,7 +83,7 @@ with open(dist, 'r') as f:
             sp = [l.rstrip('\n') for l in line.split(',')]
             chrom, start, end, rho, chrom_mean, actual_ratio, is_hotspot = sp
             try:
-                curr_theta, c = SFS_from_antr(table, chrom, int(start), int(end), 
+                curr_theta, c = SFS_from_antr(p, chrom, int(start), int(end), 
                                               min_alleles = min_alleles, neutral_only = neutral_only, counter = True)
                 c = int(c)
             except ZeroDivisionError: # nothing in window
@@ -67,8 +67,8 @@ def attr_fetch(rec, attribute):
 def check_gene_proximity(record, dist, direction):
     '''(rec, int, str) -> bool
     direction = 'u' for upstream, 'd' for downstream
+    Uses the global reader p.
     '''
-    p = antr.Reader(table)
     try: # in case site hits end of chrom
         if direction == 'u':
             region = p.fetch(record.chrom, record.pos, record.pos + dist)
@@ -96,14 +96,14 @@ print('chromosome', 'start', 'end', 'upstream_total', 'downstream_total', \
     'intergenic_total', 'both_total', 'upstream_count', 'downstream_total', \
     'intergenic_total', 'both_total', 'total_counter')
 
+p = antr.Reader(table) # reused for every fetch - each fetch is independent
+
 for chrom in range(1, 18):
     current_chrom = 'chromosome_{}'.format(str(chrom))
     windows = list(range(0, lengths[current_chrom], windowsize)) + [lengths[current_chrom]]
 
     for i in range(len(windows) - 1):
         window = (windows[i], windows[i + 1])
-        
-        p = antr.Reader(table)
 
         rho = OrderedDict.fromkeys(['upstream', 'downstream', 'intergenic', 'both'], 0.0)
         count = OrderedDict.fromkeys(['upstream', 'downstream', 'intergenic', 'both'], 0)
@@ -163,20 +163,19 @@ for key in genes.keys():
 # col headers for file
 print('chromosome', 'start', 'end', 'length', 'type', 'order', 'rho', 'total_rho', 'count')
 
+p = antr.Reader(table) # one reader for every exon/intron - each fetch is independent
+
 # iterate through chromosomes
 for chrom in range(1, 18):
     eprint('starting', chrom)
     current_chrom = 'chromosome_{}'.format(str(chrom))
     eprint('current_chrom = ', current_chrom)
-    p = antr.Reader(table)
 
     # exons
     exon_order = 0 # keep track of which dict for the 'order' column
     # 0 - first, 1 - other, 2 - last
     for coord_dict in [first_exons, other_exons, last_exons]:
         for exon in tqdm(coord_dict[current_chrom]):
-            
-            p = antr.Reader(table)
 
             exon = [int(v) for v in exon]
 
@@ -209,8 +208,6 @@ for chrom in range(1, 18):
     # 0 - first, 1 - other, 2 - last
     for coord_dict in [first_introns, other_introns, last_introns]:
         for intron in tqdm(coord_dict[current_chrom]):
-            
-            p = antr.Reader(table)
 
             intron = [int(v) for v in intron]
 
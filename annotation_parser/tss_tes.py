@@ -44,14 +44,13 @@ if windowsize:
     
     print('type windowleft windowright rho rho_total rho_count') # colnames
 
-    def windowcalc(feature_type, strand, distance, windowsize, table, chromosome, region, start, end):
-        '''Where region is a tuple of size 2, indicating the start and the end of the region
-        i.e. windowcalc('TES', '+', 20, 'table.txt.gz', 'chromosome_2', (900, 1000), 16200, 17300)'''
+    def windowcalc(feature_type, strand, distance, windowsize, p, chromosome, region, start, end):
+        '''Where region is a tuple of size 2, indicating the start and the end of the region,
+        and p is an antr.Reader
+        i.e. windowcalc('TES', '+', 20, antr.Reader('table.txt.gz'), 'chromosome_2', (900, 1000), 16200, 17300)'''
         
         windowlist = list(range(region[0], region[1] + 1, windowsize))
         
-        p = antr.Reader(table)
-        
         for i in range(len(windowlist) - 1):
             windowleft, windowright = windowlist[i], windowlist[i + 1]
             rho_cumulative = 0.0
@@ -89,8 +88,7 @@ if windowsize:
 else: # no windowsize
     print('type distance rho')
 
-    def singlecalc(feature_type, strand, distance, table, chromosome, region, start, end):
-        p = antr.Reader(table)
+    def singlecalc(feature_type, strand, distance, p, chromosome, region, start, end):
 
         for record in p.fetch(chromosome, region[0], region[1]):
             rho = record.ld_rho
@@ -108,10 +106,11 @@ else: # no windowsize
             print(out)
 
 
+p = antr.Reader(table) # reused for every feature - each fetch is independent
+
 with open(gff, 'r') as f:
     for line in tqdm(f):
         if chromosome in line:
-            p = antr.Reader(table)
 
             if '_prime_UTR' in line:
 
@@ -130,12 +129,12 @@ with open(gff, 'r') as f:
                             region_inside = (start, start + distance)
 
                         if not windowsize:
-                            singlecalc('TSS', strand, distance, table, chromosome, region_outside, start, end)
-                            singlecalc('TSS', strand, distance, table, chromosome, region_inside, start, end)
+                            singlecalc('TSS', strand, distance, p, chromosome, region_outside, start, end)
+                            singlecalc('TSS', strand, distance, p, chromosome, region_inside, start, end)
 
                         elif windowsize:
-                            windowcalc('TSS', strand, distance, windowsize, table, chromosome, region_outside, start, end)
-                            windowcalc('TSS', strand, distance, windowsize, table, chromosome, region_inside, start, end)
+                            windowcalc('TSS', strand, distance, windowsize, p, chromosome, region_outside, start, end)
+                            windowcalc('TSS', strand, distance, windowsize, p, chromosome, region_inside, start, end)
 
                     elif strand == '-':
                         if end > distance:
@@ -146,12 +145,12 @@ with open(gff, 'r') as f:
                             region_inside = (end % windowsize, end)
                         
                         if not windowsize:
-                            singlecalc('TSS', strand, distance, table, chromosome, region_outside, start, end)
-                            singlecalc('TSS', strand, distance, table, chromosome, region_inside, start, end)
+                            singlecalc('TSS', strand, distance, p, chromosome, region_outside, start, end)
+                            singlecalc('TSS', strand, distance, p, chromosome, region_inside, start, end)
 
                         elif windowsize:
-                            windowcalc('TSS', strand, distance, windowsize, table, chromosome, region_outside, start, end)
-                            windowcalc('TSS', strand, distance, windowsize, table, chromosome, region_inside, start, end)
+                            windowcalc('TSS', strand, distance, windowsize, p, chromosome, region_outside, start, end)
+                            windowcalc('TSS', strand, distance, windowsize, p, chromosome, region_inside, start, end)
 
                 elif 'three' in utr:
                     if strand == '+':
@@ -163,12 +162,12 @@ with open(gff, 'r') as f:
                             region_inside = (end % windowsize, end)
 
                         if not windowsize:
-                            singlecalc('TES', strand, distance, table, chromosome, region_outside, start, end)
-                            singlecalc('TES', strand, distance, table, chromosome, region_inside, start, end)
+                            singlecalc('TES', strand, distance, p, chromosome, region_outside, start, end)
+                            singlecalc('TES', strand, distance, p, chromosome, region_inside, start, end)
 
                         elif windowsize:
-                            windowcalc('TES', strand, distance, windowsize, table, chromosome, region_outside, start, end)
-                            windowcalc('TES', strand, distance, windowsize, table, chromosome, region_inside, start, end)
+                            windowcalc('TES', strand, distance, windowsize, p, chromosome, region_outside, start, end)
+                            windowcalc('TES', strand, distance, windowsize, p, chromosome, region_inside, start, end)
 
                     elif strand == '-':
                         if start > distance:
@@ -179,9 +178,9 @@ with open(gff, 'r') as f:
                             region_inside = (start, start + distance)
                         
                         if not windowsize:
-                            singlecalc('TES', strand, distance, table, chromosome, region_outside, start, end)
-                            singlecalc('TES', strand, distance, table, chromosome, region_inside, start, end)
+                            singlecalc('TES', strand, distance, p, chromosome, region_outside, start, end)
+                            singlecalc('TES', strand, distance, p, chromosome, region_inside, start, end)
 
                         elif windowsize:
-                            windowcalc('TES', strand, distance, windowsize, table, chromosome, region_outside, start, end)
-                            windowcalc('TES', strand, distance, windowsize, table, chromosome, region_inside, start, end)
+                            windowcalc('TES', strand, distance, windowsize, p, chromosome, region_outside, start, end)
+                            windowcalc('TES', strand, distance, windowsize, p, chromosome, region_inside, start, end)
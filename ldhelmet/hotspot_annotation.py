@@ -30,11 +30,10 @@ args = parser.parse_args()
 table = args.table
 filename = args.filename
 
-def check_gene_proximity(record, dist, direction):
-    '''(rec, int, str) -> bool
+def check_gene_proximity(record, dist, direction, p):
+    '''(rec, int, str, Reader) -> bool
     dir = 'u' for upstream, 'd' for downstream
     '''
-    p = antr.Reader(table)
 
     try: # in case site hits end of chrom
         if direction == 'u':
@@ -63,6 +62,8 @@ correlates = dict.fromkeys(['is_genic', 'is_intergenic', 'is_exonic', 'is_intron
 with open(filename, 'r') as f:
     hotspot_lines = f.readlines()
 
+p = antr.Reader(table) # reused for every fetch below - each fetch is independent
+
 
 for line in tqdm(hotspot_lines):
     if 'chr,block_start,block_end' in line: # skip header
@@ -72,8 +73,6 @@ for line in tqdm(hotspot_lines):
         chrom, start, end = sp[0], float(sp[1]), float(sp[2])
         ratio = float(sp[5])
 
-        p = antr.Reader(table)
-
         if ratio >= 5.0:
             for record in p.fetch(chrom, start, end):
                 for key in correlates:
@@ -85,10 +84,10 @@ for line in tqdm(hotspot_lines):
                         upstream = False
                         downstream = False
                         neither = True
-                        if check_gene_proximity(record, 2000, 'u'):
+                        if check_gene_proximity(record, 2000, 'u', p):
                             upstream = True
                             neither = False
-                        if check_gene_proximity(record, 2000, 'd'):
+                        if check_gene_proximity(record, 2000, 'd', p):
                             downstream = True
                             neither = False
                         if upstream and downstream:
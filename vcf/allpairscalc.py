@@ -1,18 +1,34 @@
 '''
 allpairscalc.py - calculates LD stats between _all_ SNPs in a given vcf
 
+Each chromosome is read in once and bit-packed (see snpstore.py, snpcache.py), after which LD is
+computed once per pair - ie only the upper triangle of the genome-wide pair matrix
+(pos1 < pos2 within a chromosome, and chrom1 before chrom2 across chromosomes).
+
 usage: python allpairscalc.py -v [vcf (.gz)] -l [ld stats] > [outfile]
 
+Alternatively, the matrix can be written out as compressed .npz tiles instead of text:
+python allpairscalc.py -v [vcf (.gz)] -l [ld stats] -o [out directory]
+
+Each tile holds pos1/pos2 arrays, a chrom1/chrom2 pair and one float32 matrix per stat
+(plus hapcount if -p is given). Pairs outside the upper triangle are NaN.
+
+Pairs can also be written in the binary columnar format used by the other LD drivers
+(see ldcolumns.py) with -b [out directory], or summarised per chromosome and distance
+bin with -n [bin width] (see ldbins.py) - only intra-chromosome pairs are computed then.
+
 AH - 09/2017
 '''
 
+import os
 import vcf
 import argparse
+import numpy as np
 from tqdm import tqdm
 from popgen import * # snppuller, header
 from ldcalc import *
 
-parser = argparse.ArgumentParser(description = 'Calculate LD stats between all SNP pairs in a VCF file.', 
+parser = argparse.ArgumentParser(description = 'Calculate LD stats between all SNP pairs in a VCF file.',
                                 usage = 'allpairscalc.py [options]')
 
 parser.add_argument('-v', '--vcfinput', required = True,
@@ -21,78 +37,101 @@ parser.add_argument('-l', '--ldstats', required = True,
                    type = str, help = 'LD stats to calculate, separated by forward slashes (i.e. d/dprime)')
 parser.add_argument('-p', '--haps', required = False,
                    action = 'store_true', help = 'Whether to output the number of observed haplotypes for each comparison. Optional.')
+parser.add_argument('-o', '--outdir', required = False,
+                   type = str, help = 'Write compressed .npz tiles to this directory instead of printing text. Optional.')
+parser.add_argument('-b', '--binary', required = False,
+                   type = str, help = 'Write binary columnar output (see ldcolumns.py) to this directory instead of printing. Optional.')
+parser.add_argument('-n', '--bins', required = False,
+                   type = int, help = 'Print per-distance-bin summaries with this bin width (bp) instead of pairs. Optional.')
+parser.add_argument('-s', '--tilesize', required = False, default = 256,
+                   type = int, help = 'Number of SNPs per side of each tile [default 256]')
 
 
 args = parser.parse_args()
 vcfin = args.vcfinput
 ldstats = args.ldstats
 haps = args.haps
+outdir = args.outdir
+binary = args.binary
+tilesize = args.tilesize
+bins = args.bins
 
-def allpairscalc(vcf_file, stat, haps = False):
+def tilestats(sites1, i0, i1, sites2, j0, j1, stat, haps = False):
+    '''Computes LD stats for a tile, masking out pairs below the diagonal if both
+    blocks are on the same chromosome. Returns (haplotype counts, stats dict, mask of pairs to keep).
+    '''
+    counts = sites1.blockcounts(np.arange(i0, i1), np.arange(j0, j1), other = sites2)
+    stats = ldfromcounts(*counts, stats = stat)
+    if haps:
+        stats['hapcount'] = sum((c > 0).astype(np.int64) for c in counts)
+    if sites1 is sites2:
+        keep = np.arange(j0, j1)[None, :] > np.arange(i0, i1)[:, None]
+    else:
+        keep = np.ones((i1 - i0, j1 - j0), dtype = bool)
+    return counts, stats, keep
+
+def allpairscalc(vcf_file, stat, haps = False, outdir = None, tilesize = 256, binary = None, bins = None):
     '''In a single VCF, calculates linkage stats between all possible pairs, regardless of region.
-    The stat parameter can take any of 'd', 'dprime', or 'r2' as input. 
+    Each pair is only computed once, with the earlier SNP (in VCF order) as record1.
+    The stat parameter can take any of 'd', 'dprime', or 'r2' as input.
     Multiple parameters can be provided if separated by a forward slash (ie 'd/dprime' or 'r2/d').
-    Output is printed in a space separated format.
-    
+    Output is printed in a space separated format one tile at a time (so pairs are ordered
+    by tile, then by record1 and record2 within each tile - use tilesize = 1 for the
+    record1 by record1 order of the other scripts), unless an outdir is given, in which case
+    .npz tiles are written there instead, or binary is given, in which case pairs are
+    written there in binary columnar format (see ldcolumns.py). If bins is given as a bin
+    width in bp, only a summary of each stat per chromosome and distance bin is printed
+    (see ldbins.py), and pairs between chromosomes are skipped.
+
     Setting haps to True will also print out how many of the four possible haplotypes
     were actually present in the final comparison.
     '''
-    
-    def metadata(record1, record2):
-        out = record1.CHROM + ' ' + str(record1.POS) + ' ' + record2.CHROM + ' ' + str(record2.POS)
-        return out
-      
-    def ldgetter(record1, record2):
-        if haps == False: # proceed w/o haps
-            if len(stat) == 1:
-                if 'd' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2))
-                elif 'dprime' in stat:
-                    print(metadata(record1, record2), dprimecalc(record1, record2))
-                elif 'r2' in stat:
-                    print(metadata(record1, record2), r2calc(record1, record2))
-            elif len(stat) == 2:
-                if 'd' in stat and 'dprime' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2))
-                elif 'd' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-                elif 'dprime' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-            elif len(stat) == 3:
-                print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2))
-
-        elif haps == True: # show haps/4 for each comparison
-            observed_haps = list(freqsgetter(record1, record2)[2].values()) # get hap frequencies
-            hapcount = 4 - observed_haps.count(0)
-            if len(stat) == 1:
-                if 'd' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), hapcount)
-                elif 'dprime' in stat:
-                    print(metadata(record1, record2), dprimecalc(record1, record2), hapcount)
-                elif 'r2' in stat:
-                    print(metadata(record1, record2), r2calc(record1, record2), hapcount)
-            elif len(stat) == 2:
-                if 'd' in stat and 'dprime' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), hapcount)
-                elif 'd' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2), hapcount)
-                elif 'dprime' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2), hapcount)
-            elif len(stat) == 3:
-                print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2), hapcount) 
-
-    left = snppuller(vcf_file) # create ref vcf record generator
     stat = stat.split('/') # get stat
-    header(stat, haps) # print header
-    
-    for record1 in tqdm(left):
-        right = snppuller(vcf_file)
-        if len(record1.ALT) > 1:
-            continue
-        for record2 in right:
-            if record1.CHROM == record2.CHROM and record1.POS == record2.POS:
-                continue
-            else:
-                ldgetter(record1, record2)
-
-allpairscalc(vcf_file = vcfin, stat = ldstats, haps = haps)
+    cols = ldcols(stat, haps)
+    allsites = chromstores(vcf_file)
+    writer = None
+    if outdir:
+        os.makedirs(outdir, exist_ok = True)
+    elif bins:
+        writer = BinnedLD(bins, cols)
+    elif binary:
+        writer = ColumnWriter(binary, cols)
+    else:
+        header(stat, haps) # print header
+
+    for a, sites1 in enumerate(allsites):
+        for i0 in tqdm(range(0, len(sites1), tilesize)):
+            i1 = min(i0 + tilesize, len(sites1))
+            for sites2 in allsites[a:]:
+                if bins and sites2 is not sites1: # no distance between chromosomes
+                    continue
+                # on the diagonal, only tiles from the current strip onwards are needed
+                start = i0 if sites2 is sites1 else 0
+                for j0 in range(start, len(sites2), tilesize):
+                    j1 = min(j0 + tilesize, len(sites2))
+                    counts, stats, keep = tilestats(sites1, i0, i1, sites2, j0, j1, stat, haps)
+                    if outdir:
+                        tilename = '{0}_{1}_{2}_{3}.npz'.format(sites1.chrom, sites2.chrom, i0, j0)
+                        matrices = {s: np.where(keep, stats[s], np.nan).astype(np.float32) for s in cols}
+                        np.savez_compressed(os.path.join(outdir, tilename),
+                            chrom1 = sites1.chrom, chrom2 = sites2.chrom,
+                            pos1 = sites1.positions[i0:i1], pos2 = sites2.positions[j0:j1], **matrices)
+                        continue
+                    if writer:
+                        rowidx, colidx = np.nonzero(keep)
+                        writer.writearrays(sites1.chrom, sites1.positions[i0:i1][rowidx],
+                            sites2.chrom, sites2.positions[j0:j1][colidx], {s: stats[s][keep] for s in cols})
+                        continue
+                    # printed tile by tile, so only one tile's text is held at a time
+                    columns = textvalues(counts, stats, cols)
+                    pos2 = sites2.positions[j0:j1].tolist()
+                    lines = []
+                    for i, p1 in enumerate(sites1.positions[i0:i1].tolist()):
+                        prefix = sites1.chrom + ' ' + str(p1) + ' ' + sites2.chrom + ' '
+                        lines.extend(prefix + ' '.join([str(pos2[j])] + [str(c[i, j]) for c in columns]) + '\n'
+                            for j in np.flatnonzero(keep[i]).tolist())
+                    print(''.join(lines), end = '')
+    if writer:
+        writer.close()
+
+allpairscalc(vcf_file = vcfin, stat = ldstats, haps = haps, outdir = outdir, tilesize = tilesize, binary = binary, bins = bins)
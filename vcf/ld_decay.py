@@ -1,78 +1,204 @@
 '''
 pick out variants at random from the VCF and calculate LD between them
 
-can parallelize this by suppressing col header printing, running in parallel,
-and then concatenating the outfiles
+SNPs are drawn from an in-memory index of eligible SNP positions (built once from
+the SNP cache - see snpcache.py), and r2 is computed in batches from pre-encoded
+genotypes, so no tabix queries are made per draw.
+
+By default only the first chromosome in the VCF is sampled. With --all_chroms, draws
+are spread over every chromosome with SNPs, in proportion to its number of SNPs
+(--weight snps) or its length (--weight length) - pairs are always within a chromosome.
+
+Draws are split into batches, each with its own RNG stream derived from --seed, and
+the batches can be spread over several processes (--processes). Output comes out in
+batch order and only depends on the seed, not on the number of processes, so runs are
+reproducible. Without --seed, a fresh seed is drawn each run.
 
 usage:
 python3.5 ld_decay.py --vcf [vcf.gz] --count [number of comparisons] --filter [optional distance limit] > [outfile]
+python3.5 ld_decay.py --vcf [vcf.gz] --count 1000000 --all_chroms --processes 8 --seed 42 > [outfile]
+
+add --binary [out directory] to write binary columnar output instead (see ldcolumns.py)
+
+add --bins [bin width in bp] to print mean, sd and quantiles of r2 per chromosome and
+distance bin instead of individual pairs (see ldbins.py) - the pairs are summarised as
+they're computed and never written out
 '''
 
-import vcf
 import random
+import bisect
 import argparse
+import numpy as np
+from multiprocessing import Pool
 from popgen import *
 from ldcalc import *
+from ldbins import BinnedLD
+from vcfreader import openvcf
 
-parser = argparse.ArgumentParser(description = 'Calculate LD stats between randomly selected sites in a VCF file.',
-                                usage = 'ld_decay.py [options] > [outfile]')
-
-parser.add_argument('-v', '--vcf', required = True, type = str, help = 'Input VCF(.gz)')
-parser.add_argument('-c', '--count', required = True, type = int, help = 'Number of pairwise draws to consider in calculations')
-parser.add_argument('-f', '--filter', required = False, type = int, help = 'Maximum distance between SNPs [optional]')
-parser.add_argument('-t', '--title', required = False, action = 'store_true', help = 'Print column headers? [optional]')
+# draws per batch - each batch gets its own RNG stream
+batchsize = 100000
 
-args = parser.parse_args()
-filename = str(args.vcf)
-total_count = int(args.count)
-filt = args.filter
-incl_title = args.title
+# set in each worker by _init_worker - chrom: (PackedSites, sorted position list)
+_sites = {}
 
-vcfin = vcf.Reader(filename = filename, compressed = True)
-chrom = next(vcfin).CHROM
-chrom_length = vcfin.contigs[chrom][1] # get chromosome length
+def _init_worker(stores):
+    '''Pool initializer - stores the packed sites for each chromosome as a global.'''
+    global _sites
+    _sites = {sites.chrom: (sites, sites.positions.tolist()) for sites in stores}
 
-def get_random_record(filename, chrom_length, offset, limit_center = None, distance_limit = None):
+def get_random_site(positions, chrom_length, offset, limit_center = None, distance_limit = None, rng = random):
     '''
-    filename = vcf file
+    positions = sorted list of SNP positions on the chromosome
     chrom_length = length of chromosome
-    offset = when creating generator objects, how far ahead of drawn position to look?
+    offset = how far ahead of drawn position to look for a SNP
     limit_center = [default None] an integer value, representing a site position around which to look distance_limit bp
     on either side
     distance_limit = [default None] an integer value, describing how far around the limit center to look
+    rng = [default random module] random.Random instance to draw positions with
 
-    returns a random record in the vcf given these parameters
+    returns the index (in positions) of a random SNP given these parameters - the first SNP within
+    offset bp after a uniformly drawn position, redrawing if there isn't one
     '''
-    found = False
-    while not found:
-        try:
-            if not distance_limit:
-                pos = random.randint(1, chrom_length)
-                record = next(snppuller(filename, chrom, pos, pos + offset))
-            elif distance_limit:
-                in_range = False
-                while not in_range:
-                    pos = random.randint(limit_center - distance_limit, limit_center + distance_limit)
-                    if pos > chrom_length or pos < 0: # out of range - fetch another record
-                        continue
-                    else:
-                        record = next(snppuller(filename, chrom, pos, pos + offset))
-                        in_range = True
-            found = True
-        except StopIteration:
-            continue
-    return record
-
-if incl_title:
-    print('chrom1 pos1 chrom2 pos2 r2')
-    
-for i in tqdm(range(total_count)):
-    if not filt:
-        record1 = get_random_record(filename, chrom_length, 100)
-        record2 = get_random_record(filename, chrom_length, 100)
-    elif filt:
-        record1 = get_random_record(filename, chrom_length, 100)
-        record2 = get_random_record(filename, chrom_length, 100, \
-            limit_center = record1.POS, distance_limit = int(filt))
-    r2 = r2calc(record1, record2, snpcheck = False)
-    print(record1.CHROM, record1.POS, record2.CHROM, record2.POS, r2)
+    if not positions:
+        raise ValueError('no SNPs to sample from')
+    while True:
+        if not distance_limit:
+            pos = rng.randint(1, chrom_length)
+        else:
+            pos = rng.randint(limit_center - distance_limit, limit_center + distance_limit)
+            if pos > chrom_length or pos < 0: # out of range - draw again
+                continue
+        i = bisect.bisect_right(positions, pos) # first SNP after pos
+        if i < len(positions) and positions[i] <= pos + offset:
+            return i
+
+def sampletask(task):
+    '''Worker function - draws one batch of pairs on a chromosome and computes r2.
+    Returns (chrom, number of pairs, result), where result is a BinnedLD if binwidth
+    is set and (pos1, pos2, r2, r2 for printing - see ldcalc.textvalues) arrays otherwise.
+    '''
+    chrom, chrom_length, count, filt, seed, binwidth = task
+    rng = random.Random(seed)
+    sites, positions = _sites[chrom]
+    idx1 = []
+    idx2 = []
+    for i in range(count):
+        site1 = get_random_site(positions, chrom_length, 100, rng = rng)
+        if not filt:
+            site2 = get_random_site(positions, chrom_length, 100, rng = rng)
+        elif filt:
+            site2 = get_random_site(positions, chrom_length, 100, \
+                limit_center = positions[site1], distance_limit = int(filt), rng = rng)
+        idx1.append(site1)
+        idx2.append(site2)
+    counts = sites.hapcounts(idx1, idx2)
+    values = ldfromcounts(*counts, stats = ['r2'])
+    r2 = values['r2']
+    pos1 = sites.positions[idx1]
+    pos2 = sites.positions[idx2]
+    if binwidth:
+        bins = BinnedLD(binwidth, ['r2'])
+        bins.writearrays(chrom, pos1, chrom, pos2, {'r2': r2})
+        return chrom, count, bins
+    return chrom, count, (pos1, pos2, r2, textvalues(counts, values, ['r2'])[0])
+
+def maketasks(stores, lengths, total_count, filt = None, weight = 'snps', seed = None, binwidth = None):
+    '''Splits total_count draws over chromosomes (multinomially, weighted by SNP count
+    or length) and then into batches of at most batchsize draws. Each batch gets its
+    own seed spawned from the master seed, so results don't depend on how the batches
+    are scheduled.
+    '''
+    seedseq = np.random.SeedSequence(seed)
+    allocseq, batchseq = seedseq.spawn(2)
+    if weight == 'length':
+        weights = np.array([lengths[sites.chrom] if len(sites) else 0 for sites in stores], dtype = np.float64)
+    else:
+        weights = np.array([len(sites) for sites in stores], dtype = np.float64)
+    if weights.sum() == 0:
+        raise ValueError('no SNPs to sample from')
+    counts = np.random.default_rng(allocseq).multinomial(total_count, weights / weights.sum())
+    batches = [(sites.chrom, min(batchsize, count - start))
+        for sites, count in zip(stores, counts.tolist()) for start in range(0, count, batchsize)]
+    seeds = [int(s.generate_state(1)[0]) for s in batchseq.spawn(len(batches))]
+    return [(chrom, lengths[chrom], count, filt, s, binwidth) for (chrom, count), s in zip(batches, seeds)]
+
+def ld_decay(vcf_file, total_count, filt = None, all_chroms = False, weight = 'snps', processes = 1,
+        seed = None, binwidth = None, binary = None, title = False, quantiles = (0.05, 0.5, 0.95)):
+    '''Draws total_count random pairs of SNPs and prints r2 between them (or writes them
+    in binary format to binary, or prints per-chromosome, per-distance-bin summaries if
+    binwidth is given).
+    '''
+    vcfin = openvcf(vcf_file) # pysam-backed if available (see vcfreader.py)
+    if all_chroms:
+        stores = chromstores(vcf_file)
+    else:
+        chrom = next(iter(vcfin)).CHROM
+        stores = [sitestore(vcf_file, chrom)]
+    # chromosome lengths from the header, falling back on the last SNP
+    lengths = {}
+    for sites in stores:
+        if sites.chrom in vcfin.contigs and vcfin.contigs[sites.chrom][1]:
+            lengths[sites.chrom] = vcfin.contigs[sites.chrom][1]
+        elif len(sites):
+            lengths[sites.chrom] = int(sites.positions[-1])
+    tasks = maketasks(stores, lengths, total_count, filt, weight, seed, binwidth)
+
+    writer = None
+    if binwidth:
+        writer = BinnedLD(binwidth, ['r2'], quantiles = quantiles, title = title)
+    elif binary:
+        writer = ColumnWriter(binary, ['r2'])
+    elif title:
+        print('chrom1 pos1 chrom2 pos2 r2')
+
+    if processes > 1:
+        pool = Pool(processes = processes, initializer = _init_worker, initargs = (stores,))
+        results = pool.imap(sampletask, tasks)
+    else:
+        pool = None
+        _init_worker(stores)
+        results = map(sampletask, tasks)
+
+    with tqdm(total = total_count) as progress:
+        for chrom, count, result in results:
+            if binwidth:
+                writer.merge(result)
+            elif writer:
+                pos1, pos2, r2, r2text = result
+                writer.writearrays(chrom, pos1, chrom, pos2, {'r2': r2})
+            else:
+                pos1, pos2, r2, r2text = result
+                for p1, p2, value in zip(pos1.tolist(), pos2.tolist(), r2text.tolist()):
+                    print(chrom, p1, chrom, p2, value)
+            progress.update(count)
+
+    if pool:
+        pool.close()
+        pool.join()
+    if writer:
+        writer.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Calculate LD stats between randomly selected sites in a VCF file.',
+                                    usage = 'ld_decay.py [options] > [outfile]')
+
+    parser.add_argument('-v', '--vcf', required = True, type = str, help = 'Input VCF(.gz)')
+    parser.add_argument('-c', '--count', required = True, type = int, help = 'Number of pairwise draws to consider in calculations')
+    parser.add_argument('-f', '--filter', required = False, type = int, help = 'Maximum distance between SNPs [optional]')
+    parser.add_argument('-t', '--title', required = False, action = 'store_true', help = 'Print column headers? [optional]')
+    parser.add_argument('-a', '--all_chroms', required = False, action = 'store_true', help = 'Sample pairs on all chromosomes instead of just the first [optional]')
+    parser.add_argument('-w', '--weight', required = False, default = 'snps', choices = ['snps', 'length'],
+                        help = 'Weight chromosomes by SNP count or length with --all_chroms [default snps]')
+    parser.add_argument('-p', '--processes', required = False, default = 1, type = int, help = 'Number of processes to use [default 1]')
+    parser.add_argument('-s', '--seed', required = False, type = int, help = 'Random seed, for reproducible draws [optional]')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-b', '--binary', required = False, type = str, help = 'Write binary columnar output (see ldcolumns.py) to this directory instead [optional]')
+    output.add_argument('-n', '--bins', required = False, type = int, help = 'Print r2 summaries per distance bin of this width (bp) instead of pairs [optional]')
+    parser.add_argument('-q', '--quantiles', required = False, default = [0.05, 0.5, 0.95], type = float, nargs = '+',
+                        help = 'Quantiles to report with --bins [default 0.05 0.5 0.95]')
+
+    args = parser.parse_args()
+
+    ld_decay(str(args.vcf), int(args.count), filt = args.filter, all_chroms = args.all_chroms, weight = args.weight,
+        processes = args.processes, seed = args.seed, binwidth = args.bins, binary = args.binary,
+        title = args.title, quantiles = args.quantiles)
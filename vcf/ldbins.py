@@ -0,0 +1,238 @@
+'''
+ldbins.py - streaming, distance-binned summaries of pairwise LD
+
+For LD decay curves we only need the mean (and a few quantiles) of r2 per distance
+bin, not every pair. DistanceBins folds pairs into per-bin accumulators as they are
+computed: count, sum, and sum of squares, plus a fixed-resolution histogram of values
+per bin that serves as a quantile sketch. Accumulators from different processes
+can be merged, so the raw pairs never need to be written out.
+
+Since LD stats are bounded, the histogram covers [lo, hi] (default [0, 1], ie r2) in
+resolution equal-width buckets, and quantiles are interpolated within buckets -
+they're accurate to within (hi - lo)/resolution.
+
+BinnedLD keeps one DistanceBins per chromosome and stat, and has the same write()/
+writearrays()/close() interface as ldcolumns.ColumnWriter, so the LD drivers can
+hand their pairs to it in place of a writer. Closing it prints the summary, one
+block of bins per chromosome and stat. Pairs between different chromosomes have no
+distance and are skipped.
+
+usage:
+bins = DistanceBins(1000) # 1 kb bins
+bins.add(abs(pos2 - pos1), r2)
+bins.write() # prints dist_start dist_end count mean sd q0.05 q0.5 q0.95
+
+binned = BinnedLD(1000, ['d', 'r2'])
+binned.write('chromosome_1', 1000, 'chromosome_1', 1500, [0.1, 0.4])
+binned.close() # prints chrom stat dist_start dist_end count mean sd q0.05 q0.5 q0.95
+'''
+
+import sys
+import numpy as np
+
+# possible range of each LD stat - used as the histogram range
+STATRANGES = {'d': (-0.25, 0.25), 'dprime': (-1.0, 1.0), 'r2': (0.0, 1.0)}
+
+class DistanceBins(object):
+    '''Per-distance-bin accumulators for one LD stat.
+
+    binwidth - bin width in bp. Bin i covers distances [i * binwidth, (i + 1) * binwidth).
+    lo, hi - range of the stat (values outside are clipped into the end buckets)
+    resolution - number of histogram buckets used for quantiles
+    '''
+    def __init__(self, binwidth, lo = 0.0, hi = 1.0, resolution = 100):
+        self.binwidth = binwidth
+        self.lo = lo
+        self.hi = hi
+        self.resolution = resolution
+        self.count = np.zeros(0, dtype = np.int64)
+        self.sum = np.zeros(0)
+        self.sumsq = np.zeros(0)
+        self.hist = np.zeros((0, resolution), dtype = np.int64)
+
+    def _grow(self, numbins):
+        '''Extends the accumulators to at least numbins bins.'''
+        extra = numbins - len(self.count)
+        if extra <= 0:
+            return
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype = np.int64)])
+        self.sum = np.concatenate([self.sum, np.zeros(extra)])
+        self.sumsq = np.concatenate([self.sumsq, np.zeros(extra)])
+        self.hist = np.concatenate([self.hist, np.zeros((extra, self.resolution), dtype = np.int64)])
+
+    def add(self, dist, values):
+        '''Folds in pairs given as arrays of distances and stat values. Non-finite
+        values are skipped.
+        '''
+        dist = np.atleast_1d(np.asarray(dist, dtype = np.int64))
+        values = np.atleast_1d(np.asarray(values, dtype = np.float64))
+        keep = np.isfinite(values)
+        dist, values = np.abs(dist[keep]), values[keep]
+        if len(dist) == 0:
+            return
+        bins = dist // self.binwidth
+        numbins = int(bins.max()) + 1
+        self._grow(numbins)
+        self.count[:numbins] += np.bincount(bins, minlength = numbins)
+        self.sum[:numbins] += np.bincount(bins, weights = values, minlength = numbins)
+        self.sumsq[:numbins] += np.bincount(bins, weights = values**2, minlength = numbins)
+        buckets = ((values - self.lo) / (self.hi - self.lo) * self.resolution).astype(np.int64)
+        buckets = np.clip(buckets, 0, self.resolution - 1)
+        flat = np.bincount(bins * self.resolution + buckets, minlength = numbins * self.resolution)
+        self.hist[:numbins] += flat.reshape(numbins, self.resolution)
+
+    def merge(self, other):
+        '''Adds another DistanceBins (with the same settings) into this one.'''
+        assert (self.binwidth, self.lo, self.hi, self.resolution) == \
+            (other.binwidth, other.lo, other.hi, other.resolution)
+        numbins = len(other.count)
+        self._grow(numbins)
+        self.count[:numbins] += other.count
+        self.sum[:numbins] += other.sum
+        self.sumsq[:numbins] += other.sumsq
+        self.hist[:numbins] += other.hist
+        return self
+
+    def mean(self):
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return self.sum / self.count
+
+    def sd(self):
+        '''Sample standard deviation per bin.'''
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            var = (self.sumsq - self.sum**2 / self.count) / (self.count - 1)
+        return np.sqrt(np.maximum(var, 0))
+
+    def quantile(self, q):
+        '''Estimated q-quantile per bin (NaN for empty bins), interpolating linearly
+        within histogram buckets.
+        '''
+        out = np.full(len(self.count), np.nan)
+        width = (self.hi - self.lo) / self.resolution
+        cumulative = np.cumsum(self.hist, axis = 1)
+        for i in np.flatnonzero(self.count):
+            target = q * self.count[i]
+            k = int(np.searchsorted(cumulative[i], target, side = 'left'))
+            k = min(k, self.resolution - 1)
+            below = cumulative[i, k - 1] if k > 0 else 0
+            inbucket = self.hist[i, k]
+            frac = (target - below) / inbucket if inbucket else 0
+            out[i] = self.lo + (k + frac) * width
+        return out
+
+    def rows(self, quantiles = (0.05, 0.5, 0.95)):
+        '''Returns summary rows [dist_start, dist_end, count, mean, sd, quantiles...]
+        for every non-empty bin.
+        '''
+        mean, sd = self.mean(), self.sd()
+        qs = [self.quantile(q) for q in quantiles]
+        out = []
+        for i in np.flatnonzero(self.count):
+            out.append([i * self.binwidth, (i + 1) * self.binwidth - 1, int(self.count[i]),
+                mean[i], sd[i]] + [q[i] for q in qs])
+        return out
+
+    def header(self, quantiles = (0.05, 0.5, 0.95)):
+        return ['dist_start', 'dist_end', 'count', 'mean', 'sd'] + ['q' + str(q) for q in quantiles]
+
+    def write(self, quantiles = (0.05, 0.5, 0.95), title = True, prefix = None, file = None):
+        '''Prints the summary in space separated format. If prefix is given (eg a
+        chromosome name), it's added as a first column.
+        '''
+        if title:
+            print(*((['chrom'] if prefix is not None else []) + self.header(quantiles)), file = file)
+        for row in self.rows(quantiles):
+            print(*(([prefix] if prefix is not None else []) + row), file = file)
+
+class BinnedLD(object):
+    '''Distance-binned summaries of LD stats, kept separately for each chromosome.
+
+    binwidth - bin width in bp
+    cols - output columns, in the order values are given to write() (eg ldcalc.ldcols()
+    output). Only d, dprime and r2 are binned - other columns (ie hapcount) are ignored.
+    quantiles - quantiles to report
+    title - whether to print column headers on close()
+    file - where to print the summary [default stdout]
+    '''
+    def __init__(self, binwidth, cols, quantiles = (0.05, 0.5, 0.95), resolution = 100,
+            title = True, file = None, chunksize = 100000):
+        self.binwidth = binwidth
+        self.cols = list(cols)
+        self.stats = [s for s in self.cols if s in STATRANGES]
+        self.quantiles = quantiles
+        self.resolution = resolution
+        self.title = title
+        self.file = file
+        self.chunksize = chunksize
+        self.bins = {} # chrom: {stat: DistanceBins}, in order of first appearance
+        self._buffers = {} # chrom: (distances, values) lists for write()
+
+    def _chrombins(self, chrom):
+        if chrom not in self.bins:
+            self.bins[chrom] = {s: DistanceBins(self.binwidth, *STATRANGES[s], resolution = self.resolution)
+                for s in self.stats}
+        return self.bins[chrom]
+
+    def write(self, chrom1, pos1, chrom2, pos2, values):
+        '''Adds a single pair - values are in the same order as cols.'''
+        if chrom1 != chrom2:
+            return
+        if chrom1 not in self._buffers:
+            self._chrombins(chrom1)
+            self._buffers[chrom1] = ([], [])
+        dists, rows = self._buffers[chrom1]
+        dists.append(pos2 - pos1)
+        rows.append(values)
+        if len(dists) >= self.chunksize:
+            self._flush(chrom1)
+
+    def writearrays(self, chrom1, pos1, chrom2, pos2, values):
+        '''Adds pairs given as arrays - values is a dict of column: array.'''
+        if chrom1 != chrom2:
+            return
+        dist = np.asarray(pos2, dtype = np.int64) - np.asarray(pos1, dtype = np.int64)
+        self._add(chrom1, dist, values)
+
+    def _add(self, chrom, dist, values):
+        chrombins = self._chrombins(chrom)
+        for s in self.stats:
+            chrombins[s].add(dist, values[s])
+
+    def _flush(self, chrom):
+        dists, rows = self._buffers[chrom]
+        if dists:
+            values = np.array(rows, dtype = np.float64).reshape(len(rows), len(self.cols))
+            self._add(chrom, dists, {s: values[:, self.cols.index(s)] for s in self.stats})
+        self._buffers[chrom] = ([], [])
+
+    def merge(self, other):
+        '''Adds another BinnedLD (with the same settings) into this one.'''
+        other.flush()
+        self.flush()
+        for chrom, statbins in other.bins.items():
+            chrombins = self._chrombins(chrom)
+            for s in self.stats:
+                chrombins[s].merge(statbins[s])
+        return self
+
+    def flush(self):
+        for chrom in list(self._buffers):
+            self._flush(chrom)
+
+    def summary(self):
+        '''Prints the binned summary for every chromosome and stat.'''
+        self.flush()
+        out = self.file if self.file else sys.stdout
+        if self.title:
+            print(*['chrom', 'stat'] + DistanceBins(self.binwidth).header(self.quantiles), file = out)
+        for chrom, statbins in self.bins.items():
+            for s in self.stats:
+                for row in statbins[s].rows(self.quantiles):
+                    print(chrom, s, *row, file = out)
+
+    def close(self):
+        self.summary()
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__
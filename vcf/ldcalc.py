@@ -6,65 +6,98 @@ Uses LD functions defined in popgen.py.
 AH - 06/2017
 '''
 
+import sys
 import vcf
 import random
 import itertools
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from popgen import *
+from ldcolumns import ColumnWriter
+from ldbins import BinnedLD
+from snpstore import PackedSites
+import snpcache
+from vcfreader import openvcf
 
-def snppuller(vcf_file, chrom = None, start = None, end = None, return_none = False):
+# filters used by snppuller
+def hardsnpcheck(record): # ensure biallelic SNP
+    if len(record.REF) == 1 and len(record.ALT) == 1 and len(record.ALT[0]) == 1 and len(record.alleles) == 2:
+        return True
+    elif len(record.REF) != 1 or len(record.ALT) != 1 or len(record.ALT[0]) != 1 or len(record.alleles) != 2:
+        return False
+    
+def issingleton(record): # ensure not singleton
+    if type(record.INFO['AN']) == list:
+        count = record.INFO['AN'][0] - record.INFO['AC'][0]
+    else:
+        count = record.INFO['AN'] - record.INFO['AC'][0]
+    if count == 1:
+        return True
+    if record.INFO['AC'][0] == 1:
+        return True
+    else:
+        return False
+    
+def isinvariant(record):
+    if record.INFO['AC'][0] == 0:
+        return True
+    if record.INFO['AF'][0] == 1.0:
+        return True
+    else:
+        return False
+
+def snpfilter(record):
+    '''Returns True for the records snppuller keeps - biallelic SNPs that aren't
+    singletons or invariant.
+    '''
+    return hardsnpcheck(record) and not issingleton(record) and not isinvariant(record)
+
+def snppuller(vcf_file, chrom = None, start = None, end = None, return_none = False, cache = True):
     '''Returns a generator object for a specified VCF snippet that returns only
     SNPs, while filtering out singletons.
+    
+    By default, SNPs are read from the preprocessed SNP cache (see snpcache.py), which is
+    compiled on first use - records are then snpstore.CachedRecord objects that stand in
+    for pyVCF records. Set cache = False to parse the VCF directly (see vcfreader.py).
     '''
     
-    vcfin = vcf.Reader(filename = vcf_file, compressed = True)
+    if cache:
+        try:
+            stores = snpcache.cachedsites(vcf_file, chrom)
+        except OSError as e:
+            print('warning: SNP cache unavailable ({0}) - parsing VCF'.format(e), file = sys.stderr)
+            stores = None
+        if stores is not None:
+            for sites in stores:
+                if chrom and start and end:
+                    yield from sites.records(start + 1, end) # same as vcf.Reader.fetch()
+                else:
+                    yield from sites.records()
+            return
+    
+    vcfin = openvcf(vcf_file)
     
-    # filters
-    def hardsnpcheck(record): # ensure biallelic SNP
-        if len(record.REF) == 1 and len(record.ALT) == 1 and len(record.ALT[0]) == 1 and len(record.alleles) == 2:
-            return True
-        elif len(record.REF) != 1 or len(record.ALT) != 1 or len(record.ALT[0]) != 1 or len(record.alleles) != 2:
-            return False
-        
-    def issingleton(record): # ensure not singleton
-        if type(record.INFO['AN']) == list:
-            count = record.INFO['AN'][0] - record.INFO['AC'][0]
-        else:
-            count = record.INFO['AN'] - record.INFO['AC'][0]
-        if count == 1:
-            return True
-        if record.INFO['AC'][0] == 1:
-            return True
-        else:
-            return False
-        
-    def isinvariant(record):
-        if record.INFO['AC'][0] == 0:
-            return True
-        if record.INFO['AF'][0] == 1.0:
-            return True
-        else:
-            return False
-        
     # fetch
     acquired = False
     if chrom and start and end:
         for record in vcfin.fetch(chrom = chrom, start = start, end = end):
-            if hardsnpcheck(record) and not issingleton(record) and not isinvariant(record):
+            if snpfilter(record):
                 acquired = True
                 yield record
             else:
                 pass
     elif chrom and not start or not end:
         for record in vcfin.fetch(chrom = chrom):
-            if hardsnpcheck(record) and not issingleton(record) and not isinvariant(record):
+            if snpfilter(record):
                 acquired = True
                 yield record
             else:
                 pass
     else:
         for record in vcfin:
-            if hardsnpcheck(record) and not issingleton(record) and not isinvariant(record):
+            if snpfilter(record):
                 acquired = True
                 yield record
             else:
@@ -110,8 +143,46 @@ def header(stat, haps = False):
                 print('chrom1', 'pos1', 'chrom2', 'pos2', 'dprime', 'r2', 'hapcount', 'haplist')
         elif len(stat) == 3:
             print('chrom1', 'pos1', 'chrom2', 'pos2', 'd', 'dprime', 'r2', 'hapcount', 'haplist')
+
+def sitestore(vcf_file, chrom, cache = True):
+    '''Returns the SNPs on a chromosome as a snpstore.PackedSites object, from the SNP
+    cache unless cache = False.
+    '''
+    if cache:
+        try:
+            return snpcache.loadsites(vcf_file, chrom)
+        except OSError as e:
+            print('warning: SNP cache unavailable ({0}) - parsing VCF'.format(e), file = sys.stderr)
+    return PackedSites.fromrecords(snppuller(vcf_file, chrom = chrom, cache = False))
+
+def chromstores(vcf_file, cache = True):
+    '''Returns a list of snpstore.PackedSites objects - one per chromosome, in VCF order.'''
+    if cache:
+        try:
+            return snpcache.cachedsites(vcf_file)
+        except OSError as e:
+            print('warning: SNP cache unavailable ({0}) - parsing VCF'.format(e), file = sys.stderr)
+    out = []
+    for chrom, records in itertools.groupby(snppuller(vcf_file, cache = False), key = lambda record: record.CHROM):
+        out.append(PackedSites.fromrecords(records))
+    return out
+
+def ldvalues(pstats, stat):
+    '''Helper function that returns the stats in stat from a PairStats tuple (see
+    pairstats() in popgen), in the same column order as header().
+    '''
+    return [getattr(pstats, s) for s in ['d', 'dprime', 'r2'] if s in stat]
         
 
+def ldcols(stat, haps = False):
+    '''Helper function that returns the value columns for binary output (see ldcolumns.py),
+    in the same order as header(). The haplist column is not stored.
+    '''
+    cols = [s for s in ['d', 'dprime', 'r2'] if s in stat]
+    if haps:
+        cols.append('hapcount')
+    return cols
+
 def gethaps(record1, record2, missing = True):
     '''Returns haps observed between two records as a list. Helper function for
     singlevcfcalc. Based on doublegtcounts() from popgen.
@@ -151,7 +222,135 @@ def gethaps(record1, record2, missing = True):
     out = ','.join([str(hap) for hap in out]) # print nicer
     return out
         
-def singlevcfcalc(vcf_file, ref, target, stat, filter = None, windowsize = None, haps = False):
+def bandedpairs(records, windowsize, GQ_threshold = 30):
+    '''Streams through an ordered iterable of records (ie a single chromosome) once,
+    keeping a deque of SNPs within windowsize bp of the current one. Yields
+    (record1, record2, counts) for every pair with abs(pos2 - pos1) <= windowsize
+    (including each SNP against itself), in the same order as a full nested scan.
+    counts are haplotype counts from popgen.haptally(); site bitsets are only
+    computed once per record.
+    '''
+    records = iter(records)
+    window = deque() # (record, bits) tuples
+    upcoming = next(records, None)
+    current = 0 # index of current record1 in window
+    while current < len(window) or upcoming is not None:
+        if current == len(window):
+            window.append((upcoming, sitebits(upcoming, GQ_threshold)))
+            upcoming = next(records, None)
+        record1, bits1 = window[current]
+        # read ahead to the end of the window
+        while upcoming is not None and upcoming.POS - record1.POS <= windowsize:
+            window.append((upcoming, sitebits(upcoming, GQ_threshold)))
+            upcoming = next(records, None)
+        # drop records that have fallen behind the window
+        while record1.POS - window[0][0].POS > windowsize:
+            window.popleft()
+            current -= 1
+        for record2, bits2 in window:
+            yield record1, record2, bitcounts(*bits1, *bits2)
+        current += 1
+        
+def textvalues(counts, values, cols):
+    '''Helper function - converts stat arrays from ldfromcounts() (plus hapcount, if in cols)
+    into object arrays that print exactly like countstats() output, ie with an int 0
+    wherever countstats() returns one - d for pairs without shared calls, and D'/r2 for
+    pairs where either site is monomorphic among the shared calls.
+    '''
+    AB, Ab, aB, ab = counts
+    nocalls = (AB + Ab + aB + ab) == 0
+    monomorphic = ((AB + Ab) == 0) | ((aB + ab) == 0) | ((AB + aB) == 0) | ((Ab + ab) == 0)
+    out = []
+    for s in cols:
+        column = values[s].astype(object)
+        if s == 'd':
+            column[nocalls] = 0
+        elif s in ('dprime', 'r2'):
+            column[monomorphic] = 0
+        out.append(column)
+    return out
+
+def transvcfcalc(vcf_file, ref, target, stat, filter = None, windowsize = None, haps = False, out = None,
+        bins = None, tilesize = 512, threads = None, minld = None):
+    '''
+    Tiled LD engine for comparisons between two different regions - called by singlevcfcalc
+    when ref != target, and takes the same arguments (output is identical).
+    
+    Both regions are read in once (see sitestore()) and the ref x target pair matrix is
+    split into tilesize x tilesize tiles. Haplotype counts for a whole tile come from four
+    matrix products of the unpacked called/alt matrices, which only count strains called
+    at both sites of each pair (see PackedSites.matmulcounts()). The tiles in each strip of
+    ref SNPs are spread over a pool of threads (numpy releases the GIL for the matrix
+    products), and output is written strip by strip in the same order as singlevcfcalc.
+    
+    threads - number of threads [default: ThreadPoolExecutor's default]
+    minld - only output pairs where the absolute value of the first stat given
+    (ie d in 'd/r2') is at least minld. Optional.
+    
+    The filter keeps each pair with probability filter, as in singlevcfcalc.
+    '''
+    stat = stat.split('/') # get stat
+    cols = ldcols(stat, haps)
+    if bins:
+        writer = BinnedLD(bins, cols)
+    elif out:
+        writer = ColumnWriter(out, cols)
+    else:
+        writer = None
+        header(stat, haps) # print header
+
+    refsites = sitestore(vcf_file, ref)
+    targetsites = sitestore(vcf_file, target)
+
+    def tilecalc(tile):
+        i0, i1, j0, j1 = tile
+        counts = refsites.matmulcounts(slice(i0, i1), slice(j0, j1), other = targetsites)
+        values = ldfromcounts(*counts, stats = stat)
+        if haps:
+            values['hapcount'] = sum((c > 0).astype(np.int64) for c in counts)
+        pos1 = refsites.positions[i0:i1]
+        pos2 = targetsites.positions[j0:j1]
+        keep = np.ones((i1 - i0, j1 - j0), dtype = bool)
+        if windowsize:
+            keep &= np.abs(pos2[None, :].astype(np.int64) - pos1[:, None]) <= windowsize
+        if minld is not None:
+            keep &= np.abs(values[stat[0]]) >= minld
+        if filter:
+            keep &= np.random.random(keep.shape) <= filter
+        if writer: # binary or binned output - written out in the main thread
+            rowidx, colidx = np.nonzero(keep)
+            return pos1[rowidx], pos2[colidx], {s: values[s][keep] for s in cols}
+        columns = textvalues(counts, values, cols)
+        pos2 = pos2.tolist()
+        rows = []
+        for i, p1 in enumerate(pos1.tolist()):
+            prefix = refsites.chrom + ' ' + str(p1) + ' ' + targetsites.chrom + ' '
+            lines = []
+            for j in np.flatnonzero(keep[i]).tolist():
+                fields = [str(pos2[j])] + [str(c[i, j]) for c in columns]
+                if haps:
+                    fields.append(gethaps(refsites.record(i0 + i), targetsites.record(j0 + j)))
+                lines.append(prefix + ' '.join(fields) + '\n')
+            rows.append(''.join(lines))
+        return rows
+
+    with ThreadPoolExecutor(max_workers = threads) as pool:
+        for i0 in tqdm(range(0, len(refsites), tilesize)):
+            i1 = min(i0 + tilesize, len(refsites))
+            tiles = [(i0, i1, j0, min(j0 + tilesize, len(targetsites))) for j0 in range(0, len(targetsites), tilesize)]
+            results = list(pool.map(tilecalc, tiles))
+            if writer:
+                for pos1, pos2, values in results:
+                    writer.writearrays(refsites.chrom, pos1, targetsites.chrom, pos2, values)
+            else:
+                for rowparts in zip(*results): # one ref SNP at a time
+                    sys.stdout.write(''.join(rowparts))
+    
+    if writer:
+        writer.close()
+
+def singlevcfcalc(vcf_file, ref, target, stat, filter = None, windowsize = None, haps = False, out = None, bins = None,
+        tilesize = 512, threads = None, minld = None):
     '''
     In a single VCF, calculates linkage stats between two entire regions.
     The stat parameter can take any of 'd', 'dprime', or 'r2' as input. 
@@ -169,57 +368,59 @@ def singlevcfcalc(vcf_file, ref, target, stat, filter = None, windowsize = None,
     
     Setting haps to True will also print out how many of the four possible haplotypes
     were actually present in the final comparison.
+    
+    If a windowsize is given for an intra-region comparison, the region is streamed
+    through once and each SNP is only compared against the SNPs within windowsize
+    (see bandedpairs()), instead of re-reading the whole region for every SNP.
+    
+    If out is given as a directory name, output is written there in binary columnar
+    format (see ldcolumns.py) instead of being printed. haplist is not stored.
+    
+    If bins is given as a bin width in bp, pairs aren't printed - instead, a summary of
+    each stat per distance bin (count, mean, sd, quantiles) is printed for each chromosome
+    at the end (see ldbins.py). Pairs between chromosomes are skipped.
+    
+    Comparisons between two different regions are handed to the tiled engine in
+    transvcfcalc(), which also takes tilesize, threads and minld (an output threshold).
     '''
+    if ref != target:
+        return transvcfcalc(vcf_file, ref, target, stat, filter = filter, windowsize = windowsize, haps = haps,
+            out = out, bins = bins, tilesize = tilesize, threads = threads, minld = minld)
+    
     
     def metadata(record1, record2):
         out = record1.CHROM + ' ' + str(record1.POS) + ' ' + record2.CHROM + ' ' + str(record2.POS)
         return out
     
-    def ldgetter(record1, record2):
-        if haps == False: # proceed w/o haps
-            if len(stat) == 1:
-                if 'd' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2))
-                elif 'dprime' in stat:
-                    print(metadata(record1, record2), dprimecalc(record1, record2))
-                elif 'r2' in stat:
-                    print(metadata(record1, record2), r2calc(record1, record2))
-            elif len(stat) == 2:
-                if 'd' in stat and 'dprime' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2))
-                elif 'd' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-                elif 'dprime' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-            elif len(stat) == 3:
-                print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2))
-        
+    def ldgetter(record1, record2, pstats = None):
+        if pstats is None:
+            pstats = pairstats(record1, record2, stats = stat, snpcheck = False)
+        if writer: # binary or binned output
+            values = ldvalues(pstats, stat) + ([pstats.hapcount] if haps else [])
+            writer.write(record1.CHROM, record1.POS, record2.CHROM, record2.POS, values)
+        elif haps == False: # proceed w/o haps
+            print(metadata(record1, record2), *ldvalues(pstats, stat))
         elif haps == True: # show haps/4 for each comparison
-            observed_haps = list(freqsgetter(record1, record2)[2].values()) # get hap frequencies
-            hapcount = 4 - observed_haps.count(0)
             haplist = gethaps(record1, record2)
-            if len(stat) == 1:
-                if 'd' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), hapcount, haplist)
-                elif 'dprime' in stat:
-                    print(metadata(record1, record2), dprimecalc(record1, record2), hapcount, haplist)
-                elif 'r2' in stat:
-                    print(metadata(record1, record2), r2calc(record1, record2), hapcount, haplist)
-            elif len(stat) == 2:
-                if 'd' in stat and 'dprime' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), hapcount, haplist)
-                elif 'd' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2), hapcount, haplist)
-                elif 'dprime' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2), hapcount, haplist)
-            elif len(stat) == 3:
-                print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2), hapcount, haplist)
+            print(metadata(record1, record2), *ldvalues(pstats, stat), pstats.hapcount, haplist)
             
     reflocus = snppuller(vcf_file, chrom = ref) # create ref vcf record generator
     stat = stat.split('/') # get stat
-    header(stat, haps) # print header
+    if bins:
+        writer = BinnedLD(bins, ldcols(stat, haps))
+    elif out:
+        writer = ColumnWriter(out, ldcols(stat, haps))
+    else:
+        writer = None
+        header(stat, haps) # print header
     
-    if not filter:
+    if windowsize and ref == target: # banded - single pass over region
+        for record1, record2, counts in bandedpairs(tqdm(reflocus), windowsize):
+            if filter and random.random() > filter:
+                continue
+            ldgetter(record1, record2, countstats(*counts, stats = stat))
+    
+    elif not filter:
         for record1 in tqdm(reflocus):
             targetlocus = snppuller(vcf_file, chrom = target)
             if len(record1.ALT) > 1:
@@ -249,8 +450,33 @@ def singlevcfcalc(vcf_file, ref, target, stat, filter = None, windowsize = None,
                             continue
                 elif random.random() > filter:
                     continue
+    
+    if writer:
+        writer.close()
 
-def sequentialvcfcalc(vcf_file, ref, target, stat, windowsize = None, haps = False):
+def sequentialpairs(refsites, targetsites, windowsize = None):
+    '''Helper function for sequentialvcfcalc - returns (idx1, idx2) arrays of row pairs,
+    forward pairs (ref[i], target[i]) followed by offset pairs (ref[i + 1], target[i]).
+    Pairs only run as far as the shorter region allows. If both are the same store, the
+    forward pairs would be each SNP against itself, so only offset (ie adjacent) pairs are
+    returned. Pairs more than windowsize bp apart are dropped if a windowsize is given.
+    '''
+    numref, numtarget = len(refsites), len(targetsites)
+    forward = np.arange(min(numref, numtarget))
+    offset = np.arange(min(numref - 1, numtarget))
+    if refsites is targetsites:
+        idx1, idx2 = offset + 1, offset
+    else:
+        idx1 = np.concatenate([forward, offset + 1])
+        idx2 = np.concatenate([forward, offset])
+    if windowsize:
+        dist = np.abs(targetsites.positions[idx2].astype(np.int64) - refsites.positions[idx1])
+        keep = dist <= windowsize
+        idx1, idx2 = idx1[keep], idx2[keep]
+    return idx1, idx2
+
+def sequentialvcfcalc(vcf_file, ref, target, stat, windowsize = None, haps = False, out = None, bins = None,
+        chunksize = 100000):
     '''
     Calculates LD for 'sequential' pairs as described in Lewontin 1995.
     
@@ -265,89 +491,53 @@ def sequentialvcfcalc(vcf_file, ref, target, stat, windowsize = None, haps = Fal
     'reverse' direction. The net effect is acquiring LD values for Aa, aB, Bb, bC, and so forth.
     This preserves independence of pairwise tests.
     
+    For intra-region calculations, the 'forward' pairs would just be each SNP against itself,
+    so only the 'reverse' pairs - ie each SNP and the next - are computed (BA, CB...).
+    
     Removed filter option from singlevcfcalc - was unused. For filtering, filter input vcf using 
     vcf_subset prior to calculation.
     
-    Caution: sequentialvcfcalc behaves erratically when presented with two regions
-    of different lengths, either repeating earlier SNPs for new comparisons or ending its iterations early. 
-    As such, it is best used for intra-region calculations. There are currently no plans to introduce 
-    mathematically robust inter-region compatibility.
-    '''
+    Each region is read in once (see sitestore()), and pairs are picked by index (see
+    sequentialpairs()) and computed in batches of chunksize. When the two regions have
+    different numbers of SNPs, pairs stop at the end of the shorter region - earlier SNPs
+    are no longer recycled.
     
-    def metadata(record1, record2):
-        out = record1.CHROM + ' ' + str(record1.POS) + ' ' + record2.CHROM + ' ' + str(record2.POS)
-        return out
-    
-    def ldgetter(record1, record2):
-        if haps == False: # proceed w/o haps
-            if len(stat) == 1:
-                if 'd' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2))
-                elif 'dprime' in stat:
-                    print(metadata(record1, record2), dprimecalc(record1, record2))
-                elif 'r2' in stat:
-                    print(metadata(record1, record2), r2calc(record1, record2))
-            elif len(stat) == 2:
-                if 'd' in stat and 'dprime' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2))
-                elif 'd' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-                elif 'dprime' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-            elif len(stat) == 3:
-                print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2))
-        
-        elif haps == True: # show haps/4 for each comparison
-            observed_haps = list(freqsgetter(record1, record2)[2].values()) # get hap frequencies
-            hapcount = 4 - observed_haps.count(0)
-            if len(stat) == 1:
-                if 'd' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), hapcount)
-                elif 'dprime' in stat:
-                    print(metadata(record1, record2), dprimecalc(record1, record2), hapcount)
-                elif 'r2' in stat:
-                    print(metadata(record1, record2), r2calc(record1, record2), hapcount)
-            elif len(stat) == 2:
-                if 'd' in stat and 'dprime' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), hapcount)
-                elif 'd' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2), hapcount)
-                elif 'dprime' in stat and 'r2' in stat:
-                    print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2), hapcount)
-            elif len(stat) == 3:
-                print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2), hapcount)
-            
+    If out is given as a directory name, output is written there in binary columnar
+    format (see ldcolumns.py) instead of being printed, and if bins is given as a bin width,
+    only per-distance-bin summaries are printed (see singlevcfcalc()).
+    '''
     stat = stat.split('/') # get stat
-    header(stat, haps) # print header
-    # create ref vcf record list. this cannot be a generator bc itertools.cycle()
-    reflocus = [record for record in reclist(vcf_file, chrom = ref, snpsonly = True)]
-    targetlocus = [record for record in reclist(vcf_file, chrom = target, snpsonly = True)]
-
-    # forward
-    for record1, record2 in tqdm(zip(itertools.cycle(reflocus), targetlocus)):
-        if not windowsize:
-            ldgetter(record1, record2)
-        elif windowsize:
-            if abs(record2.POS - record1.POS) <= windowsize:
-                ldgetter(record1, record2)
-            elif abs(record2.POS - record1.POS) > windowsize:
-                continue
-        continue
+    cols = ldcols(stat, haps)
+    if bins:
+        writer = BinnedLD(bins, cols)
+    elif out:
+        writer = ColumnWriter(out, cols)
+    else:
+        writer = None
+        header(stat, haps) # print header
 
-    # reverse
-    # load in records again
-    reflocus_rev = [record for record in reclist(vcf_file, chrom = ref, snpsonly = True)][1:] # 'waste' first record to make offset
-    targetlocus_rev = [record for record in reclist(vcf_file, chrom = target, snpsonly = True)]
+    refsites = sitestore(vcf_file, ref)
+    targetsites = refsites if target == ref else sitestore(vcf_file, target)
+    idx1, idx2 = sequentialpairs(refsites, targetsites, windowsize)
 
-    for record2, record1 in tqdm(zip(itertools.cycle(targetlocus_rev), reflocus_rev)): # keep ordering of rec1, rec2 consistent with previous for loop
-        if len(record1.ALT) > 1:
+    for start in tqdm(range(0, len(idx1), chunksize)):
+        chunk1, chunk2 = idx1[start:start + chunksize], idx2[start:start + chunksize]
+        counts = refsites.hapcounts(chunk1, chunk2, other = targetsites)
+        pos1 = refsites.positions[chunk1]
+        pos2 = targetsites.positions[chunk2]
+        if writer: # binary or binned output
+            values = ldfromcounts(*counts, stats = stat)
+            if haps:
+                values['hapcount'] = sum((c > 0).astype(np.int64) for c in counts)
+            writer.writearrays(refsites.chrom, pos1, targetsites.chrom, pos2, values)
             continue
-        if not windowsize:
-            ldgetter(record1, record2)
-        elif windowsize: # if a windowsize is provided
-            if abs(record2.POS - record1.POS) <= windowsize:
-                ldgetter(record1, record2)
-            elif abs(record2.POS - record1.POS) > windowsize:
-                continue
-
-  
+        # text output goes through countstats() so values print exactly as before
+        lines = []
+        for p1, p2, AB, Ab, aB, ab in zip(pos1.tolist(), pos2.tolist(), *(c.tolist() for c in counts)):
+            pstats = countstats(AB, Ab, aB, ab, stats = stat)
+            values = ldvalues(pstats, stat) + ([pstats.hapcount] if haps else [])
+            lines.append(' '.join([refsites.chrom, str(p1), targetsites.chrom, str(p2)] + [str(v) for v in values]) + '\n')
+        sys.stdout.write(''.join(lines))
+    
+    if writer:
+        writer.close()
@@ -0,0 +1,193 @@
+'''
+ldcolumns.py - binary, columnar storage of pairwise LD output
+
+An alternative to the space-separated text the LD drivers print. Pairs are written to
+a directory of compressed .npz chunks, each holding the pairs for one chromosome pair:
+pos1 and pos2 as int32, and each stat as float32 (hapcount as int8).
+
+An index.txt file in the same directory records each chunk's chromosome pair, row
+count, and the min/max of pos1, pos2 and pair distance, so that the reader only has
+to decompress chunks that overlap a query. For those ranges to be narrow whatever
+order pairs are written in, buffered pairs are split into groups by distance, then
+sorted by pos1 within each group and cut into chunks - so queries get rows back
+chunk by chunk, not in the order they were written.
+
+usage:
+writer = ColumnWriter('chr6_ld', ['d', 'r2'])
+writer.write('chromosome_6', 100, 'chromosome_6', 250, [0.1, 0.4])
+writer.close()
+
+ld = ColumnReader('chr6_ld')
+region = ld.fetch('chromosome_6', 1, 50000) # all pairs with pos1 in 1-50000
+r2 = ld.band('chromosome_6', 1000, 2000)['r2'] # all pairs 1-2 kb apart
+'''
+
+import os
+import numpy as np
+
+_INDEX_COLS = ['file', 'chrom1', 'chrom2', 'rows', 'pos1_min', 'pos1_max',
+    'pos2_min', 'pos2_max', 'dist_min', 'dist_max']
+
+def _dtype(col):
+    '''Storage type for a column.'''
+    if col in ('pos1', 'pos2'):
+        return np.int32
+    elif col == 'hapcount':
+        return np.int8
+    else:
+        return np.float32
+
+class ColumnWriter(object):
+    '''Writes LD output as compressed column chunks + an index.
+
+    outdir - directory to write to (created if needed)
+    cols - names of the value columns, in the order they're given to write()
+    (ie the requested stats in header() order, plus 'hapcount' if needed)
+    chunksize - number of pairs buffered (per chromosome pair) before writing out
+    blocksize - number of pairs per chunk
+    distgroups - number of distance groups the buffered pairs are split into
+    '''
+    def __init__(self, outdir, cols, chunksize = 1000000, blocksize = 16384, distgroups = 4):
+        self.outdir = outdir
+        self.cols = list(cols)
+        self.chunksize = chunksize
+        self.blocksize = blocksize
+        self.distgroups = distgroups
+        self._buffers = {} # (chrom1, chrom2): {col: list}
+        self._buffered = {}
+        self._index = []
+        os.makedirs(outdir, exist_ok = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _buffer(self, chrom1, chrom2):
+        key = (chrom1, chrom2)
+        if key not in self._buffers:
+            self._buffers[key] = {col: [] for col in ['pos1', 'pos2'] + self.cols}
+            self._buffered[key] = 0
+        return key, self._buffers[key]
+
+    def write(self, chrom1, pos1, chrom2, pos2, values):
+        '''Adds a single pair. values should be in the same order as cols.'''
+        key, buf = self._buffer(chrom1, chrom2)
+        buf['pos1'].append(pos1)
+        buf['pos2'].append(pos2)
+        for col, value in zip(self.cols, values):
+            buf[col].append(value)
+        self._buffered[key] += 1
+        if self._buffered[key] >= self.chunksize:
+            self._flush(key)
+
+    def writearrays(self, chrom1, pos1, chrom2, pos2, values):
+        '''Adds many pairs on one chromosome pair at once. pos1, pos2 and each
+        entry of values (a dict keyed by column name) are equal-length arrays.
+        '''
+        key, buf = self._buffer(chrom1, chrom2)
+        buf['pos1'].append(np.asarray(pos1, dtype = np.int32))
+        buf['pos2'].append(np.asarray(pos2, dtype = np.int32))
+        for col in self.cols:
+            buf[col].append(np.asarray(values[col], dtype = _dtype(col)))
+        self._buffered[key] += len(pos1)
+        if self._buffered[key] >= self.chunksize:
+            self._flush(key)
+
+    def _flush(self, key):
+        '''Writes out the buffer for a chromosome pair as chunks - split into (up to)
+        distgroups groups of similar distance, each sorted by pos1 and cut into chunks of
+        blocksize pairs, so that each chunk covers a narrow range of both.
+        '''
+        if not self._buffered.get(key):
+            return
+        buf = self._buffers[key]
+        arrays = {}
+        for col, values in buf.items():
+            parts = [np.atleast_1d(np.asarray(v, dtype = _dtype(col))) for v in values]
+            arrays[col] = np.concatenate(parts)
+        pos1 = arrays['pos1'].astype(np.int64)
+        pos2 = arrays['pos2'].astype(np.int64)
+        dist = np.abs(pos2 - pos1)
+        numgroups = max(1, min(self.distgroups, -(-len(pos1) // self.blocksize)))
+        for group in np.array_split(np.argsort(dist, kind = 'stable'), numgroups):
+            group = group[np.argsort(pos1[group], kind = 'stable')]
+            for start in range(0, len(group), self.blocksize):
+                rows = group[start:start + self.blocksize]
+                self._writechunk(key, {col: values[rows] for col, values in arrays.items()},
+                    pos1[rows], pos2[rows], dist[rows])
+        self._buffers[key] = {col: [] for col in buf}
+        self._buffered[key] = 0
+
+    def _writechunk(self, key, arrays, pos1, pos2, dist):
+        '''Writes one chunk and adds it to the index.'''
+        filename = 'chunk_{0:06d}.npz'.format(len(self._index))
+        np.savez_compressed(os.path.join(self.outdir, filename), **arrays)
+        self._index.append([filename, key[0], key[1], len(pos1), pos1.min(), pos1.max(),
+            pos2.min(), pos2.max(), dist.min(), dist.max()])
+
+    def close(self):
+        '''Flushes remaining pairs and writes the index.'''
+        for key in list(self._buffers):
+            self._flush(key)
+        with open(os.path.join(self.outdir, 'index.txt'), 'w') as f:
+            f.write(' '.join(_INDEX_COLS) + '\n')
+            f.write('#cols ' + ' '.join(self.cols) + '\n')
+            for entry in self._index:
+                f.write(' '.join(str(x) for x in entry) + '\n')
+
+class ColumnReader(object):
+    '''Reads LD output written by ColumnWriter. Queries only load the chunks
+    that the index says could contain matching pairs, and return a dict of
+    column arrays (pos1, pos2, and one per stat).
+    '''
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.index = []
+        with open(os.path.join(outdir, 'index.txt')) as f:
+            next(f) # column names
+            self.cols = f.readline().rstrip('\n').split(' ')[1:]
+            for line in f:
+                row = line.split()
+                entry = dict(zip(_INDEX_COLS, [row[0], row[1], row[2]] + [int(x) for x in row[3:]]))
+                self.index.append(entry)
+
+    def chroms(self):
+        '''Returns the chromosome pairs present in the output.'''
+        return sorted(set((e['chrom1'], e['chrom2']) for e in self.index))
+
+    def _select(self, entries, rowfilter):
+        '''Loads the given chunks and concatenates rows passing rowfilter.'''
+        out = {col: [] for col in ['pos1', 'pos2'] + self.cols}
+        for entry in entries:
+            with np.load(os.path.join(self.outdir, entry['file'])) as chunk:
+                keep = rowfilter(chunk['pos1'].astype(np.int64), chunk['pos2'].astype(np.int64))
+                for col in out:
+                    out[col].append(chunk[col][keep])
+        return {col: np.concatenate(v) if v else np.array([], dtype = _dtype(col)) for col, v in out.items()}
+
+    def fetch(self, chrom, start = None, end = None, chrom2 = None):
+        '''All pairs with pos1 on chrom between start and end (inclusive), against
+        chrom2 (default chrom).
+        '''
+        chrom2 = chrom if chrom2 is None else chrom2
+        lo = -1 if start is None else start
+        hi = np.iinfo(np.int64).max if end is None else end
+        entries = [e for e in self.index if e['chrom1'] == chrom and e['chrom2'] == chrom2
+            and e['pos1_max'] >= lo and e['pos1_min'] <= hi]
+        return self._select(entries, lambda pos1, pos2: (pos1 >= lo) & (pos1 <= hi))
+
+    def band(self, chrom, mindist, maxdist, start = None, end = None):
+        '''All intra-chromosome pairs on chrom with mindist <= abs(pos2 - pos1) <= maxdist,
+        optionally restricted to pos1 between start and end.
+        '''
+        lo = -1 if start is None else start
+        hi = np.iinfo(np.int64).max if end is None else end
+        entries = [e for e in self.index if e['chrom1'] == chrom and e['chrom2'] == chrom
+            and e['dist_max'] >= mindist and e['dist_min'] <= maxdist
+            and e['pos1_max'] >= lo and e['pos1_min'] <= hi]
+        def rowfilter(pos1, pos2):
+            dist = np.abs(pos2 - pos1)
+            return (dist >= mindist) & (dist <= maxdist) & (pos1 >= lo) & (pos1 <= hi)
+        return self._select(entries, rowfilter)
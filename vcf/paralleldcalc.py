@@ -1,83 +1,152 @@
 '''
-parallelldcalc.py - an attempt to parallelize ldcalc's operations
+paralleldcalc.py - multi-core LD calculation between two regions of a single vcf
 
-Uses LD functions defined in popgen.py and ldcalc.py
+Uses LD functions defined in popgen.py, ldcalc.py and snpstore.py
 
-probably doesn't work yet so be wary
+Both regions are read in and bit-packed once (see snpstore.PackedSites). The pair
+space (ref SNPs x target SNPs) is then split into tiles, which are handed to a
+persistent pool of worker processes - workers receive the packed genotype arrays
+once at startup rather than pickled pyVCF records. The main process is the only
+one that writes, and output comes out in the same order as singlevcfcalc.
+
+usage: python paralleldcalc.py -v [vcf (.gz)] -r [region 1] [region 2] -l [ld stats] -p [processes] > [outfile]
+
+LD stats can be any combination of d, dprime, or r2 - separate by a slash (i.e. r2/dprime) for more than one.
+For intra-region calculations, enter the same region twice. A windowsize (-w) can be given for
+intra-region calculations, in which case tiles entirely outside the window are skipped.
 
 AH - 06/2017
 '''
 
-import vcf
-import itertools
 import sys
+import argparse
+import numpy as np
 from multiprocessing import Pool
+from tqdm import tqdm
 from popgen import *
 from ldcalc import *
 
-vcfin = sys.argv[1]
-region1 = sys.argv[2]
-region2 = sys.argv[3]
-stats = sys.argv[4]
-processes = sys.argv[5]
+# set in each worker by _init_worker
+_refsites = None
+_targetsites = None
+_stat = None
+_windowsize = None
+
+def _init_worker(refsites, targetsites, stat, windowsize):
+    '''Pool initializer - stores packed sites + settings as globals in each worker.'''
+    global _refsites, _targetsites, _stat, _windowsize
+    _refsites = refsites
+    _targetsites = targetsites
+    _stat = stat
+    _windowsize = windowsize
 
-def metadata(record1, record2):
-        out = record1.CHROM + ' ' + str(record1.POS) + ' ' + record2.CHROM + ' ' + str(record2.POS)
-        return out
+def tiler(numref, numtarget, tilesize, refsites = None, targetsites = None, windowsize = None):
+    '''Splits the pair space into (i0, i1, j0, j1) tiles, in row-major order.
+    If a windowsize is given, tiles with no pair within windowsize bp are dropped.
+    '''
+    tiles = []
+    for i0 in range(0, numref, tilesize):
+        i1 = min(i0 + tilesize, numref)
+        for j0 in range(0, numtarget, tilesize):
+            j1 = min(j0 + tilesize, numtarget)
+            if windowsize:
+                refmin, refmax = refsites.positions[i0], refsites.positions[i1 - 1]
+                targetmin, targetmax = targetsites.positions[j0], targetsites.positions[j1 - 1]
+                if targetmin - refmax > windowsize or refmin - targetmax > windowsize:
+                    continue
+            tiles.append((i0, i1, j0, j1))
+    return tiles
 
-def ldgetter(record1, record2, stat):
-    '''Helper function for parallelvcfcalc.
+def tilecalc(tile):
+    '''Worker function - computes LD stats for every pair in a tile. Returns the tile
+    along with its output text, as a list with one (possibly empty) string per ref row.
     '''
-    if len(stat) == 1:
-        if 'd' in stat:
-            print(metadata(record1, record2), dcalc(record1, record2))
-        elif 'dprime' in stat:
-            print(metadata(record1, record2), dprimecalc(record1, record2))
-        elif 'r2' in stat:
-            print(metadata(record1, record2), r2calc(record1, record2))
-    elif len(stat) == 2:
-        if 'd' in stat and 'dprime' in stat:
-            print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2))
-        elif 'd' in stat and 'r2' in stat:
-            print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-        elif 'dprime' in stat and 'r2' in stat:
-            print(metadata(record1, record2), dcalc(record1, record2), r2calc(record1, record2))
-    elif len(stat) == 3:
-        print(metadata(record1, record2), dcalc(record1, record2), dprimecalc(record1, record2), r2calc(record1, record2))
-
-def parallelvcfcalc(vcf_file, ref, target, stat, num_processes = 1):
+    i0, i1, j0, j1 = tile
+    counts = _refsites.blockcounts(np.arange(i0, i1), np.arange(j0, j1), other = _targetsites)
+    stats = ldfromcounts(*counts, stats = _stat)
+    values = textvalues(counts, stats, [s for s in ['d', 'dprime', 'r2'] if s in _stat])
+    pos1 = _refsites.positions[i0:i1]
+    pos2 = _targetsites.positions[j0:j1]
+    if _windowsize:
+        keep = np.abs(pos2[None, :].astype(np.int64) - pos1[:, None]) <= _windowsize
+    else:
+        keep = np.ones((i1 - i0, j1 - j0), dtype = bool)
+    chrom1 = _refsites.chrom
+    chrom2 = _targetsites.chrom
+    pos2 = pos2.tolist()
+    rows = []
+    for i, p1 in enumerate(pos1.tolist()):
+        prefix = chrom1 + ' ' + str(p1) + ' ' + chrom2 + ' '
+        lines = [prefix + ' '.join([str(pos2[j])] + [str(v[i, j]) for v in values]) + '\n'
+            for j in np.flatnonzero(keep[i]).tolist()]
+        rows.append(''.join(lines))
+    return tile, rows
+
+def parallelvcfcalc(vcf_file, ref, target, stat, num_processes = 1, windowsize = None, tilesize = 256):
     '''
-    In a single VCF, calculates linkage stats between two entire regions.
-    The stat parameter can take any of 'd', 'dprime', or 'r2' as input. 
+    In a single VCF, calculates linkage stats between two entire regions over several processes.
+    The stat parameter can take any of 'd', 'dprime', or 'r2' as input.
     Multiple parameters can be provided if separated by a forward slash (ie 'd/dprime' or 'r2/d').
-    Output is printed in a space separated format.
-    
+    Output is printed in a space separated format, in the same order as singlevcfcalc.
+
     usage - parallelvcfcalc('myfile.vcf.gz', 'chromosome_6', 'chromosome_7', 'd/r2', 4)
     will calculate both d and r2 between sites on chr6 and chr7 using 4 parallel processes.
-    
+
     For intrachromosomal stats, simply input the same region twice:
     parallelvcfcalc('myfile.vcf.gz', 'chromosome_6', 'chromosome_6', 'd/dprime', 4)
-    
+
     num_processes will set how many processes Python will use in completing
-    the operation.
+    the operation, and tilesize the number of ref/target SNPs per tile.
     '''
-    reflocus = snppuller(vcf_file, chrom = ref)
     stat = stat.split('/')
+    refsites = sitestore(vcf_file, ref)
+    if target == ref:
+        targetsites = refsites
+    else:
+        targetsites = sitestore(vcf_file, target)
+        windowsize = None # window only makes sense within a region
     header(stat) # print header
-    # parallel process begins here
-    for record1 in reflocus:
-        targetlocus = snppuller(vcf_file, chrom = target)
-        chunk = [i for i in itertools.islice(targetlocus, num_processes)]
-        while True:
-            pool = Pool(processes = num_processes)
-            pool.starmap(ldgetter, zip(itertools.repeat(record1), chunk, itertools.repeat(stat)))
-            pool.close()
-            pool.join()
-            chunk = [i for i in itertools.islice(targetlocus, num_processes)] # get next chunk
-            if len(chunk) == 0:
-                break
+    tiles = tiler(len(refsites), len(targetsites), tilesize, refsites, targetsites, windowsize)
+
+    # rows of the current strip of ref SNPs, filled in tile by tile
+    strip = None
+    strip_tiles = []
+    with Pool(processes = num_processes, initializer = _init_worker,
+            initargs = (refsites, targetsites, stat, windowsize)) as pool:
+        for tile, rows in tqdm(pool.imap(tilecalc, tiles), total = len(tiles)):
+            if strip is not None and tile[0] != strip:
+                _writestrip(strip_tiles)
+                strip_tiles = []
+            strip = tile[0]
+            strip_tiles.append(rows)
+        if strip_tiles:
+            _writestrip(strip_tiles)
+
+def _writestrip(strip_tiles):
+    '''Writes out a completed strip of tiles one ref SNP at a time, so that output
+    is ordered by ref SNP and then by target SNP.
+    '''
+    for rowparts in zip(*strip_tiles):
+        sys.stdout.write(''.join(rowparts))
 
-parallelvcfcalc(vcfin, region1, region2, stat = stats, num_processes = processes)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Calculate LD stats between two regions in a VCF file over multiple processes.',
+                                    usage = 'paralleldcalc.py [options]')
 
+    parser.add_argument('-v', '--vcfinput', required = True,
+                       type = str, help = 'Input VCF')
+    parser.add_argument('-r', '--regions', required = True,
+                       type = str, nargs = 2, help = 'Two regions to compare (as they appear in the vcf)')
+    parser.add_argument('-l', '--ldstats', required = True,
+                       type = str, help = 'LD stats to calculate, separated by forward slashes (i.e. d/dprime)')
+    parser.add_argument('-p', '--processes', required = False, default = 1,
+                       type = int, help = 'Number of processes to use [default 1]')
+    parser.add_argument('-w', '--windowsize', required = False,
+                       type = int, help = 'Window size to calculate LD between. Only used for intra-region calculations. Optional.')
+    parser.add_argument('-s', '--tilesize', required = False, default = 256,
+                       type = int, help = 'Number of SNPs per side of each tile [default 256]')
 
+    args = parser.parse_args()
 
+    parallelvcfcalc(args.vcfinput, args.regions[0], args.regions[1], stat = args.ldstats,
+        num_processes = args.processes, windowsize = args.windowsize, tilesize = args.tilesize)
@@ -1,6 +1,6 @@
 '''
-popgen v0.6
-(requires pyVCF)
+popgen v0.7
+(requires pyVCF + numpy)
 
 Functions that calculate useful population genetics statistics
 between a pair of VCF records - ideally SNPs with single ALTs. Deviations from this
@@ -13,6 +13,13 @@ using reclist() and run functions on records out of the resultant list objects.
 If working with known sites, reclook() allows for easy access of records based on 
 their genomic positions and can be entered as input to the pop gen functions. 
 
+Pairwise stats are tallied from per-site bitsets (see sitebits()) with ANDs and 
+popcounts. Bitsets and tallies are memoized in bounded LRU caches keyed on the reader a
+record came from, chromosome, position and alleles - see sitekey(), memoconfig(),
+memostats() and memoclear(). For larger jobs, genomatrix() encodes a block of records
+into a NumPy genotype matrix once, after which ldmatrix() and friends compute D, D' and r2 for many
+pairs at once. These give the same numbers as the per-pair functions.
+
 These functions are only compatible with haploid genomes (for now). 
 Use with higher ploidies at your own risk.
 
@@ -22,7 +29,11 @@ Python library down the line.
 AH - 06/2017
 '''
 
+import sys
 import vcf
+import numpy as np
+from collections import namedtuple, OrderedDict
+from vcfreader import openvcf
 
 def snpchecker(record1, record2):
     '''Given two VCF records, checks whether they are SNPs with single ALTs each.
@@ -43,19 +54,11 @@ def straingetter(record1, record2, GQ_threshold = 30):
     '''Given two VCF records, returns a list of individuals in the population that
     contain calls at both sites. Helper function for LD calculations.
     Will filter strains for GQ (default 30).
+    Strains are returned in VCF order - the intersection is a single AND of the
+    two sites' callable masks (see sitebits()).
     '''
-    rec1set = set([record1.samples[i].sample for i in range(len(record1.samples)) if record1.samples[i]['GT'] != '.'])
-    rec2set = set([record2.samples[i].sample for i in range(len(record2.samples)) if record2.samples[i]['GT'] != '.'])
-    strainlist = list(rec1set.intersection(rec2set))
-    # filter for GQ
-    garbage = []
-    for strain in strainlist:
-        if record1.genotype(strain)['GQ'] < GQ_threshold or record2.genotype(strain)['GQ'] < GQ_threshold:
-            garbage.append(strain)
-    if len(garbage) > 0:
-        for trash_strain in garbage:
-            strainlist.remove(trash_strain)
-    return strainlist
+    both = sitebits(record1, GQ_threshold)[1] & sitebits(record2, GQ_threshold)[1]
+    return [call.sample for i, call in enumerate(record1.samples) if both >> i & 1]
 
 def freqsgetter(record1, record2, snpcheck = True):
     '''Helper function for LD statistic calculations. Returns, in order: 1. a dict containing
@@ -63,133 +66,57 @@ def freqsgetter(record1, record2, snpcheck = True):
     3. a dict containing haplotype frequencies with A/B notation. Has more accurate allele
     freq calculations than freqscalc() - handles missing data better (i.e. when biallelic genotype
     not present).
+    Haplotypes are counted from the sites' bitsets (see haptally()).
     '''
     if snpcheck:
         snpchecker(record1, record2)
     elif not snpcheck:
         pass
-    # check strains b/w compared records are identical
-    strainlist = straingetter(record1, record2)
-    # parse through VCF calls
-    haplist = []
-    pcount = 0
-    qcount = 0
-    totcalls = 0
-    for strain in strainlist:
-        outgt = ''
-        gt1 = record1.genotype(strain)['GT']
-        gt2 = record2.genotype(strain)['GT']
-        if gt1 == '.' or gt2 == '.':
-            return
-        elif gt1 == '1' and gt2 == '1': # ab
-            outgt = str(record1.ALT[0]) + str(record2.ALT[0])
-            totcalls = totcalls + 1
-        elif gt1 == '1' and gt2 == '0': # aB
-            qcount = qcount + 1
-            outgt = str(record1.ALT[0]) + record2.REF
-            totcalls = totcalls + 1
-        elif gt1 == '0' and gt2 == '1': # Ab
-            pcount = pcount + 1
-            outgt = record1.REF + str(record2.ALT[0])
-            totcalls = totcalls + 1
-        elif gt1 == '0' and gt2 == '0': # AB
-            pcount = pcount + 1
-            qcount = qcount + 1
-            outgt = record1.REF + record2.REF
-            totcalls = totcalls + 1
-        haplist.append(outgt)
+    AB, Ab, aB, ab = haptally(record1, record2)
+    totcalls = AB + Ab + aB + ab
     # assign allele freq values
     values = {}
     if totcalls == 0:
         values['p1'] = 0
         values['q1'] = 0
     else:
-        values['p1'] = pcount/totcalls
-        values['q1'] = qcount/totcalls
+        values['p1'] = (AB + Ab)/totcalls
+        values['q1'] = (AB + aB)/totcalls
     values['p2'] = 1 - values['p1']
     values['q2'] = 1 - values['q1']
-    # haplotype frequencies
-    uniques = dict.fromkeys(set(haplist))
-    for hap in uniques:
-        uniques[hap] = haplist.count(hap)/len(haplist)
-    # create tuples w/ actual haps and corresponding AB notation
-    homref = record1.REF + record2.REF, 'AB'
-    homalt = str(record1.ALT[0]) + str(record2.ALT[0]), 'ab'
-    het1 = record1.REF + str(record2.ALT[0]), 'Ab'
-    het2 = str(record1.ALT[0]) + record2.REF, 'aB'
+    # create tuples w/ actual haps, corresponding AB notation and counts
+    genotypes = [(record1.REF + record2.REF, 'AB', AB),
+                 (str(record1.ALT[0]) + str(record2.ALT[0]), 'ab', ab),
+                 (record1.REF + str(record2.ALT[0]), 'Ab', Ab),
+                 (str(record1.ALT[0]) + record2.REF, 'aB', aB)]
+    # haplotype frequencies - uniques only has observed haps, while haps has all four
+    uniques = {}
     haps = {}
-    # use tuples to assign hap freqs to AB notation for downstream use
-    genotypes = [homref, homalt, het1, het2]
-    for genotype in genotypes:
-        if genotype[0] in uniques.keys():
-            haps[genotype[1]] = uniques[genotype[0]]
+    for hap, notation, count in genotypes:
+        if count > 0:
+            uniques[hap] = count/totcalls
+            haps[notation] = uniques[hap]
         else:
-            haps[genotype[1]] = 0
+            haps[notation] = 0
     return uniques, values, haps
 
 def dcalc(record1, record2, snpcheck = True):
     '''Calculates D statistic between two VCF records.
     Will check that records are biallelic (single-ALT) SNPs unless snpcheck = False.
     '''
-    if snpcheck:
-        snpchecker(record1, record2)
-    elif not snpcheck:
-        pass    
-    haps = freqsgetter(record1, record2, snpcheck = False)[2]
-    try:
-        LHS = haps['AB'] * haps['ab']
-    except KeyError: # either hap missing
-        LHS = 0
-    try:
-        RHS = haps['Ab'] * haps['aB']
-    except KeyError:
-        RHS = 0
-    d = LHS - RHS
-    # d = round(d, 5)
-    return d 
+    return pairstats(record1, record2, stats = ['d'], snpcheck = snpcheck).d
 
 def dprimecalc(record1, record2, snpcheck = True):
     '''Calculates Lewontin's D' statistic (D/Dmax) between two VCF records.
     Will check that records are biallelic (single-ALT) SNPs unless snpcheck = False.
     '''
-    if snpcheck:
-        snpchecker(record1, record2)
-    elif not snpcheck:
-        pass
-    values = freqsgetter(record1, record2, snpcheck = False)[1] # get allele frequencies
-    d = dcalc(record1, record2, snpcheck = False)
-    if d >= 0:
-        dmax = min(values['p1'] * values['q2'], values['p2'] * values['q1'])
-        if dmax == 0:
-            out = 0
-        else:
-            out = d/dmax
-    elif d < 0:
-        dmin = max(-1 * values['p1'] * values['q1'], -1 * values['p2'] * values['q2'])
-        if dmin == 0:
-            out = 0
-        else:
-            out = d/dmin
-    elif round(d, 6) == 0:
-        out = 0
-    return out
+    return pairstats(record1, record2, stats = ['dprime'], snpcheck = snpcheck).dprime
 
 def r2calc(record1, record2, snpcheck = True):
     '''Calculates r^2 (correlation) between two VCF records.
     Will check that records are biallelic (single-ALT) SNPs unless snpcheck = False.
     '''
-    if snpcheck:
-        snpchecker(record1, record2)
-    elif not snpcheck:
-        pass
-    values = freqsgetter(record1, record2, snpcheck = False)[1]
-    if values['p1'] == 0 or values['q1'] == 0 or values['p2'] == 0 or values['q2'] == 0:
-        out = 0
-    else:
-        dsquared = dcalc(record1, record2, snpcheck = False)**2
-        out = dsquared/(values['p1'] * values['q1'] * values['p2'] * values['q2'])
-        # out = round(out, 4)
-    return out
+    return pairstats(record1, record2, stats = ['r2'], snpcheck = snpcheck).r2
 
 def ldstats(record1, record2, snpcheck = True, freqs = False):
     '''Convenience function - returns D, D prime, and r2.
@@ -207,16 +134,336 @@ def ldstats(record1, record2, snpcheck = True, freqs = False):
         print('\nFrequencies report:')
         freqscalc(record1, record2, snpcheck = False) 
 
+PairStats = namedtuple('PairStats', ['d', 'dprime', 'r2', 'hapcount'])
+
+### memoization - haplotype tallies and site bitsets are kept in bounded LRU caches
+
+class LRUCache(object):
+    '''A bounded dict-like memo that evicts the least recently used entry once it holds
+    maxsize entries. Counts hits and misses for profiling (see memostats()).
+    '''
+    def __init__(self, maxsize = 100000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        '''Returns the value for key (marking it as recently used), or default.'''
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last = False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.data) > max(maxsize, 0):
+            self.data.popitem(last = False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+# keyed on (sitekey(record1), sitekey(record2), GQ_threshold) - values are ((AB, Ab, aB, ab) tallies, sources)
+_tallycache = LRUCache(100000)
+# keyed on (sitekey(record), GQ_threshold) - values are ((alt, called) bitsets, source)
+_sitecache = LRUCache(100000)
+
+def memoconfig(tallies = None, sites = None):
+    '''Sets the maximum number of entries in the haplotype tally and site bitset caches.
+    A size of 0 turns a cache off.
+    '''
+    if tallies is not None:
+        _tallycache.resize(tallies)
+    if sites is not None:
+        _sitecache.resize(sites)
+
+def memostats():
+    '''Returns hit/miss counts and sizes of the tally and site caches, eg
+    {'tallies': {'hits': 10, 'misses': 2, 'size': 2, 'maxsize': 100000}, 'sites': {...}}
+    '''
+    return {'tallies': _tallycache.stats(), 'sites': _sitecache.stats()}
+
+def memoclear():
+    '''Empties both caches (and resets their counters).'''
+    _tallycache.clear()
+    _sitecache.clear()
+
+def _popcount(x):
+    '''Number of set bits in an int.'''
+    return bin(x).count('1')
+
+def _source(record):
+    '''Helper function - an object shared by every record read through the same reader
+    (and no others): the PackedSites store of a snpstore.CachedRecord, the reader of a
+    vcfreader.PysamRecord, or the sample index of a pyVCF _Record (shared by each
+    vcf.Reader's records - and by all of a vcfreader.PyVCFReader's fetches).
+    '''
+    for attr in ('store', 'reader', '_sample_indexes'):
+        source = getattr(record, attr, None)
+        if source is not None:
+            return source
+    return record
+
+def sitekey(record):
+    '''Returns the cache key of a record - (source id, CHROM, POS, REF, ALT) - so that
+    records from different VCFs (or different strain sets) and split multi-allelic
+    records at the same position never share cache entries. Cached values hold on to the
+    source, so that its id can't be reused while they're in the cache.
+    '''
+    return (id(_source(record)), record.CHROM, record.POS, record.REF, str(record.ALT))
+
+def sitebits(record, GQ_threshold = 30):
+    '''Encodes the calls at a single VCF record as a pair of bitsets (Python ints), where
+    bit i corresponds to strain i in the VCF. Returns (alt, called): called has a bit
+    set for every strain with a call passing the GQ filter (default 30), and alt
+    for every such strain carrying the ALT allele. With GQ_threshold = None, every
+    strain with a 0/1 call counts as called, regardless of GQ.
+    Pre-encoded records (see snpstore.CachedRecord) supply their bitsets directly.
+    '''
+    key = (sitekey(record), GQ_threshold)
+    cached = _sitecache.get(key)
+    if cached is None:
+        cached = (_sitebits(record, GQ_threshold), _source(record))
+        _sitecache.put(key, cached)
+    return cached[0]
+
+def _sitebits(record, GQ_threshold = 30):
+    '''Helper function - uncached sitebits().'''
+    if hasattr(record, 'bits'):
+        return record.bits(GQ_threshold)
+    # masks are also kept on the record itself, one pair per GQ threshold
+    masks = record.__dict__.setdefault('_callmasks', {}) if hasattr(record, '__dict__') else {}
+    if GQ_threshold in masks:
+        return masks[GQ_threshold]
+    alt = 0
+    called = 0
+    for i, call in enumerate(record.samples):
+        gt = call['GT']
+        if gt != '0' and gt != '1':
+            continue
+        gq = call['GQ']
+        if GQ_threshold is not None and (gq is None or gq < GQ_threshold):
+            continue
+        called |= 1 << i
+        if gt == '1':
+            alt |= 1 << i
+    masks[GQ_threshold] = (alt, called)
+    return alt, called
+
+def bitcounts(alt1, called1, alt2, called2):
+    '''Given the bitsets of two sites (see sitebits()), returns counts of the AB, Ab, aB and
+    ab haplotypes (A/B = ref, a/b = alt) among strains called at both sites, using
+    ANDs and popcounts only.
+    '''
+    both = _popcount(called1 & called2)
+    altalt = _popcount(alt1 & alt2)
+    alt_first = _popcount(alt1 & called2)
+    alt_second = _popcount(called1 & alt2)
+    return both - alt_first - alt_second + altalt, alt_second - altalt, alt_first - altalt, altalt
+
+def haptally(record1, record2, GQ_threshold = 30):
+    '''Single pass haplotype tally between two VCF records. Returns counts of the AB, Ab,
+    aB and ab haplotypes (A/B = ref, a/b = alt) across strains with calls at both sites
+    that pass the GQ filter (default 30) - the same strains straingetter() would return.
+    Assumes both records come from the same VCF (ie share strain order).
+    Tallies are memoized (see memostats()).
+    '''
+    key = (sitekey(record1), sitekey(record2), GQ_threshold)
+    cached = _tallycache.get(key)
+    if cached is None:
+        counts = bitcounts(*sitebits(record1, GQ_threshold), *sitebits(record2, GQ_threshold))
+        cached = (counts, _source(record1), _source(record2))
+        _tallycache.put(key, cached)
+    return cached[0]
+
+def countstats(AB, Ab, aB, ab, stats = ('d', 'dprime', 'r2')):
+    '''Given haplotype counts (see haptally()), returns a PairStats tuple containing
+    each requested stat plus the number of the four possible haplotypes observed.
+    Stats that weren't requested are set to None. Arithmetic is identical to
+    dcalc(), dprimecalc() and r2calc().
+    '''
+    totcalls = AB + Ab + aB + ab
+    if totcalls == 0:
+        p1 = 0
+        q1 = 0
+        d = 0
+    else:
+        p1 = (AB + Ab)/totcalls
+        q1 = (AB + aB)/totcalls
+        d = (AB/totcalls) * (ab/totcalls) - (Ab/totcalls) * (aB/totcalls)
+    p2 = 1 - p1
+    q2 = 1 - q1
+    dprime = None
+    r2 = None
+    if 'dprime' in stats:
+        if d >= 0:
+            dmax = min(p1 * q2, p2 * q1)
+            dprime = 0 if dmax == 0 else d/dmax
+        else:
+            dmin = max(-1 * p1 * q1, -1 * p2 * q2)
+            dprime = 0 if dmin == 0 else d/dmin
+    if 'r2' in stats:
+        if p1 == 0 or q1 == 0 or p2 == 0 or q2 == 0:
+            r2 = 0
+        else:
+            r2 = d**2/(p1 * q1 * p2 * q2)
+    hapcount = (AB > 0) + (Ab > 0) + (aB > 0) + (ab > 0)
+    return PairStats(d if 'd' in stats else None, dprime, r2, hapcount)
+
+def pairstats(record1, record2, stats = ('d', 'dprime', 'r2'), snpcheck = True, GQ_threshold = 30):
+    '''Calculates any of D, D' and r2 between two VCF records from a single haplotype tally.
+    Returns a PairStats namedtuple with fields d, dprime, r2 and hapcount (number of
+    the four possible haplotypes observed); stats not requested are left as None.
+    Will check that records are biallelic (single-ALT) SNPs unless snpcheck = False.
+    
+    usage - pairstats(record1, record2, stats = ['d', 'r2']).r2
+    '''
+    if snpcheck:
+        snpchecker(record1, record2)
+    return countstats(*haptally(record1, record2, GQ_threshold), stats = stats)
+
+### vectorized functions - operate on blocks of records at once
+
+def genomatrix(records, GQ_threshold = 30):
+    '''Encodes the haploid calls in a list of VCF records as a NumPy genotype matrix.
+    Returns a tuple of two (sites x strains) arrays: an int8 matrix of calls
+    (0 = ref, 1 = alt, -1 = missing) and a boolean mask of calls that are present and
+    pass the GQ filter (default 30) - ie strains that straingetter() would keep.
+    All records should come from the same VCF so that strain order is shared.
+    '''
+    records = list(records)
+    numstrains = len(records[0].samples) if records else 0
+    genotypes = np.full((len(records), numstrains), -1, dtype = np.int8)
+    called = np.zeros((len(records), numstrains), dtype = bool)
+    for i, record in enumerate(records):
+        for j, call in enumerate(record.samples):
+            gt = call['GT']
+            if gt == '0':
+                genotypes[i, j] = 0
+            elif gt == '1':
+                genotypes[i, j] = 1
+            else: # missing (or not a haploid biallelic call)
+                continue
+            gq = call['GQ']
+            called[i, j] = gq is not None and gq >= GQ_threshold
+    return genotypes, called
+
+def _refalt(genotypes, called):
+    '''Helper function - splits a genotype matrix into float indicator matrices of
+    callable ref and alt calls, for use in matrix products.
+    '''
+    ref = ((genotypes == 0) & called).astype(np.float64)
+    alt = ((genotypes == 1) & called).astype(np.float64)
+    return ref, alt
+
+def hapcountmatrix(genotypes1, called1, genotypes2 = None, called2 = None):
+    '''Given genotype matrices + masks from genomatrix(), returns haplotype counts for
+    every pair of sites between the two blocks as four (sites1 x sites2) int64 matrices,
+    in the order AB, Ab, aB, ab (A/B = ref, a/b = alt). Only strains callable at both
+    sites of a pair are counted. If the second block is omitted, compares the first
+    block against itself.
+    '''
+    if genotypes2 is None:
+        genotypes2, called2 = genotypes1, called1
+    ref1, alt1 = _refalt(genotypes1, called1)
+    ref2, alt2 = _refalt(genotypes2, called2)
+    counts = [ref1 @ ref2.T, ref1 @ alt2.T, alt1 @ ref2.T, alt1 @ alt2.T]
+    return tuple(np.rint(c).astype(np.int64) for c in counts)
+
+def hapcountpairs(genotypes, called, idx1, idx2):
+    '''As hapcountmatrix(), but for an explicit list of pairs - returns AB, Ab, aB and ab
+    counts for rows idx1[i] and idx2[i] of a single genotype matrix as 1D int64 arrays.
+    '''
+    ref = (genotypes == 0) & called
+    alt = (genotypes == 1) & called
+    idx1 = np.asarray(idx1, dtype = np.intp)
+    idx2 = np.asarray(idx2, dtype = np.intp)
+    counts = [ref[idx1] & ref[idx2], ref[idx1] & alt[idx2], alt[idx1] & ref[idx2], alt[idx1] & alt[idx2]]
+    return tuple(c.sum(axis = 1, dtype = np.int64) for c in counts)
+
+def ldfromcounts(AB, Ab, aB, ab, stats = ('d', 'dprime', 'r2')):
+    '''Computes LD statistics from arrays of haplotype counts (as returned by hapcountmatrix()
+    or hapcountpairs()). Returns a dict mapping each requested stat ('d', 'dprime', 'r2')
+    to a float64 array of the same shape as the counts.
+    Mirrors the arithmetic in freqsgetter(), dcalc(), dprimecalc() and r2calc(), including
+    their treatment of pairs without any shared calls and of monomorphic sites.
+    '''
+    AB, Ab, aB, ab = (np.asarray(c) for c in (AB, Ab, aB, ab))
+    totcalls = AB + Ab + aB + ab
+    totcalls = np.where(totcalls == 0, 1, totcalls) # all counts are 0 here anyway
+    p1 = (AB + Ab) / totcalls
+    q1 = (AB + aB) / totcalls
+    p2 = 1 - p1
+    q2 = 1 - q1
+    d = (AB / totcalls) * (ab / totcalls) - (Ab / totcalls) * (aB / totcalls)
+    out = {}
+    if 'd' in stats:
+        out['d'] = d
+    if 'dprime' in stats:
+        dmax = np.where(d >= 0, np.minimum(p1 * q2, p2 * q1), np.maximum(-1 * p1 * q1, -1 * p2 * q2))
+        out['dprime'] = np.divide(d, dmax, out = np.zeros(d.shape), where = dmax != 0)
+    if 'r2' in stats:
+        denom = p1 * q1 * p2 * q2
+        out['r2'] = np.divide(d**2, denom, out = np.zeros(d.shape), where = denom != 0)
+    return out
+
+def ldmatrix(records1, records2 = None, stats = ('d', 'dprime', 'r2'), GQ_threshold = 30):
+    '''Convenience function - calculates LD stats between every pair of records in two lists
+    (or within a single list if records2 is not provided). Returns a dict of 
+    (len(records1) x len(records2)) matrices keyed by stat name.
+    
+    usage - ldmatrix(reclist('myfile.vcf.gz', 'chromosome_6', 1, 5000, snpsonly = True))['r2']
+    '''
+    genotypes1, called1 = genomatrix(records1, GQ_threshold)
+    if records2 is None:
+        counts = hapcountmatrix(genotypes1, called1)
+    else:
+        genotypes2, called2 = genomatrix(records2, GQ_threshold)
+        counts = hapcountmatrix(genotypes1, called1, genotypes2, called2)
+    return ldfromcounts(*counts, stats = stats)
+
 ### exploratory functions        
         
-def reclist(vcf_file, chrom = None, start = None, end = None, snpsonly = False):
+def reclist(vcf_file, chrom = None, start = None, end = None, snpsonly = False, cache = True):
     '''Returns records in given bgzipped VCF file as a list.
     If given chrom, will fetch just chrom; if given both chrom 
     and start-end coordinates, will fetch just that 
     subset of the VCF.
+    
+    With snpsonly = True, records come from the preprocessed SNP cache (see snpcache.py) 
+    as snpstore.CachedRecord objects unless cache = False.
     '''
     
-    vcfin = vcf.Reader(filename = vcf_file, compressed = True)
+    if snpsonly and cache and not (start and end and not chrom):
+        import snpcache # imported here to avoid a circular import
+        try:
+            if chrom and start and end:
+                return list(snpcache.loadsites(vcf_file, chrom).records(start, end))
+            elif chrom and not start and not end:
+                return list(snpcache.loadsites(vcf_file, chrom).records())
+            else:
+                return [record for sites in snpcache.cachedsites(vcf_file) for record in sites.records()]
+        except OSError as e:
+            print('warning: SNP cache unavailable ({0}) - parsing VCF'.format(e), file = sys.stderr)
+    
+    vcfin = openvcf(vcf_file) # pysam-backed if available (see vcfreader.py)
     outlist = []
     
     # filters
@@ -388,11 +635,9 @@ def doublegtcounts(record1, record2, freqs = True, missing = True):
 def triplefreqsgetter(record1, record2, record3):
     
     def triplestraingetter(record1, record2, record3):
-        rec1set = set([record1.samples[i].sample for i in range(len(record1.samples)) if record1.samples[i]['GT'] != '.'])
-        rec2set = set([record2.samples[i].sample for i in range(len(record2.samples)) if record2.samples[i]['GT'] != '.'])
-        rec3set = set([record3.samples[i].sample for i in range(len(record3.samples)) if record3.samples[i]['GT'] != '.'])
-        strainlist = list(rec1set.intersection(rec2set).intersection(rec3set))
-        return strainlist
+        # strains called at all three sites, regardless of GQ
+        called = sitebits(record1, None)[1] & sitebits(record2, None)[1] & sitebits(record3, None)[1]
+        return [call.sample for i, call in enumerate(record1.samples) if called >> i & 1]
     
     # check strains b/w compared records are identical
     strainlist = triplestraingetter(record1, record2, record3)
@@ -484,39 +729,66 @@ def triplefreqsgetter(record1, record2, record3):
     return uniques, values, haps
 
 
-def triple_dcalc(record1, record2, record3):
-    # Dabc = Fabc - p1*Dbc - q1*Dac - r1*Dab - p1*q1*r1
-    
-    from popgen import freqsgetter
-    
-    def quick_dcalc(record1, record2):
-        haps = freqsgetter(record1, record2, snpcheck = False)[2]
-        try:
-            LHS = haps['AB'] * haps['ab']
-        except KeyError: # either hap missing
-            LHS = 0
-        try:
-            RHS = haps['Ab'] * haps['aB']
-        except KeyError:
-            RHS = 0
-        d = LHS - RHS
-        # d = round(d, 5)
-        return d
+TRIPLEHAPS = ['ABC', 'ABc', 'AbC', 'Abc', 'aBC', 'aBc', 'abC', 'abc']
+
+def tripletally(record1, record2, record3):
+    '''Single pass tally of the 8 three-locus haplotypes (A/B/C = ref, a/b/c = alt) across
+    strains with a call at all three records - same strains as triplefreqsgetter(), ie
+    without a GQ filter. Returns counts in TRIPLEHAPS order.
+    '''
+    alt1, called1 = sitebits(record1, None)
+    alt2, called2 = sitebits(record2, None)
+    alt3, called3 = sitebits(record3, None)
+    called = called1 & called2 & called3
+    sites = [(called & ~alt, alt & called) for alt in (alt1, alt2, alt3)] # (ref, alt) bitsets
+    return tuple(_popcount(x1 & x2 & x3) for x1 in sites[0] for x2 in sites[1] for x3 in sites[2])
 
-    freqs = triplefreqsgetter(record1, record2, record3)[1]
-    haps = triplefreqsgetter(record1, record2, record3)[2]
+def tripled(counts, d23, d13, d12):
+    '''Three-locus D (Weir) from a tally of the 8 haplotypes (see tripletally()) and the
+    pairwise D values between sites 2/3, 1/3 and 1/2.
+    Dabc = Fabc - p1*Dbc - q1*Dac - r1*Dab - p1*q1*r1
+    Arithmetic is identical to the original triple_dcalc().
+    '''
+    totcalls = sum(counts)
+    if totcalls == 0:
+        Fabc, p1, q1, r1 = 0, 0, 0, 0
+    else:
+        ABC, ABc, AbC, Abc, aBC, aBc, abC, abc = counts
+        Fabc = ABC/totcalls # frequency of the all-REF haplotype
+        p1 = (ABC + ABc + AbC + Abc)/totcalls
+        q1 = (ABC + ABc + aBC + aBc)/totcalls
+        r1 = (ABC + AbC + aBC + abC)/totcalls
+    return Fabc - p1 * d23 - q1 * d13 - r1 * d12 - p1 * q1 * r1
 
-    try:
-        Fabc = haps['ABC']
-    except KeyError:
-        Fabc = 0
+def tripledfromcounts(counts, d23, d13, d12):
+    '''Vectorized tripled() - counts is an (n x 8) array of haplotype tallies in TRIPLEHAPS
+    order (see snpstore.PackedSites.tripletally()), and d23, d13, d12 arrays of pairwise D.
+    '''
+    counts = np.asarray(counts)
+    totcalls = counts.sum(axis = 1)
+    safe = np.where(totcalls == 0, 1, totcalls)
+    ref1 = counts[:, 0:4].sum(axis = 1)
+    ref2 = counts[:, [0, 1, 4, 5]].sum(axis = 1)
+    ref3 = counts[:, 0::2].sum(axis = 1)
+    Fabc, p1, q1, r1 = counts[:, 0] / safe, ref1 / safe, ref2 / safe, ref3 / safe
+    return Fabc - p1 * d23 - q1 * d13 - r1 * d12 - p1 * q1 * r1
 
-    second_term = freqs['p1'] * quick_dcalc(record2, record3)
-    third_term = freqs['q1'] * quick_dcalc(record1, record3)
-    fourth_term = freqs['r1'] * quick_dcalc(record1, record2)
-    fifth_term = freqs['p1'] * freqs['q1'] * freqs['r1']
+def triple_dcalc(record1, record2, record3, dcache = None):
+    '''Three-locus D between three VCF records:
+    Dabc = Fabc - p1*Dbc - q1*Dac - r1*Dab - p1*q1*r1
 
-    dabc = Fabc - second_term - third_term - fourth_term - fifth_term
+    The 8 haplotypes are tallied in one pass (see tripletally()), and pairwise D values
+    come from pairstats(). If a dict is given as dcache, pairwise D values are stored in it,
+    keyed on (CHROM, POS) pairs, and reused across calls - eg when scanning overlapping
+    triples. For whole-chromosome scans, see tripleldcalc.py.
+    '''
+    def cached_d(rec1, rec2):
+        if dcache is None:
+            return pairstats(rec1, rec2, stats = ['d'], snpcheck = False).d
+        key = (rec1.CHROM, rec1.POS, rec2.CHROM, rec2.POS)
+        if key not in dcache:
+            dcache[key] = pairstats(rec1, rec2, stats = ['d'], snpcheck = False).d
+        return dcache[key]
 
-    # dabc = round(dabc, 5)
-    return dabc
+    counts = tripletally(record1, record2, record3)
+    return tripled(counts, cached_d(record2, record3), cached_d(record1, record3), cached_d(record1, record2))
@@ -5,9 +5,18 @@ singlevcfcalc.py - calculate ld stats between two regions within a single vcf fi
 
 usage: python singlevcfcalc.py -v [vcf (.gz)] -r [region 1] [region 2] -l [ld stats] -f [filter] -w [windowsize] > [outfile]
 
+or, for binary columnar output (see ldcolumns.py):
+python singlevcfcalc.py -v [vcf (.gz)] -r [region 1] [region 2] -l [ld stats] -b [out directory]
+
+or, for LD decay summaries (mean, sd and quantiles of each stat per distance bin, see ldbins.py):
+python singlevcfcalc.py -v [vcf (.gz)] -r [region 1] [region 2] -l [ld stats] -n [bin width] > [outfile]
+
 LD stats can be any combination of d, dprime, or r2 -
 separate by a slash (i.e. r2/dprime) for more than one.
 
+comparisons between two different regions are computed in tiles over several threads
+(-t [threads]), and can be limited to pairs in strong LD with -m [minimum LD]
+
 if looking to do an intra-region comparison, simply enter the same region name
 for both region 1 and region 2 (i.e. -v myvcf.gz -r chromosome_2 chromosome_2 -l r2/dprime > chr2.ld)
 
@@ -37,6 +46,16 @@ parser.add_argument('-p', '--haps', required = False,
                    action = 'store_true', help = 'Whether to output the number of observed haplotypes for each comparison. Optional.')
 parser.add_argument('-q', '--sequential', required = False,
                    action = 'store_true', help = 'Calculate in sequential pairs instead of all pairs (Lewontin 1995). Optional.')
+parser.add_argument('-b', '--binary', required = False,
+                   type = str, help = 'Write binary columnar output (see ldcolumns.py) to this directory instead of printing. Optional.')
+parser.add_argument('-t', '--threads', required = False,
+                   type = int, help = 'Threads to use for comparisons between two different regions. Optional.')
+parser.add_argument('-m', '--minld', required = False,
+                   type = float, help = 'Only output pairs where the first LD stat given is at least this large (in absolute value) - two different regions only. Optional.')
+parser.add_argument('-s', '--tilesize', required = False, default = 512,
+                   type = int, help = 'Number of SNPs per side of each tile, for two different regions [default 512]')
+parser.add_argument('-n', '--bins', required = False,
+                   type = int, help = 'Print per-distance-bin summaries with this bin width (bp) instead of pairs. Optional.')
 
 
 args = parser.parse_args()
@@ -47,8 +66,14 @@ filt = args.filter
 haps = args.haps
 sequential = args.sequential
 windowsize = args.windowsize
+binary = args.binary
+bins = args.bins
+threads = args.threads
+minld = args.minld
+tilesize = args.tilesize
 
 if sequential == True:
-    sequentialvcfcalc(vcfin, ref = regions[0], target = regions[1], stat = ldstats, windowsize = windowsize, haps = haps)  
+    sequentialvcfcalc(vcfin, ref = regions[0], target = regions[1], stat = ldstats, windowsize = windowsize, haps = haps, out = binary, bins = bins)
 else:
-    singlevcfcalc(vcfin, ref = regions[0], target = regions[1], stat = ldstats, filter = filt, windowsize = windowsize, haps = haps)
+    singlevcfcalc(vcfin, ref = regions[0], target = regions[1], stat = ldstats, filter = filt, windowsize = windowsize, haps = haps, out = binary, bins = bins,
+        tilesize = tilesize, threads = threads, minld = minld)
@@ -0,0 +1,127 @@
+'''
+snpcache.py - persistent, preprocessed SNP cache for snppuller
+
+Opening the bgzipped VCF, parsing every record with pyVCF and re-applying the SNP
+filters in snppuller (biallelic, non-singleton, non-invariant) dominates the runtime
+of the LD drivers, which call it over and over again. This module 'compiles' each
+chromosome's filtered SNPs once into a compressed .npz file (positions, REF/ALT,
+packed genotype bitsets and GQ values - see snpstore.PackedSites) that later runs
+load instead of touching the VCF.
+
+Cache files live in a directory keyed on the VCF's absolute path, modification time,
+size, and the filter settings, so editing or replacing the VCF (or changing the filters)
+invalidates the cache automatically. By default the cache sits in .snpcache/ next to the
+VCF - set the SNPCACHE environment variable to put it somewhere else.
+
+snppuller(), reclist(snpsonly = True) and the LD drivers use the cache automatically
+(compiling chromosomes on first use), but it can also be built ahead of time:
+
+usage: python snpcache.py -v [vcf (.gz)] [-c chromosome_1 chromosome_2 ...]
+'''
+
+import os
+import sys
+import hashlib
+import argparse
+import itertools
+from snpstore import PackedSites
+from vcfreader import openvcf
+
+# bump if the filters in snppuller change
+FILTERS = 'biallelic_snp/no_singletons/no_invariant/v1'
+
+# stores already loaded in this process - (path, GQ_threshold): PackedSites
+_loaded = {}
+
+def cachedir(vcf_file):
+    '''Returns the cache directory for a VCF.'''
+    vcf_file = os.path.abspath(vcf_file)
+    root = os.environ.get('SNPCACHE') or os.path.join(os.path.dirname(vcf_file), '.snpcache')
+    stat = os.stat(vcf_file)
+    key = '|'.join([vcf_file, str(stat.st_mtime_ns), str(stat.st_size), FILTERS])
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(root, os.path.basename(vcf_file) + '.' + digest)
+
+def chrompath(vcf_file, chrom):
+    '''Returns the cache file for a chromosome.'''
+    return os.path.join(cachedir(vcf_file), chrom + '.npz')
+
+def _save(sites, path):
+    '''Writes a store atomically, so that interrupted compiles don't leave partial files.'''
+    tmp = path[:-len('.npz')] + '.tmp{0}.npz'.format(os.getpid())
+    sites.save(tmp)
+    os.replace(tmp, path)
+
+def compilevcf(vcf_file, chroms = None):
+    '''Parses the VCF once and writes each chromosome's filtered SNPs to the cache.
+    If chroms is None, the entire VCF is compiled and the chromosome order recorded
+    (see cachedchroms()). Returns the list of compiled chromosomes.
+    Genotypes are read in bulk (see vcfreader.py), with the same filters as snppuller.
+    '''
+    from ldcalc import snpfilter # avoid circular import
+    reader = openvcf(vcf_file)
+    outdir = cachedir(vcf_file)
+    os.makedirs(outdir, exist_ok = True)
+    compiled = []
+    if chroms:
+        for chrom in chroms:
+            arrays = reader.genoarrays(chrom, filter = snpfilter)
+            _save(PackedSites.fromarrays(chrom, arrays, reader.samples), chrompath(vcf_file, chrom))
+            compiled.append(chrom)
+    else:
+        arrays = reader.genoarrays(filter = snpfilter)
+        for chrom, rows in itertools.groupby(range(len(arrays['chrom'])), key = lambda i: arrays['chrom'][i]):
+            rows = list(rows)
+            block = {key: arrays[key][rows[0]:rows[-1] + 1] for key in ['pos', 'ref', 'alt', 'gt', 'gq']}
+            _save(PackedSites.fromarrays(chrom, block, reader.samples), chrompath(vcf_file, chrom))
+            compiled.append(chrom)
+        with open(os.path.join(outdir, 'chroms.txt'), 'w') as f:
+            f.write('\n'.join(compiled) + '\n')
+    return compiled
+
+def loadsites(vcf_file, chrom, GQ_threshold = 30, compile = True):
+    '''Returns the cached SNPs on a chromosome as a PackedSites object, compiling the
+    chromosome first if needed (or returning None if compile = False).
+    Raises OSError if the cache can't be written.
+    '''
+    path = chrompath(vcf_file, chrom)
+    if (path, GQ_threshold) in _loaded:
+        return _loaded[(path, GQ_threshold)]
+    if not os.path.exists(path):
+        if not compile:
+            return None
+        compilevcf(vcf_file, [chrom])
+    sites = PackedSites.load(path, GQ_threshold)
+    _loaded[(path, GQ_threshold)] = sites
+    return sites
+
+def cachedchroms(vcf_file, compile = True):
+    '''Returns the chromosomes with SNPs in the VCF, in VCF order, compiling the
+    entire VCF first if it hasn't been (or returning None if compile = False).
+    '''
+    path = os.path.join(cachedir(vcf_file), 'chroms.txt')
+    if not os.path.exists(path):
+        if not compile:
+            return None
+        compilevcf(vcf_file)
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def cachedsites(vcf_file, chrom = None, GQ_threshold = 30):
+    '''Returns a list of PackedSites - just the one for chrom if given, or else one per
+    chromosome in VCF order.
+    '''
+    chroms = [chrom] if chrom else cachedchroms(vcf_file)
+    return [loadsites(vcf_file, c, GQ_threshold) for c in chroms]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compile a VCF into the SNP cache used by snppuller and the LD drivers.',
+                                    usage = 'snpcache.py [options]')
+    parser.add_argument('-v', '--vcfinput', required = True,
+                       type = str, help = 'Input VCF (.gz)')
+    parser.add_argument('-c', '--chroms', required = False,
+                       type = str, nargs = '+', help = 'Chromosome(s) to compile. Optional - defaults to the entire VCF.')
+    args = parser.parse_args()
+
+    compiled = compilevcf(args.vcfinput, args.chroms)
+    print('compiled', len(compiled), 'chromosome(s) to', cachedir(args.vcfinput), file = sys.stderr)
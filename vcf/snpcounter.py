@@ -1,11 +1,24 @@
 #!/usr/bin/python3.5
 
 '''
-Given a zipped vcf file and a window size, calculates the number of SNPs in each given window.
-Chromosome lengths are currently hardcoded for the Chlamydomonas reinhardtii genome.
+Given a zipped vcf file and one or more window sizes, calculates the number of SNPs in each window,
+for every chromosome in the vcf.
+
+Each chromosome is read through once (see vcfreader.py) and its SNP positions binned into
+windows of every requested size at once, with chromosomes spread over several processes
+(-p). Chromosome lengths are taken from the ##contig lines of the vcf header - if a
+chromosome has no length there, its last SNP is used instead.
+
+Windows are 1-based and inclusive (1-100000, 100001-200000, ...), with the last window of
+each chromosome ending at the chromosome's length.
 
 usage:
-python3.5 snpsampler.py [vcf (.gz)] [windowsize] > [outfile]
+python3.5 snpcounter.py [vcf (.gz)] [windowsize(s)] > [outfile]
+
+e.g.
+python3.5 snpcounter.py genome.vcf.gz 10000 100000 -p 4 > snpcounts.txt
+
+add -c [chromosome(s)] to only count some chromosomes
 
 reference - notebook 8.6
 
@@ -13,32 +26,10 @@ AH - 04/2017
 '''
 
 import sys
-import vcf
-
-lengths = {'chromosome_1': 8033585,
-'chromosome_2': 9223677,
-'chromosome_3': 9219486,
-'chromosome_4': 4091191,
-'chromosome_5': 3500558,
-'chromosome_6': 9023763,
-'chromosome_7': 6421821,
-'chromosome_8': 5033832,
-'chromosome_9': 7956127,
-'chromosome_10': 6576019,
-'chromosome_11': 3826814,
-'chromosome_12': 9730733,
-'chromosome_13': 5206065,
-'chromosome_14': 4157777,
-'chromosome_15': 1922860,
-'chromosome_16': 7783580,
-'chromosome_17': 7188315} 
-
-
-def chromgetter(vcfinput):
-    '''Fetches chrom name from vcf. Helper function for variantgetter.'''
-    thisvcf = vcf.Reader(filename = vcfinput, compressed = True)
-    chromname = next(thisvcf).CHROM
-    return chromname
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from vcfreader import openvcf
 
 def windowranger(windowsize, totalsize):
     '''Returns a list of mins and maxes given a window size and
@@ -50,28 +41,66 @@ def windowranger(windowsize, totalsize):
     windowmins = [num + 1 for num in windowmins]
     return windowmins, windowmaxes
 
-def variantgetter(vcfinput, windowmin, windowmax):
-    '''Returns number of SNPs within a given window'''
-    vcfin = vcf.Reader(filename = vcfinput, compressed = True) 
-    chromname = chromgetter(vcfinput)
-    counter = 0
-    for record in vcfin.fetch(chrom = chromname, start = windowmin, end = windowmax - 1):
-        if record.POS >= windowmin and record.POS <= windowmax and record.is_snp == True:
-            counter = counter + 1
-        else:
-            pass
-    return counter
-
-
-# analysis
-
-infile = sys.argv[1]
-windowsize = int(sys.argv[2])
-
-chromname = chromgetter(infile)
-ranges = windowranger(windowsize, lengths[chromname]) # get ranges
-
-print('start end snpcount') # initialize headers
-
-for start, end in zip(ranges[0], ranges[1]):
-    print(start, end, variantgetter(infile, start, end)) # add data
+def snppositions(vcfinput, chrom):
+    '''Returns the positions of all SNPs on a chromosome as an array, in one pass.'''
+    vcfin = openvcf(vcfinput)
+    return np.array([record.POS for record in vcfin.fetch(chrom = chrom) if record.is_snp], dtype = np.int64)
+
+def windowcounts(positions, windowsize, totalsize):
+    '''Returns the number of positions in each window of the chromosome (see windowranger()).'''
+    numwindows = len(range(0, totalsize, windowsize))
+    positions = positions[(positions >= 1) & (positions <= totalsize)]
+    return np.bincount((positions - 1) // windowsize, minlength = numwindows)[:numwindows]
+
+def chromcounter(task):
+    '''Worker function - counts SNPs in windows of each size on one chromosome.
+    Returns output lines for the chromosome.
+    '''
+    vcfinput, chrom, length, windowsizes = task
+    positions = snppositions(vcfinput, chrom)
+    if not length: # not in header
+        length = int(positions.max()) if len(positions) else 0
+    out = []
+    for windowsize in windowsizes:
+        counts = windowcounts(positions, windowsize, length)
+        starts, ends = windowranger(windowsize, length)
+        for start, end, count in zip(starts, ends, counts.tolist()):
+            out.append('{0} {1} {2} {3} {4}\n'.format(chrom, windowsize, start, end, count))
+    return ''.join(out)
+
+def snpcounter(vcfinput, windowsizes, chroms = None, processes = 1):
+    '''Prints SNP counts in windows of each size in windowsizes, for every chromosome in chroms
+    (default: every chromosome in the vcf header).
+    '''
+    vcfin = openvcf(vcfinput)
+    if not chroms:
+        chroms = list(vcfin.contigs)
+    if not chroms: # no ##contig lines - fall back on the chromosomes in the file
+        chroms = []
+        for record in vcfin:
+            if not chroms or record.CHROM != chroms[-1]:
+                chroms.append(record.CHROM)
+    tasks = [(vcfinput, chrom, vcfin.contigs[chrom][1] if chrom in vcfin.contigs else None, windowsizes)
+        for chrom in chroms]
+
+    print('chrom windowsize start end snpcount') # initialize headers
+    if processes > 1:
+        with Pool(processes = processes) as pool:
+            for text in pool.imap(chromcounter, tasks):
+                sys.stdout.write(text)
+    else:
+        for task in tasks:
+            sys.stdout.write(chromcounter(task))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Count SNPs in windows along each chromosome of a VCF file.',
+                                    usage = 'snpcounter.py [vcf (.gz)] [windowsize(s)] [options]')
+    parser.add_argument('vcfinput', type = str, help = 'Input VCF (.gz, tabix-indexed)')
+    parser.add_argument('windowsizes', type = int, nargs = '+', help = 'Window size(s) in bp')
+    parser.add_argument('-c', '--chroms', required = False,
+                       type = str, nargs = '+', help = 'Chromosome(s) to count. Optional - defaults to all.')
+    parser.add_argument('-p', '--processes', required = False, default = 1,
+                       type = int, help = 'Number of processes to use [default 1]')
+    args = parser.parse_args()
+
+    snpcounter(args.vcfinput, args.windowsizes, chroms = args.chroms, processes = args.processes)
@@ -6,29 +6,32 @@ python3.5 snpsample2vcf.py [vcf (.gz)] [windowsize] [chrom] [outfile]
 
 e.g.
 python3.5 snpsample2vcf.py chromosome10.vcf.gz 100000 chromosome_10 out
-will create a vcf called outsampled.vcf.
+will create a vcf called outsampled.vcf (or outsampled.vcf.gz + .tbi with --bgzip).
+
+The chromosome is read through once - each window (1-100000, 100001-200000, ...) keeps a
+reservoir of randomly picked records, which are written out in order as soon as the
+window closes. Windows with fewer records than the target are written out whole.
 
 Number of SNPs picked out from each window are hardcoded in the snpcounts dictionary,
 based on calculations from snpcounter.py. These were calculated such that an equivalent
 amount of SNPs are obtained from each chromosome so as not to bias downstream inter-chromosome 
 r2 comparisons, and correspond to a window size of 100kb.
 
-In order to reuse this script for a different window size/genome, one would have to
-run snpcounter.py for the desired window size and with the chromosome lengths modified as
-necessary, after inputting the respective SNP counts (as well as chromosome lengths) into this script.
+For a different window size/genome, either give the number of SNPs to pick per window
+directly (-k), or a total for the chromosome (-n) - the per window count is then worked out
+from the number of windows, using the chromosome length in the vcf header.
 
 reference - notebook 8.6c
 
 AH - 04/2017
 '''
 
-import sys
-import vcf
+import math
 import random
+import argparse
+from vcfreader import openvcf, openbgzip, tabixindex
 from tqdm import tqdm
 
-random.seed(42) 
-
 snpcounts = {'chromosome_1': 25,
 'chromosome_10': 30,
 'chromosome_11': 51,
@@ -47,88 +50,83 @@ snpcounts = {'chromosome_1': 25,
 'chromosome_8': 39,
 'chromosome_9': 25} 
 
-lengths = {'chromosome_1': 8033585,
-'chromosome_2': 9223677,
-'chromosome_3': 9219486,
-'chromosome_4': 4091191,
-'chromosome_5': 3500558,
-'chromosome_6': 9023763,
-'chromosome_7': 6421821,
-'chromosome_8': 5033832,
-'chromosome_9': 7956127,
-'chromosome_10': 6576019,
-'chromosome_11': 3826814,
-'chromosome_12': 9730733,
-'chromosome_13': 5206065,
-'chromosome_14': 4157777,
-'chromosome_15': 1922860,
-'chromosome_16': 7783580,
-'chromosome_17': 7188315} 
-
-def chromgetter(vcfinput):
-    '''Fetches chrom name from vcf. Helper function for randvariantgetter.'''
-    thisvcf = vcf.Reader(filename = vcfinput, compressed = True)
-    chromname = next(thisvcf).CHROM
-    return chromname
-
-def windowranger(windowsize, totalsize):
-    '''Returns a list of mins and maxes given a window size and
-    max length. These lists will be in a tuple that needs to be
-    unpacked.'''
-    windowmins = list(range(0, totalsize, windowsize))
-    windowmaxes = windowmins[1:len(windowmins)]
-    windowmaxes.append(totalsize)
-    windowmins = [num + 1 for num in windowmins]
-    return windowmins, windowmaxes
-
-def randvariantgetter(vcfinput, chrom, windowmin, windowmax, snplist):
-    '''Returns randomly selected SNP positions within current window.
-    Number of SNPs picked out for given chrom is determined from snpcounts 
-    dict. Feed empty list if first iteration.'''
-    vcfin = vcf.Reader(filename = vcfinput, compressed = True) 
-    snppositions = [] # reset list
-    snippet = vcfin.fetch(chrom = chrom, start = windowmin, end = windowmax - 1)
-    try:
-        snppositions = [record.POS for record in snippet]
-    except IndexError:
-        pass
-    try:
-        snpsample = sorted(random.sample(snppositions, snpcounts[chrom]))
-    except ValueError:
-        snpsample = snppositions
-    snpsample = snplist + snpsample
-    return snpsample
-
-def variantwriter(vcfinput, inchrom, outfile, snplist):
-    '''Given a list of a SNPs and an input, writes a vcf file
-    that only contains those records.'''
-    vcfin = vcf.Reader(filename = vcfinput, compressed = True) 
-    snippet = vcfin.fetch(chrom = inchrom)
-    with open(outfile, 'w') as outvcf:
-        writer = vcf.Writer(outvcf, snippet)
-        try:
-            for record in snippet:
-                if record.POS in snplist:
-                    writer.write_record(record)
-                else:
-                    pass
-        except IndexError:
-            pass 
-
-# analysis
-vcfin = str(sys.argv[1])
-windowsize = int(sys.argv[2])
-chrom = str(sys.argv[3])
-outfilename = str(sys.argv[4])
-
-ranges = windowranger(windowsize, lengths[chrom])
-
-snplist = []
-
-for start, end in tqdm(zip(ranges[0], ranges[1])):
-    snplist = randvariantgetter(vcfin, chrom, start, end, snplist)
-    
-outname = outfilename + 'sampled.vcf'
-    
-variantwriter(vcfin, chrom, outname, snplist)    
-
+def windowcount(windowsize, chromlength):
+    '''Returns the number of windows of windowsize needed to cover a chromosome.'''
+    return max(1, math.ceil(chromlength / windowsize))
+
+def persnpcount(vcfin, chrom, windowsize, total):
+    '''Returns the number of SNPs to pick per window so that about total SNPs are
+    picked out of the chromosome, using its length from the vcf header.'''
+    chromlength = vcfin.contigs[chrom][1] if chrom in vcfin.contigs else None
+    if not chromlength:
+        raise ValueError('no length for {0} in the vcf header - use -k instead'.format(chrom))
+    return math.ceil(total / windowcount(windowsize, chromlength))
+
+def reservoirsampler(records, windowsize, k, rng = random):
+    '''Picks up to k records at random from each window of windowsize along a
+    chromosome, in a single pass over records (which have to be sorted by position).
+    Yields the picked records in order, one window at a time.
+    '''
+    window = None
+    reservoir = []
+    seen = 0
+    for record in records:
+        thiswindow = (record.POS - 1) // windowsize
+        if thiswindow != window:
+            for i, picked in sorted(reservoir, key = lambda x: x[0]):
+                yield picked
+            window = thiswindow
+            reservoir = []
+            seen = 0
+        if seen < k:
+            reservoir.append((seen, record))
+        else:
+            j = rng.randrange(seen + 1)
+            if j < k:
+                reservoir[j] = (seen, record)
+        seen += 1
+    for i, picked in sorted(reservoir, key = lambda x: x[0]):
+        yield picked
+
+def snpsample2vcf(vcfinput, windowsize, chrom, outfilename, k = None, total = None, bgzip = False, seed = 42):
+    '''Writes a random sample of k records per window of chrom to outfilename + 'sampled.vcf'
+    (+ '.gz', tabix-indexed, if bgzip). k defaults to the chromosome's entry in snpcounts,
+    or is worked out from total if given.
+    '''
+    rng = random.Random(seed)
+    vcfin = openvcf(vcfinput) # see vcfreader.py
+    if k is None:
+        k = persnpcount(vcfin, chrom, windowsize, total) if total else snpcounts[chrom]
+    outname = outfilename + 'sampled.vcf'
+    if bgzip:
+        outname += '.gz'
+        outvcf = openbgzip(outname)
+    else:
+        outvcf = open(outname, 'w')
+    with outvcf:
+        writer = vcfin.writer(outvcf)
+        for record in tqdm(reservoirsampler(vcfin.fetch(chrom = chrom), windowsize, k, rng)):
+            writer.write_record(record)
+    if bgzip:
+        tabixindex(outname)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Randomly sample SNPs from windows along a chromosome into a new VCF.',
+                                    usage = 'snpsample2vcf.py [vcf (.gz)] [windowsize] [chrom] [outfile] [options]')
+    parser.add_argument('vcfinput', type = str, help = 'Input VCF (.gz, tabix-indexed)')
+    parser.add_argument('windowsize', type = int, help = 'Window size in bp')
+    parser.add_argument('chrom', type = str, help = 'Chromosome to sample from')
+    parser.add_argument('outfile', type = str, help = 'Output prefix - writes [outfile]sampled.vcf')
+    count = parser.add_mutually_exclusive_group()
+    count.add_argument('-k', '--persnp', required = False,
+                       type = int, help = 'SNPs to pick per window. Optional - defaults to snpcounts')
+    count.add_argument('-n', '--total', required = False,
+                       type = int, help = 'Approximate total SNPs to pick from the chromosome')
+    parser.add_argument('-b', '--bgzip', required = False, action = 'store_true',
+                       help = 'Write bgzipped + tabix-indexed output (needs pysam)')
+    parser.add_argument('-s', '--seed', required = False, default = 42,
+                       type = int, help = 'Random seed [default 42]')
+    args = parser.parse_args()
+
+    snpsample2vcf(args.vcfinput, args.windowsize, args.chrom, args.outfile,
+        k = args.persnp, total = args.total, bgzip = args.bgzip, seed = args.seed)
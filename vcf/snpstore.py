@@ -0,0 +1,299 @@
+'''
+snpstore.py - compact, bit-packed storage of haploid biallelic SNPs
+
+Since our samples are haploid and the SNPs are biallelic, the calls at each site
+can be stored as two bitsets - one marking strains carrying the ALT allele,
+and one marking strains with a usable (present + GQ-filtered) call. A PackedSites
+object holds these for a block of SNPs (usually a whole chromosome) as packed
+uint8 rows alongside positions, alleles and GQ values, which takes a few bytes per
+site instead of a full pyVCF _Record. Stores can be saved to and loaded from .npz
+files (see snpcache.py), and single sites handed out as CachedRecords that stand
+in for pyVCF records in the popgen functions.
+
+Haplotype counts for a pair of sites then come from ANDs and popcounts, and
+LD stats from popgen.ldfromcounts()/countstats().
+
+usage:
+from ldcalc import snppuller
+from snpstore import PackedSites
+sites = PackedSites.fromrecords(snppuller('myfile.vcf.gz', chrom = 'chromosome_6'))
+sites.pairstats(0, 1).r2
+r2 = sites.ldblock(range(0, 100), range(100, 200))['r2']
+'''
+
+import numpy as np
+from popgen import ldfromcounts, countstats
+
+# popcounts for every possible byte
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype = np.uint8)
+
+def popcount(packed, axis = -1):
+    '''Total number of set bits along an axis of a packed uint8 array.'''
+    return _POPCOUNT[packed].sum(axis = axis, dtype = np.int64)
+
+class PackedSites(object):
+    '''A block of biallelic SNPs stored as packed alt/called bitsets.
+
+    Attributes:
+    chrom - chromosome name
+    positions - int32 array of SNP positions
+    refs, alts - arrays of single-character REF and ALT alleles
+    strains - strain names, in VCF order
+    present, altpresent - packed bitsets of strains with a (0 or 1) call, and of those
+    carrying the ALT allele, regardless of GQ
+    gq - (sites x strains) uint8 matrix of GQ values (capped at 255, 0 if missing)
+    alt, called - the same bitsets after applying the GQ filter, which are what the LD
+    kernels use. These are rebuilt by setthreshold().
+    GQ_threshold - GQ filter currently applied
+
+    All bitsets are (sites x ceil(strains/8)) uint8 arrays packed with bitorder = 'little',
+    so that bit i of a row is strain i (same as popgen.sitebits()).
+    '''
+    def __init__(self, chrom, positions, refs, alts, present, altpresent, gq, strains, GQ_threshold = 30):
+        self.chrom = chrom
+        self.positions = np.asarray(positions, dtype = np.int32)
+        self.refs = np.asarray(refs, dtype = 'S1')
+        self.alts = np.asarray(alts, dtype = 'S1')
+        self.present = present
+        self.altpresent = altpresent
+        self.gq = gq
+        self.strains = list(strains)
+        self.setthreshold(GQ_threshold)
+
+    def setthreshold(self, GQ_threshold):
+        '''Rebuilds the called/alt bitsets for a new GQ threshold.'''
+        passing = np.packbits(self.gq >= GQ_threshold, axis = 1, bitorder = 'little')
+        self.called = self.present & passing
+        self.alt = self.altpresent & passing
+        self.GQ_threshold = GQ_threshold
+
+    @classmethod
+    def fromrecords(cls, records, GQ_threshold = 30):
+        '''Builds a store from an iterable of pyVCF records (eg snppuller output).
+        Records should all be on the same chromosome.
+        '''
+        records = list(records)
+        numstrains = len(records[0].samples) if records else 0
+        present = np.zeros((len(records), numstrains), dtype = bool)
+        altpresent = np.zeros((len(records), numstrains), dtype = bool)
+        gq = np.zeros((len(records), numstrains), dtype = np.uint8)
+        for i, record in enumerate(records):
+            for j, call in enumerate(record.samples):
+                gt = call['GT']
+                if gt != '0' and gt != '1':
+                    continue
+                present[i, j] = True
+                altpresent[i, j] = gt == '1'
+                if call['GQ'] is not None:
+                    gq[i, j] = min(call['GQ'], 255)
+        if records:
+            chrom = records[0].CHROM
+            strains = [call.sample for call in records[0].samples]
+        else:
+            chrom = None
+            strains = []
+        return cls(chrom, [r.POS for r in records], [r.REF for r in records], [str(r.ALT[0]) for r in records],
+            np.packbits(present, axis = 1, bitorder = 'little'), np.packbits(altpresent, axis = 1, bitorder = 'little'),
+            gq, strains, GQ_threshold)
+
+    @classmethod
+    def fromarrays(cls, chrom, arrays, strains, GQ_threshold = 30):
+        '''Builds a store from bulk genotype arrays (see vcfreader.openvcf().genoarrays()) -
+        positions, REF/ALT lists and (sites x strains) gt and gq matrices.
+        '''
+        gt, gq = arrays['gt'], arrays['gq']
+        return cls(chrom, arrays['pos'], arrays['ref'], arrays['alt'],
+            np.packbits(gt >= 0, axis = 1, bitorder = 'little'), np.packbits(gt == 1, axis = 1, bitorder = 'little'),
+            np.clip(np.where(gt >= 0, gq, 0), 0, 255).astype(np.uint8), strains, GQ_threshold)
+
+    def save(self, filename):
+        '''Writes the store to a compressed .npz file (see load()).'''
+        np.savez_compressed(filename, chrom = np.array(self.chrom if self.chrom else ''),
+            positions = self.positions, refs = self.refs, alts = self.alts, present = self.present,
+            altpresent = self.altpresent, gq = self.gq, strains = np.array(self.strains))
+
+    @classmethod
+    def load(cls, filename, GQ_threshold = 30):
+        '''Reads a store written by save(), applying the given GQ threshold.'''
+        with np.load(filename) as f:
+            chrom = str(f['chrom']) or None
+            return cls(chrom, f['positions'], f['refs'], f['alts'], f['present'], f['altpresent'],
+                f['gq'], [str(s) for s in f['strains']], GQ_threshold)
+
+    def record(self, i):
+        '''Returns a CachedRecord for row i, which can stand in for a pyVCF record.'''
+        return CachedRecord(self, i)
+
+    def records(self, start = None, end = None):
+        '''Generator of CachedRecords for SNPs with start <= pos <= end.'''
+        rows = self.region(start, end)
+        for i in range(rows.start, rows.stop):
+            yield CachedRecord(self, i)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def index(self, pos):
+        '''Returns the row of the SNP at pos, or None if there isn't one.'''
+        i = int(np.searchsorted(self.positions, pos))
+        if i < len(self.positions) and self.positions[i] == pos:
+            return i
+        return None
+
+    def region(self, start = None, end = None):
+        '''Returns a slice covering SNPs with start <= pos <= end.'''
+        lo = 0 if start is None else int(np.searchsorted(self.positions, start, side = 'left'))
+        hi = len(self.positions) if end is None else int(np.searchsorted(self.positions, end, side = 'right'))
+        return slice(lo, hi)
+
+    def hapcounts(self, idx1, idx2, other = None):
+        '''Haplotype counts for explicit pairs of rows - idx1[i] in this store against
+        idx2[i] in other (default this store). Returns AB, Ab, aB and ab as int64 arrays.
+        '''
+        other = self if other is None else other
+        idx1 = np.asarray(idx1, dtype = np.intp)
+        idx2 = np.asarray(idx2, dtype = np.intp)
+        alt1, called1 = self.alt[idx1], self.called[idx1]
+        alt2, called2 = other.alt[idx2], other.called[idx2]
+        return _countsfrombits(alt1, called1, alt2, called2)
+
+    def blockcounts(self, rows1, rows2, other = None):
+        '''Haplotype counts for every pair between rows1 of this store and rows2 of
+        other (default this store). Returns AB, Ab, aB and ab as (len(rows1) x len(rows2))
+        int64 matrices. Keep blocks modest - this broadcasts over all pairs at once.
+        '''
+        other = self if other is None else other
+        alt1, called1 = self.alt[rows1][:, None, :], self.called[rows1][:, None, :]
+        alt2, called2 = other.alt[rows2][None, :, :], other.called[rows2][None, :, :]
+        return _countsfrombits(alt1, called1, alt2, called2)
+
+    def unpacked(self, rows, dtype = np.float32):
+        '''Returns (called, alt) as dense (len(rows) x strains) 0/1 matrices of dtype.'''
+        n = len(self.strains)
+        called = np.unpackbits(self.called[rows], axis = 1, count = n, bitorder = 'little').astype(dtype)
+        alt = np.unpackbits(self.alt[rows], axis = 1, count = n, bitorder = 'little').astype(dtype)
+        return called, alt
+
+    def matmulcounts(self, rows1, rows2, other = None):
+        '''Same as blockcounts(), but the four popcounts are computed as matrix products
+        of the unpacked 0/1 matrices (ie called1 @ called2.T counts strains called at both
+        sites of each pair), which is much faster for large blocks. Products are done in
+        float32, which is exact for counts below 2**24 strains.
+        '''
+        other = self if other is None else other
+        called1, alt1 = self.unpacked(rows1)
+        called2, alt2 = other.unpacked(rows2)
+        both, altalt, alt_first, alt_second = (np.rint(m).astype(np.int64) for m in
+            (called1 @ called2.T, alt1 @ alt2.T, alt1 @ called2.T, called1 @ alt2.T))
+        return both - alt_first - alt_second + altalt, alt_second - altalt, alt_first - altalt, altalt
+
+    def tripletally(self, idx1, idx2, idx3):
+        '''Tallies the 8 three-locus haplotypes for triples of rows (idx1[i], idx2[i], idx3[i])
+        among strains with a call at all three sites, without a GQ filter (same as
+        popgen.tripletally()). Returns an (n x 8) int64 array in popgen.TRIPLEHAPS order.
+        '''
+        rows = [np.asarray(idx, dtype = np.intp) for idx in (idx1, idx2, idx3)]
+        called = self.present[rows[0]] & self.present[rows[1]] & self.present[rows[2]]
+        sites = [(called & ~self.altpresent[r], called & self.altpresent[r]) for r in rows] # (ref, alt)
+        return np.stack([popcount(x1 & x2 & x3) for x1 in sites[0] for x2 in sites[1] for x3 in sites[2]], axis = -1)
+
+    def pairstats(self, i, j, stats = ('d', 'dprime', 'r2'), other = None):
+        '''Returns a PairStats tuple (see popgen.pairstats()) for row i against row j of
+        other (default this store).
+        '''
+        counts = self.hapcounts([i], [j], other)
+        return countstats(*(int(c[0]) for c in counts), stats = stats)
+
+    def ldpairs(self, idx1, idx2, stats = ('d', 'dprime', 'r2'), other = None):
+        '''Vectorized LD stats for explicit pairs of rows. Returns a dict of arrays.'''
+        return ldfromcounts(*self.hapcounts(idx1, idx2, other), stats = stats)
+
+    def ldblock(self, rows1, rows2, stats = ('d', 'dprime', 'r2'), other = None):
+        '''Vectorized LD stats for every pair between two blocks of rows. Returns a dict
+        of (len(rows1) x len(rows2)) matrices.
+        '''
+        rows1 = np.asarray(rows1, dtype = np.intp)
+        rows2 = np.asarray(rows2, dtype = np.intp)
+        return ldfromcounts(*self.blockcounts(rows1, rows2, other), stats = stats)
+
+class _CachedCall(object):
+    '''Minimal stand-in for a pyVCF _Call - supports call.sample, call['GT'] and call['GQ'].'''
+    __slots__ = ('sample', 'data')
+
+    def __init__(self, sample, gt, gq):
+        self.sample = sample
+        self.data = {'GT': gt, 'GQ': gq}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+class CachedRecord(object):
+    '''A single SNP from a PackedSites store, exposing the parts of the pyVCF _Record
+    interface used in popgen.py and ldcalc.py (CHROM, POS, REF, ALT, alleles, samples,
+    genotype()). popgen.sitebits() reads its bitsets directly via bits().
+    '''
+    __slots__ = ('store', 'row', 'CHROM', 'POS', 'REF', 'ALT', '_samples')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+        self.CHROM = store.chrom
+        self.POS = int(store.positions[row])
+        self.REF = store.refs[row].decode()
+        self.ALT = [store.alts[row].decode()]
+        self._samples = None
+
+    def __repr__(self):
+        return 'CachedRecord(CHROM={0}, POS={1}, REF={2}, ALT={3})'.format(self.CHROM, self.POS, self.REF, self.ALT)
+
+    @property
+    def alleles(self):
+        return [self.REF] + self.ALT
+
+    @property
+    def is_snp(self):
+        return True
+
+    def bits(self, GQ_threshold = 30):
+        '''Returns (alt, called) bitsets as Python ints - see popgen.sitebits().'''
+        store = self.store
+        if GQ_threshold is None:
+            alt, called = store.altpresent[self.row], store.present[self.row]
+        elif GQ_threshold == store.GQ_threshold:
+            alt, called = store.alt[self.row], store.called[self.row]
+        else:
+            passing = np.packbits(store.gq[self.row] >= GQ_threshold, bitorder = 'little')
+            alt, called = store.altpresent[self.row] & passing, store.present[self.row] & passing
+        return int.from_bytes(alt.tobytes(), 'little'), int.from_bytes(called.tobytes(), 'little')
+
+    @property
+    def samples(self):
+        if self._samples is None:
+            self._samples = self._makesamples()
+        return self._samples
+
+    def _makesamples(self):
+        store = self.store
+        present = np.unpackbits(store.present[self.row], bitorder = 'little')
+        altpresent = np.unpackbits(store.altpresent[self.row], bitorder = 'little')
+        out = []
+        for j, strain in enumerate(store.strains):
+            if present[j]:
+                out.append(_CachedCall(strain, '1' if altpresent[j] else '0', int(store.gq[self.row, j])))
+            else:
+                out.append(_CachedCall(strain, '.', None))
+        return out
+
+    def genotype(self, name):
+        return self.samples[self.store.strains.index(name)]
+
+def _countsfrombits(alt1, called1, alt2, called2):
+    '''Helper function - AB, Ab, aB, ab counts from (broadcastable) packed bitsets.
+    Alt bits are a subset of called bits at each site, so the four counts follow from
+    four popcounts (same identities as popgen.bitcounts()).
+    '''
+    both = popcount(called1 & called2)
+    altalt = popcount(alt1 & alt2)
+    alt_first = popcount(alt1 & called2)
+    alt_second = popcount(called1 & alt2)
+    return both - alt_first - alt_second + altalt, alt_second - altalt, alt_first - altalt, altalt
@@ -0,0 +1,123 @@
+'''
+tripleldcalc.py - three-locus LD (Dabc, as in Weir's Genetic Data Analysis) between every
+triple of SNPs within a sliding window
+
+Uses functions defined in popgen.py, ldcalc.py and snpstore.py
+
+Each chromosome is read in once and bit-packed (see snpstore.PackedSites). The SNPs are
+split into blocks of first SNPs, which are spread over a pool of worker processes. For each
+block, pairwise D is computed once for every pair within the window and kept in a banded
+array, so every triple (SNP1 < SNP2 < SNP3, with pos3 - pos1 <= windowsize) reuses the D
+values of its three pairs, and the 8 haplotypes of each triple are tallied in a single
+pass over the bitsets. Output comes out in order of SNP1, then SNP2, then SNP3.
+
+As with popgen.triple_dcalc(), the haplotype tally uses every strain with a call at all
+three sites, while the pairwise D values use the usual GQ filter.
+
+usage: python tripleldcalc.py -v [vcf (.gz)] -w [windowsize] -p [processes] > [outfile]
+
+add -c [chromosome(s)] to only scan some chromosomes
+'''
+
+import sys
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from tqdm import tqdm
+from popgen import *
+from ldcalc import *
+
+# set in each worker by _init_worker
+_sites = None
+_windowsize = None
+
+def _init_worker(sites, windowsize):
+    '''Pool initializer - stores the packed sites + window as globals in each worker.'''
+    global _sites, _windowsize
+    _sites = sites
+    _windowsize = windowsize
+
+def tripleblock(block):
+    '''Worker function - computes Dabc for every triple within the window whose first
+    SNP is in rows b0 to b1. Returns the output text for the block.
+    '''
+    b0, b1 = block
+    positions = _sites.positions.astype(np.int64)
+    # one past the last SNP within the window of each SNP
+    ends = np.searchsorted(positions, positions + _windowsize, side = 'right')
+    last = int(ends[b1 - 1]) # SNPs b0 - last are the only ones involved
+    maxoffset = int((ends[b0:last] - np.arange(b0, last)).max()) - 1 if last > b0 else 0
+    if maxoffset < 2: # no triples
+        return ''
+
+    # banded pairwise D - dband[r - b0, o] is D between rows r and r + o
+    rows = np.repeat(np.arange(b0, last), maxoffset)
+    offsets = np.tile(np.arange(1, maxoffset + 1), last - b0)
+    valid = (rows + offsets < ends[rows])
+    dband = np.zeros((last - b0, maxoffset + 1))
+    dband[rows[valid] - b0, offsets[valid]] = _sites.ldpairs(rows[valid], rows[valid] + offsets[valid], stats = ['d'])['d']
+
+    idx1, idx2, idx3 = [], [], []
+    for i in range(b0, b1):
+        m = int(ends[i]) - i - 1 # SNPs after i within the window
+        if m < 2:
+            continue
+        j, k = np.triu_indices(m, 1)
+        idx1.append(np.full(len(j), i))
+        idx2.append(i + 1 + j)
+        idx3.append(i + 1 + k)
+    if not idx1:
+        return ''
+    idx1, idx2, idx3 = np.concatenate(idx1), np.concatenate(idx2), np.concatenate(idx3)
+
+    counts = _sites.tripletally(idx1, idx2, idx3)
+    d23 = dband[idx2 - b0, idx3 - idx2]
+    d13 = dband[idx1 - b0, idx3 - idx1]
+    d12 = dband[idx1 - b0, idx2 - idx1]
+    dabc = tripledfromcounts(counts, d23, d13, d12)
+
+    chrom = _sites.chrom
+    pos = _sites.positions
+    return ''.join(chrom + ' ' + str(p1) + ' ' + str(p2) + ' ' + str(p3) + ' ' + str(v) + '\n'
+        for p1, p2, p3, v in zip(pos[idx1].tolist(), pos[idx2].tolist(), pos[idx3].tolist(), dabc.tolist()))
+
+def tripleldcalc(vcf_file, windowsize, chroms = None, num_processes = 1, blocksize = 256):
+    '''
+    Calculates three-locus D for every triple of SNPs within windowsize bp of each other,
+    on each chromosome in chroms (default all chromosomes), and prints it in a space
+    separated format (chrom pos1 pos2 pos3 dabc).
+
+    num_processes will set how many processes Python will use, and blocksize the number
+    of first SNPs handled per task.
+    '''
+    if chroms:
+        allsites = [sitestore(vcf_file, chrom) for chrom in chroms]
+    else:
+        allsites = chromstores(vcf_file)
+    print('chrom', 'pos1', 'pos2', 'pos3', 'dabc')
+    for sites in allsites:
+        blocks = [(b0, min(b0 + blocksize, len(sites))) for b0 in range(0, len(sites), blocksize)]
+        with Pool(processes = num_processes, initializer = _init_worker,
+                initargs = (sites, windowsize)) as pool:
+            for text in tqdm(pool.imap(tripleblock, blocks), total = len(blocks)):
+                sys.stdout.write(text)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Calculate three-locus LD between all SNP triples within a window.',
+                                    usage = 'tripleldcalc.py [options]')
+
+    parser.add_argument('-v', '--vcfinput', required = True,
+                       type = str, help = 'Input VCF')
+    parser.add_argument('-w', '--windowsize', required = True,
+                       type = int, help = 'Maximum distance between the first and last SNP of a triple')
+    parser.add_argument('-c', '--chroms', required = False,
+                       type = str, nargs = '+', help = 'Chromosome(s) to scan. Optional - defaults to all.')
+    parser.add_argument('-p', '--processes', required = False, default = 1,
+                       type = int, help = 'Number of processes to use [default 1]')
+    parser.add_argument('-s', '--blocksize', required = False, default = 256,
+                       type = int, help = 'Number of first SNPs per task [default 256]')
+
+    args = parser.parse_args()
+
+    tripleldcalc(args.vcfinput, args.windowsize, chroms = args.chroms,
+        num_processes = args.processes, blocksize = args.blocksize)
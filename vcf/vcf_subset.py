@@ -1,10 +1,26 @@
 #!usr/bin/env python3.5
 
 '''
-Given a tabix-indexed vcf, start/end coordinates, and an outfile name, writes a new vcf 
-containing that snippet. Can also be provided with a filter value in the form of a 
-proportion (float, 0 < x < 1) or a number of sites to keep. Filtering uses the random
-module and is less exact for smaller numbers of records. 
+Given a tabix-indexed vcf, a set of regions, and an outfile name, writes a new vcf
+containing those snippets. Can also be provided with a filter value in the form of a
+proportion (float, 0 < x < 1) or an exact number of sites to keep, picked at random
+from across all the regions.
+
+Regions can be given as:
+-c chromosome(s) - whole chromosomes, or with -p start-end (1-based, inclusive), the same
+positions on each
+-r region(s) - in the form chrom:start-end (1-based, inclusive) or just chrom
+-b a BED file (chrom, start, end - 0-based, end exclusive)
+and with none of these, the entire vcf is used. Regions are sorted and merged, and
+read over a single reader, so that the output is one sorted vcf with a single header.
+
+Records are passed through as raw text lines, without being parsed. If the outfile
+name ends in .gz, the output is bgzipped and tabix-indexed (needs pysam). Without pysam (or
+a tabix index), each region is read by scanning through the whole vcf.
+
+For -n, the records in the regions are counted first (--sampling count, the default),
+then the chosen records picked out on a second pass - or with --sampling reservoir, a
+single pass keeps a reservoir of n records in memory.
 
 usage:
 python3.5 vcf_subset.py -v <input vcf> -c <chromosome> -p <start-end> -o <outname>
@@ -12,128 +28,180 @@ python3.5 vcf_subset.py -v <input vcf> -c <chromosome> -p <start-end> -o <outnam
 e.g.
 python3.5 vcf_subset.py -v genome.vcf -c chromosome_6 -p 280000-290000 -f 0.5 -o snippet.vcf
 
-will write 0.5 of the records from position 280000 to 290000 to a new file called snippet.vcf.
+will write 0.5 of the records from position 280000 to 290000 (inclusive) to a new file called snippet.vcf.
+
+python3.5 vcf_subset.py -v genome.vcf.gz -b regions.bed -n 10000 -o snippet.vcf.gz
+
+will write 10000 records picked at random from the regions in regions.bed to a bgzipped,
+tabix-indexed file called snippet.vcf.gz.
 
 AH - 05/2017
 
 '''
 
-import sys
-import vcf
 import random
 import argparse
 from tqdm import tqdm
-
-parser = argparse.ArgumentParser(description = 'Subset and/or filter a vcf file.', 
-                                usage = 'vcf_subset.py [options]')
-
-parser.add_argument('-v', '--vcfinput', required = True,
-                   type = str, help = 'Input VCF')
-parser.add_argument('-c', '--chrom', required = False,
-                   type = str, nargs = '+', help = 'Chromosome name(s) (as they appears in the vcf). Optional')
-parser.add_argument('-p', '--positions', required = False,
-                   type = str, help = 'Positions, in the format "start-end" (ie 100-200). Optional.')
-parser.add_argument('-f', '--filter_fraction', required = False,
-                   type = float, help = 'Fraction of sites to keep. Optional. Cannot be used with -n')
-parser.add_argument('-n', '--filter_num', required = False,
-                   type = int, help = 'Number of sites to keep. Optional. Cannot be used with -f. Only works if chrom(s) provided.')
-parser.add_argument('-o', '--out', required = True,
-                   type = str, help = 'Name of desired output file')
-
-# define args
-args = parser.parse_args()
-vcfin = args.vcfinput
-chrom = args.chrom
-pos = args.positions
-filt_frac = args.filter_fraction
-filt_num = args.filter_num
-outfile = args.out
-    
-# load in file    
-file = vcf.Reader(filename = vcfin, compressed = True)
-
-# assert both not present
-if filt_frac and filt_num:
-    print('Error - both filter fraction and filter-to-number args provided.')
-    print('Please provide only one of the two args.')
-    sys.exit(1)
-
-# initial subset
-if pos:
-    pos = pos.split('-')
-    start = int(pos[0])
-    end = int(pos[1])
-    snippet = file.fetch(chrom = chrom, start = start, end = end) 
-elif chrom and not pos and len(chrom) == 1: # single chrom provided
-    snippet = file.fetch(chrom = chrom[0])
-elif chrom and not pos and len(chrom) > 1: # multiple chroms provided
-    snippet = []
-    for c in chrom:
-        file = vcf.Reader(filename = vcfin, compressed = True) # since the generator resets each time
-        snippet.append(file.fetch(chrom = c))
-elif not chrom and not pos: # no chrom or pos provided - just filtering
-    snippet = file
-
-# filter and write
-### given a fraction
-if filt_frac: # given fraction between 0 and 1
-    assert not filt_num
-    with open(outfile, 'a') as out:
-        if len(chrom) == 1:
-            writer = vcf.Writer(out, snippet)
-            for record in tqdm(snippet):
-                if random.random() <= filt_frac: # filtering
-                    writer.write_record(record)
-        elif len(chrom) > 1:
-            for region in snippet: # write and filter each region independently
-                writer = vcf.Writer(out, region)
-                for record in tqdm(region):
-                    if random.random() <= filt_frac:
-                        writer.write_record(record)
-        elif not chrom:
-            writer = vcf.Writer(out, snippet)
-            for record in tqdm(snippet):
-                if random.random() <= filt_frac:
-                    writer.write_record(record)
-
-### given a number                
-elif filt_num and len(chrom) == 1: # given number of sites to keep - one region
-    assert not filt_frac
-    if pos:
-        totalrecs = end - start # length of specified snippet
-    elif not pos:
-        totalrecs = snippet.contigs[chrom][1] # get length of entire chrom from metadata
-    frac_from_num = filt_num/totalrecs # get filter fraction
-    with open(outfile, 'w') as out:
-        writer = vcf.Writer(out, snippet)
-        for record in tqdm(snippet):
-            if random.random() <= frac_from_num:
-                writer.write_record(record)
-
-elif filt_num and len(chrom) > 1: # multiple regions
-    assert not filt_frac
-    for region in snippet:
-        totalrecs = snippet.contigs[region][1] # get length of current region
-        frac_from_num  = filt_num/totalrecs # filter fraction
-        with open(outfile, 'a') as out:
-            writer = vcf.Writer(out, region)
-            for record in tqdm(region):
-                if random.random() <= frac_from_num:
-                    writer.write_record(record)
-
-
-# no filtering - just write                
-elif not filt_frac and not filt_num:
-    if len(chrom) == 1:
-        with open(outfile, 'w') as out:
-            writer = vcf.Writer(out, snippet)
-            for record in tqdm(snippet):
-                writer.write_record(record) 
-    elif len(chrom) > 1:
-        for region in snippet:
-            with open(outfile, 'a') as out:
-                writer = vcf.Writer(out, region)
-                for record in tqdm(region):
-                    writer.write_record(record)
-
-print('VCF written to', outfile)         
+from vcfreader import openvcf, openbgzip, tabixindex
+
+def parsepositions(positions):
+    '''Parses start-end (1-based, inclusive) into (start, end) - start 0-based, end
+    inclusive, same as fetch().'''
+    start, end = positions.replace(',', '').split('-')
+    return (int(start) - 1, int(end))
+
+def parseregion(region):
+    '''Parses chrom:start-end (1-based, inclusive) or chrom into a
+    (chrom, start, end) region (start 0-based, end inclusive - same as fetch()).'''
+    if ':' not in region:
+        return (region, None, None)
+    chrom, positions = region.rsplit(':', 1)
+    return (chrom,) + parsepositions(positions)
+
+def bedregions(bedfile):
+    '''Returns the regions in a BED file as (chrom, start, end). BED coordinates (0-based,
+    end exclusive) are the same as fetch()'s.'''
+    regions = []
+    with open(bedfile) as f:
+        for line in f:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.split()
+            regions.append((fields[0], int(fields[1]), int(fields[2])))
+    return regions
+
+def mergeregions(regions, contigorder):
+    '''Sorts regions by chromosome (in the order of contigorder, then the order given)
+    and start, and merges any that overlap, so that no record is fetched twice.'''
+    order = {chrom: i for i, chrom in enumerate(contigorder)}
+    for chrom, start, end in regions:
+        order.setdefault(chrom, len(order))
+    merged = []
+    for chrom, start, end in sorted(regions, key = lambda r: (order[r[0]], r[1] or 0)):
+        if merged and merged[-1][0] == chrom:
+            lastchrom, laststart, lastend = merged[-1]
+            if lastend is None or start is None or start <= lastend:
+                if lastend is not None and end is not None:
+                    end = max(end, lastend)
+                else:
+                    end = None
+                merged[-1] = (chrom, laststart if start is not None else None, end)
+                continue
+        merged.append((chrom, start, end))
+    return merged
+
+def regionlines(reader, regions):
+    '''Yields the raw record lines in each region in turn.'''
+    if not regions: # entire file
+        yield from reader.rawfetch()
+        return
+    for chrom, start, end in regions:
+        yield from reader.rawfetch(chrom = chrom, start = start, end = end)
+
+def countsample(reader, regions, num, rng = random):
+    '''Yields num lines picked at random from the regions (or all of them, if there are
+    fewer), in order, using a first pass to count them.'''
+    total = sum(1 for line in tqdm(regionlines(reader, regions)))
+    keep = set(rng.sample(range(total), min(num, total)))
+    for i, line in enumerate(regionlines(reader, regions)):
+        if i in keep:
+            yield line
+
+def reservoirsample(reader, regions, num, rng = random):
+    '''Yields num lines picked at random from the regions (or all of them, if there are
+    fewer), in order, from a single pass with a reservoir of num lines.'''
+    reservoir = []
+    for i, line in enumerate(regionlines(reader, regions)):
+        if i < num:
+            reservoir.append((i, line))
+        else:
+            j = rng.randrange(i + 1)
+            if j < num:
+                reservoir[j] = (i, line)
+    for i, line in sorted(reservoir, key = lambda x: x[0]):
+        yield line
+
+def fractionsample(reader, regions, fraction, rng = random):
+    '''Yields each line in the regions with probability fraction.'''
+    for line in regionlines(reader, regions):
+        if rng.random() <= fraction: # filtering
+            yield line
+
+def vcf_subset(vcfin, outfile, regions = None, filt_frac = None, filt_num = None,
+               sampling = 'count', seed = None):
+    '''Writes the records in regions (list of (chrom, start, end), or the entire file if
+    None) to outfile - keeping filt_frac of them, or filt_num picked at random - as a
+    bgzipped + tabix-indexed vcf if outfile ends with .gz. Returns the number of records written.
+    '''
+    rng = random.Random(seed)
+    reader = openvcf(vcfin) # pysam-backed if available (see vcfreader.py)
+    if regions:
+        regions = mergeregions(regions, list(reader.contigs))
+
+    if filt_frac:
+        lines = fractionsample(reader, regions, filt_frac, rng)
+    elif filt_num is not None:
+        sampler = countsample if sampling == 'count' else reservoirsample
+        lines = sampler(reader, regions, filt_num, rng)
+    else:
+        lines = regionlines(reader, regions)
+
+    bgzip = outfile.endswith('.gz')
+    written = 0
+    with (openbgzip(outfile) if bgzip else open(outfile, 'w')) as out:
+        out.write(reader.rawheader())
+        for line in tqdm(lines):
+            out.write(line + '\n')
+            written += 1
+    if bgzip:
+        tabixindex(outfile)
+    return written
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Subset and/or filter a vcf file.',
+                                    usage = 'vcf_subset.py [options]')
+
+    parser.add_argument('-v', '--vcfinput', required = True,
+                       type = str, help = 'Input VCF')
+    parser.add_argument('-c', '--chrom', required = False,
+                       type = str, nargs = '+', help = 'Chromosome name(s) (as they appears in the vcf). Optional')
+    parser.add_argument('-p', '--positions', required = False,
+                       type = str, help = 'Positions, in the format "start-end" (ie 100-200 - 1-based, inclusive). Optional. Needs -c')
+    parser.add_argument('-r', '--regions', required = False,
+                       type = str, nargs = '+', help = 'Region(s), in the format chrom:start-end (1-based, inclusive) or chrom. Optional')
+    parser.add_argument('-b', '--bed', required = False,
+                       type = str, help = 'BED file of regions. Optional')
+    filt = parser.add_mutually_exclusive_group()
+    filt.add_argument('-f', '--filter_fraction', required = False,
+                       type = float, help = 'Fraction of sites to keep. Optional. Cannot be used with -n')
+    filt.add_argument('-n', '--filter_num', required = False,
+                       type = int, help = 'Exact number of sites to keep. Optional. Cannot be used with -f.')
+    parser.add_argument('--sampling', required = False, default = 'count',
+                       choices = ['count', 'reservoir'], help = 'How -n picks sites - counting pass or reservoir [default count]')
+    parser.add_argument('-s', '--seed', required = False,
+                       type = int, help = 'Random seed. Optional')
+    parser.add_argument('-o', '--out', required = True,
+                       type = str, help = 'Name of desired output file (bgzipped + indexed if it ends in .gz)')
+
+    args = parser.parse_args()
+
+    if args.positions and not args.chrom:
+        parser.error('-p needs -c')
+
+    # collect regions
+    regions = []
+    if args.chrom:
+        if args.positions:
+            start, end = parsepositions(args.positions)
+            regions.extend((c, start, end) for c in args.chrom)
+        else:
+            regions.extend((c, None, None) for c in args.chrom)
+    if args.regions:
+        regions.extend(parseregion(r) for r in args.regions)
+    if args.bed:
+        regions.extend(bedregions(args.bed))
+
+    vcf_subset(args.vcfinput, args.out, regions = regions, filt_frac = args.filter_fraction,
+        filt_num = args.filter_num, sampling = args.sampling, seed = args.seed)
+
+    print('VCF written to', args.out)
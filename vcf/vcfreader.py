@@ -0,0 +1,355 @@
+'''
+vcfreader.py - pluggable VCF reader layer for the vcf/ tools
+
+pyVCF builds a Python object for every sample of every record as it parses, which is
+slow and memory heavy for large callsets. openvcf() returns a reader with a common
+interface on top of one of two backends:
+
+pysam - pysam.VariantFile (htslib). Records are wrapped in PysamRecord objects that
+only decode INFO and sample fields when they're asked for.
+pyvcf - the original vcf.Reader, kept as a fallback when pysam isn't installed.
+
+pysam is used if it can be imported - set the VCFREADER environment variable to 'pyvcf'
+(or pass backend = 'pyvcf') to force the fallback.
+
+Records from either backend expose the parts of the pyVCF _Record interface used in
+these scripts (CHROM, POS, REF, ALT, alleles, INFO, is_snp, samples, genotype()), and
+readers can write records back out with writer(). For bulk work, genoarrays() returns
+positions plus (sites x samples) genotype and GQ matrices directly, without building
+per-sample objects.
+
+See vcfreader_bench.py for a parse time comparison of the two backends.
+
+usage:
+from vcfreader import openvcf
+reader = openvcf('myfile.vcf.gz')
+for record in reader.fetch('chromosome_6', 0, 100000):
+    print(record.POS, record.samples[0]['GT'])
+arrays = reader.genoarrays('chromosome_6') # pos, ref, alt, gt, gq
+
+For passing records through untouched, rawheader() and rawfetch() give the header and
+record lines as text, without parsing them.
+
+openbgzip() and tabixindex() write bgzipped, tabix-indexed output (pysam only).
+'''
+
+import io
+import os
+import gzip
+import numpy as np
+import vcf
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+BACKENDS = ['pysam', 'pyvcf']
+
+def openvcf(filename, backend = None):
+    '''Returns a reader for a VCF (tabix-indexed if fetch() is to be used), using the
+    given backend - by default pysam if available, else pyVCF.
+    '''
+    backend = backend or os.environ.get('VCFREADER') or ('pysam' if pysam else 'pyvcf')
+    if backend == 'pysam':
+        if pysam is None:
+            raise ImportError('pysam backend requested but pysam is not installed')
+        return PysamReader(filename)
+    elif backend == 'pyvcf':
+        return PyVCFReader(filename)
+    raise ValueError('unknown VCF reader backend {0} - must be one of {1}'.format(backend, BACKENDS))
+
+def openbgzip(filename):
+    '''Opens filename for writing bgzip-compressed text - pass to reader.writer(), then
+    call tabixindex(filename) once closed.
+    '''
+    if pysam is None:
+        raise ImportError('bgzip output requires pysam')
+    from pysam.libcbgzf import BGZFile
+    return io.TextIOWrapper(BGZFile(filename, 'wb'))
+
+def tabixindex(filename):
+    '''Builds a tabix index (filename.tbi) for a bgzipped VCF.'''
+    if pysam is None:
+        raise ImportError('tabix indexing requires pysam')
+    pysam.tabix_index(filename, preset = 'vcf', force = True)
+
+def _textlines(filename):
+    '''Helper function - lines of a plain or (b)gzipped text file.'''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename)
+
+def _tabixlines(filename, chrom = None, start = None, end = None):
+    '''Helper function - record lines in a region straight from the tabix index (see rawfetch()).'''
+    tabixfile = pysam.TabixFile(filename) # own handle per iterator
+    if chrom is None:
+        return tabixfile.fetch()
+    if chrom not in tabixfile.contigs: # no records
+        return iter([])
+    return tabixfile.fetch(chrom, start, end)
+
+def _gtcode(gt):
+    '''Helper function - haploid GT string to 0 (ref), 1 (alt) or -1 (anything else).'''
+    if gt == '0':
+        return 0
+    elif gt == '1':
+        return 1
+    return -1
+
+class PyVCFReader(object):
+    '''Reader backed by pyVCF. Records are plain pyVCF _Records.'''
+    backend = 'pyvcf'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._reader = self._open()
+        self.samples = list(self._reader.samples)
+        # name: (name, length), so that contigs[chrom][1] works as with pyVCF
+        self.contigs = {name: (name, contig.length) for name, contig in self._reader.contigs.items()}
+
+    def _open(self):
+        return vcf.Reader(filename = self.filename, compressed = self.filename.endswith('.gz'))
+
+    def fetch(self, chrom = None, start = None, end = None):
+        '''Iterator of records in a region (start is 0-based, end inclusive - same as
+        vcf.Reader.fetch()), or the entire file if chrom is None. Each call gets its own
+        file handle, so iterators are independent. A chromosome with no records (ie one only
+        in the header) gives an empty iterator, as with PysamReader.
+        '''
+        reader = self._open()
+        # records from every fetch share one sample index, so popgen's caches (keyed on it -
+        # see popgen.sitekey()) see them as coming from the same file
+        reader._sample_indexes = self._reader._sample_indexes
+        if chrom is None:
+            return iter(reader)
+        try:
+            return reader.fetch(chrom, start, end)
+        except ValueError: # could not create iterator for region
+            if chrom in reader._tabix.contigs: # something else wrong with the region
+                raise
+            return iter([])
+
+    def __iter__(self):
+        return self.fetch()
+
+    def rawheader(self):
+        '''Header lines as text.'''
+        header = []
+        with _textlines(self.filename) as lines:
+            for line in lines:
+                if not line.startswith('#'):
+                    break
+                header.append(line)
+        return ''.join(header)
+
+    def rawfetch(self, chrom = None, start = None, end = None):
+        '''Iterator of record lines (as text, no newline) in a region - same coordinates as
+        fetch(). Uses the tabix index through pysam where there is one (as pyVCF's own
+        fetch() does) - otherwise scans through the whole file, once per call.
+        '''
+        if chrom is not None and pysam is not None and os.path.exists(self.filename + '.tbi'):
+            return _tabixlines(self.filename, chrom, start, end)
+        return self._scanlines(chrom, start, end)
+
+    def _scanlines(self, chrom = None, start = None, end = None):
+        '''Helper function - rawfetch() by reading through the file.'''
+        for line in _textlines(self.filename):
+            if line.startswith('#'):
+                continue
+            if chrom is None:
+                yield line.rstrip('\n')
+                continue
+            fields = line.split('\t', 2)
+            if fields[0] != chrom:
+                continue
+            pos = int(fields[1])
+            if (start is None or pos > start) and (end is None or pos <= end):
+                yield line.rstrip('\n')
+
+    def writer(self, out):
+        '''Returns a writer for records from this reader to the open file out
+        (with write_record(record) and close()).
+        '''
+        return vcf.Writer(out, self._reader)
+
+    def genoarrays(self, chrom = None, start = None, end = None, filter = None):
+        '''Bulk genotypes for a region - see _genoarrays().'''
+        def calls(record):
+            return [(_gtcode(call['GT']), call['GQ']) for call in record.samples]
+        return _genoarrays(self.fetch(chrom, start, end), len(self.samples), calls, filter)
+
+class PysamReader(object):
+    '''Reader backed by pysam.VariantFile. Records are PysamRecords.'''
+    backend = 'pysam'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = pysam.VariantFile(filename)
+        self.header = self._file.header
+        self.samples = list(self.header.samples)
+        self.contigs = {name: (name, contig.length) for name, contig in self.header.contigs.items()}
+        self._sampleindex = {name: i for i, name in enumerate(self.samples)}
+
+    def _records(self, chrom = None, start = None, end = None):
+        variantfile = pysam.VariantFile(self.filename) # own handle per iterator
+        if chrom is None:
+            return iter(variantfile)
+        return variantfile.fetch(chrom, start, end)
+
+    def fetch(self, chrom = None, start = None, end = None):
+        '''Iterator of records in a region (start is 0-based, end inclusive - same as
+        vcf.Reader.fetch()), or the entire file if chrom is None. Each call gets its own
+        file handle, so iterators are independent.
+        '''
+        return (PysamRecord(record, self) for record in self._records(chrom, start, end))
+
+    def __iter__(self):
+        return self.fetch()
+
+    def rawheader(self):
+        '''Header lines as text, exactly as in the file.'''
+        return ''.join(line + '\n' for line in pysam.TabixFile(self.filename).header)
+
+    def rawfetch(self, chrom = None, start = None, end = None):
+        '''Iterator of record lines (as text, no newline) in a region - same coordinates as
+        fetch(). Lines come straight from the tabix index, without being parsed.
+        '''
+        return _tabixlines(self.filename, chrom, start, end)
+
+    def writer(self, out):
+        '''Returns a writer for records from this reader to the open file out
+        (with write_record(record) and close()).
+        '''
+        return _PysamWriter(out, self.header)
+
+    def genoarrays(self, chrom = None, start = None, end = None, filter = None):
+        '''Bulk genotypes for a region - see _genoarrays(). Sample fields are split out of
+        the raw record text rather than decoded one sample at a time.
+        '''
+        def calls(record):
+            fields = str(record.raw).rstrip('\n').split('\t')
+            keys = fields[8].split(':')
+            gtindex = keys.index('GT')
+            gqindex = keys.index('GQ') if 'GQ' in keys else None
+            out = []
+            for sample in fields[9:]:
+                values = sample.split(':')
+                gq = None
+                if gqindex is not None and gqindex < len(values) and values[gqindex] not in ('.', ''):
+                    gq = int(values[gqindex])
+                out.append((_gtcode(values[gtindex]), gq))
+            return out
+        return _genoarrays(self.fetch(chrom, start, end), len(self.samples), calls, filter)
+
+class _PysamWriter(object):
+    '''Writes PysamRecords (as VCF text) to an open file, header first.'''
+    def __init__(self, out, header):
+        self.out = out
+        self.out.write(str(header))
+
+    def write_record(self, record):
+        self.out.write(str(record.raw))
+
+    def flush(self):
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+class _PysamCall(object):
+    '''Minimal stand-in for a pyVCF _Call - call.sample, call['GT'] (as a string, ie '0',
+    '1', '.' or '0/1') and call[key] for other FORMAT fields (None if missing).
+    '''
+    __slots__ = ('sample', '_data')
+
+    def __init__(self, sample, data):
+        self.sample = sample
+        self._data = data
+
+    def __getitem__(self, key):
+        if key == 'GT':
+            alleles = self._data['GT']
+            sep = '|' if self._data.phased and len(alleles) > 1 else '/'
+            return sep.join('.' if a is None else str(a) for a in alleles)
+        return self._data.get(key)
+
+class PysamRecord(object):
+    '''Wraps a pysam VariantRecord with the parts of the pyVCF _Record interface used in
+    these scripts. INFO and samples are only decoded on first use. The pysam record is
+    available as raw.
+    '''
+    def __init__(self, raw, reader):
+        self.raw = raw
+        self.reader = reader
+        self.CHROM = raw.chrom
+        self.POS = raw.pos
+        self.ID = raw.id
+        self.REF = raw.ref
+        self.ALT = list(raw.alts) if raw.alts else [None]
+        self._info = None
+        self._samples = None
+
+    def __repr__(self):
+        return 'PysamRecord(CHROM={0}, POS={1}, REF={2}, ALT={3})'.format(self.CHROM, self.POS, self.REF, self.ALT)
+
+    def __str__(self):
+        return str(self.raw)
+
+    @property
+    def alleles(self):
+        return [self.REF] + self.ALT
+
+    @property
+    def is_snp(self):
+        '''Same rules as pyVCF - single base REF and single base ALT(s).'''
+        if len(self.REF) > 1:
+            return False
+        for alt in self.ALT:
+            if alt not in ['A', 'C', 'G', 'T', 'N', '*']:
+                return False
+        return True
+
+    @property
+    def INFO(self):
+        '''INFO fields as a dict - multi-valued fields are lists, as in pyVCF.'''
+        if self._info is None:
+            self._info = {key: list(value) if isinstance(value, tuple) else value
+                for key, value in self.raw.info.items()}
+        return self._info
+
+    @property
+    def samples(self):
+        if self._samples is None:
+            self._samples = [_PysamCall(name, data) for name, data in self.raw.samples.items()]
+        return self._samples
+
+    def genotype(self, name):
+        return self.samples[self.reader._sampleindex[name]]
+
+def _genoarrays(records, numsamples, calls, filter = None):
+    '''Helper function - collects genotypes for an iterable of records into arrays.
+    calls(record) returns a list of (gt code, GQ or None) for each sample, and filter, if
+    given, is a predicate that records have to pass (eg ldcalc.snpfilter).
+
+    Returns a dict with chrom (list), pos (int32 array), ref and alt (lists of strings -
+    first ALT only), gt ((sites x samples) int8 matrix - 0 = ref, 1 = alt, -1 = missing or
+    not a haploid biallelic call) and gq ((sites x samples) int16 matrix, -1 = missing).
+    '''
+    chroms, positions, refs, alts, gts, gqs = [], [], [], [], [], []
+    for record in records:
+        if filter and not filter(record):
+            continue
+        chroms.append(record.CHROM)
+        positions.append(record.POS)
+        refs.append(record.REF)
+        alts.append(str(record.ALT[0]))
+        row = calls(record)
+        gts.append([gt for gt, gq in row])
+        gqs.append([-1 if gq is None else gq for gt, gq in row])
+    return {'chrom': chroms,
+            'pos': np.array(positions, dtype = np.int32),
+            'ref': refs,
+            'alt': alts,
+            'gt': np.array(gts, dtype = np.int8).reshape(len(positions), numsamples),
+            'gq': np.array(gqs, dtype = np.int16).reshape(len(positions), numsamples)}
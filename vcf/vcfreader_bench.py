@@ -0,0 +1,65 @@
+'''
+vcfreader_bench.py - compares parse times of the VCF reader backends (see vcfreader.py)
+
+For a chromosome (or the whole file), times:
+records - iterating over every record and reading GT + GQ for every sample, as the
+popgen functions do
+genoarrays - bulk genotype + GQ matrices via genoarrays()
+snpfilter - bulk arrays for the SNPs snppuller keeps (ie what the SNP cache compiles)
+
+for each available backend, taking the best of --repeats runs.
+
+usage: python vcfreader_bench.py -v [vcf (.gz)] -c [chromosome] -r [repeats]
+'''
+
+import time
+import argparse
+from vcfreader import openvcf, BACKENDS
+from ldcalc import snpfilter
+
+def readrecords(reader, chrom):
+    '''Reads GT and GQ for every sample of every record. Returns number of records.'''
+    count = 0
+    for record in reader.fetch(chrom):
+        for call in record.samples:
+            call['GT'], call['GQ']
+        count += 1
+    return count
+
+def timer(function, repeats):
+    '''Returns (best time in seconds, result) over repeats calls of function.'''
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def benchmark(vcf_file, chrom = None, repeats = 3):
+    print('backend', 'task', 'records', 'seconds', 'records_per_second')
+    for backend in BACKENDS:
+        try:
+            reader = openvcf(vcf_file, backend = backend)
+        except ImportError:
+            print(backend, 'unavailable')
+            continue
+        tasks = [('records', lambda: readrecords(reader, chrom)),
+                 ('genoarrays', lambda: len(reader.genoarrays(chrom)['pos'])),
+                 ('snpfilter', lambda: len(reader.genoarrays(chrom, filter = snpfilter)['pos']))]
+        for name, function in tasks:
+            seconds, count = timer(function, repeats)
+            print(backend, name, count, round(seconds, 4), round(count / seconds) if seconds else 'NA')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare parse times of the VCF reader backends.',
+                                    usage = 'vcfreader_bench.py [options]')
+    parser.add_argument('-v', '--vcfinput', required = True,
+                       type = str, help = 'Input VCF (.gz)')
+    parser.add_argument('-c', '--chrom', required = False,
+                       type = str, help = 'Chromosome to parse. Optional - defaults to the whole file.')
+    parser.add_argument('-r', '--repeats', required = False, default = 3,
+                       type = int, help = 'Number of runs per task - the best is reported [default 3]')
+    args = parser.parse_args()
+
+    benchmark(args.vcfinput, args.chrom, args.repeats)